@@ -1,3 +1,4 @@
+import argparse
 import numpy as np
 import random
 import time
@@ -5,23 +6,33 @@ import socket
 import threading
 from qunetsim.components import Host, Network
 from qunetsim.objects import Qubit, Logger
+import qkd_frame
+import bb84_batch
+from key_store import DEFAULT_PAIR
+import qkd_otp
 
 Logger.DISABLED = True
 wait_time = 2
+WINDOW_SIZE = 64 # qubits per window in the sliding-window protocol
+WINDOW_FINISH_RETRIES = 10
+shm_store = None # SharedKeyStore of key_service.py when run with --shm
 
-# ... (Encryption/Decryption functions - unchanged)
+# String wrappers around the byte-oriented helpers in qkd_otp.py
 def encrypt(key, text):
-    return ''.join([chr(ord(k) ^ ord(c)) for k, c in zip(key, text)])
+    n = min(len(key), len(text))
+    try:
+        key_bytes = key[:n].encode('latin-1')
+        text_bytes = text[:n].encode('latin-1')
+    except UnicodeEncodeError:
+        # Characters beyond one byte: keep the per-character XOR
+        return ''.join([chr(ord(k) ^ ord(c)) for k, c in zip(key, text)])
+    return qkd_otp.xor_bytes(key_bytes, text_bytes).decode('latin-1')
 
 def decrypt(key, encrypted_text):
     return encrypt(key, encrypted_text)
 
 def key_array_to_key_string(key_array):
-    key_string_binary = ''.join(str(x) for x in key_array)
-    padding_needed = 8 - (len(key_string_binary) % 8)
-    if padding_needed != 8:
-        key_string_binary += '0' * padding_needed
-    return ''.join(chr(int(key_string_binary[i:i+8], 2)) for i in range(0, len(key_string_binary), 8))
+    return qkd_otp.key_array_to_bytes(key_array).decode('latin-1')
 
 def key_array_to_key_string_full(key_array, length):
     key_chars = key_array_to_key_string(key_array)
@@ -29,7 +40,12 @@ def key_array_to_key_string_full(key_array, length):
     return (key_chars * repeat_count)[:length]
 
 def key_string_to_bitstring(key_string):
-    return ''.join(f'{ord(c):08b}' for c in key_string)
+    try:
+        key_bytes = key_string.encode('latin-1')
+    except UnicodeEncodeError:
+        # Characters beyond one byte: keep the per-character conversion
+        return ''.join(f'{ord(c):08b}' for c in key_string)
+    return qkd_otp.key_array_to_bitstring(qkd_otp.bytes_to_key_array(key_bytes))
 
 # ... (QKD Functions - unchanged)
 def alice_qkd(alice, secret_key, receiver):
@@ -107,6 +123,119 @@ def eve_qkd(eve, key_size, sender):
             time.sleep(0.05)
     return key_array
 
+def _next_classical(host, sender, timeout):
+    """Next unread classical message content from sender, or None after timeout seconds."""
+    msg = host.get_next_classical(sender, wait=max(timeout, 0))
+    if msg is None or not isinstance(msg.content, str):
+        return None
+    return msg.content
+
+def alice_qkd_windowed(alice, key_size, receiver, window=WINDOW_SIZE):
+    """
+    Sliding-window BB84 sender. Per window Alice streams `window` qubits and one
+    header W:<nr>:<qubit ids>; the receiver answers with all its bases in one
+    B:<nr>:<bases> message and Alice replies with one sift bitmap S:<nr>:<bitmap>.
+    Windows without a basis reply are abandoned, so lost or reordered messages
+    only cost that window. A final E/R/F exchange makes sure the receiver holds
+    the bitmap of every committed window.
+    """
+    sifted = {}
+    bitmaps = {}
+    n_kept = 0
+    window_nr = 0
+    while n_kept < key_size:
+        window_nr += 1
+        bits = np.random.randint(2, size=window)
+        bases = np.random.randint(2, size=window)
+        q_ids = []
+        for bit, base in zip(bits, bases):
+            q_bit = Qubit(alice)
+            if bit == 1:
+                q_bit.X()
+            if base == 1:
+                q_bit.H()
+            alice.send_qubit(receiver, q_bit, await_ack=False)
+            q_ids.append(q_bit.id)
+        alice.send_classical(receiver, f"W:{window_nr}:{','.join(q_ids)}", await_ack=False)
+
+        receiver_bases = None
+        # The receiver may spend up to wait_time waiting for lost qubits
+        deadline = time.time() + 2 * wait_time
+        while receiver_bases is None and time.time() < deadline:
+            content = _next_classical(alice, receiver, deadline - time.time())
+            # Replies for other (abandoned) windows are stale and ignored
+            if content is not None and content.startswith(f"B:{window_nr}:"):
+                receiver_bases = content.split(':', 2)[2]
+        if receiver_bases is None or len(receiver_bases) != window:
+            print(f"Alice abandoned window {window_nr} (no basis reply)")
+            continue
+
+        bitmap = ''.join('1' if rb == str(base) else '0' for rb, base in zip(receiver_bases, bases))
+        bitmaps[window_nr] = bitmap
+        sifted[window_nr] = [int(bit) for bit, m in zip(bits, bitmap) if m == '1']
+        alice.send_classical(receiver, f"S:{window_nr}:{bitmap}", await_ack=False)
+        n_kept += len(sifted[window_nr])
+        print(f"Alice window {window_nr}: kept {len(sifted[window_nr])}/{window} bits ({n_kept} total)")
+
+    windows = sorted(sifted)
+    for _ in range(WINDOW_FINISH_RETRIES):
+        alice.send_classical(receiver, f"E:{','.join(str(w) for w in windows)}", await_ack=False)
+        content = _next_classical(alice, receiver, wait_time)
+        if content is None:
+            continue
+        if content == 'F':
+            break
+        if content.startswith('R:'):
+            for w in (int(x) for x in content[2:].split(',') if x):
+                alice.send_classical(receiver, f"S:{w}:{bitmaps[w]}", await_ack=False)
+    else:
+        print("Alice got no final confirmation from the receiver")
+    return [bit for w in windows for bit in sifted[w]][:key_size]
+
+def eve_qkd_windowed(eve, key_size, sender):
+    """Receiver side of alice_qkd_windowed. Returns the receiver's sifted key."""
+    measured = {}
+    sifted = {}
+    while True:
+        content = _next_classical(eve, sender, wait_time)
+        if content is None:
+            continue
+        kind, _, rest = content.partition(':')
+        if kind == 'W':
+            nr, q_ids = rest.split(':', 1)
+            bits, bases = [], []
+            # Lost qubits share one wait_time budget per window
+            deadline = time.time() + wait_time
+            for q_id in q_ids.split(','):
+                q_bit = eve.get_qubit(sender, q_id=q_id, wait=max(deadline - time.time(), 0))
+                if q_bit is None:
+                    # Lost qubit: 'x' never matches Alice's basis
+                    bits.append(None)
+                    bases.append('x')
+                    continue
+                measurement_base = random.randint(0, 1)
+                if measurement_base == 1:
+                    q_bit.H()
+                bits.append(q_bit.measure())
+                bases.append(str(measurement_base))
+            measured[int(nr)] = bits
+            eve.send_classical(sender, f"B:{nr}:{''.join(bases)}", await_ack=False)
+        elif kind == 'S':
+            nr, bitmap = rest.split(':', 1)
+            bits = measured.pop(int(nr), None)
+            if bits is not None:
+                sifted[int(nr)] = [bit for bit, m in zip(bits, bitmap) if m == '1']
+        elif kind == 'E':
+            windows = [int(w) for w in rest.split(',') if w]
+            missing = [w for w in windows if w not in sifted]
+            if missing:
+                eve.send_classical(sender, f"R:{','.join(str(w) for w in missing)}", await_ack=False)
+                continue
+            eve.send_classical(sender, 'F', await_ack=False)
+            key = [bit for w in windows for bit in sifted[w]][:key_size]
+            print(f"Eve sifted {len(key)} bits over {len(windows)} windows")
+            return key
+
 def eve_receive_message(eve, eve_key, sender):
     payload = None
     while payload is None:
@@ -129,20 +258,66 @@ def alice_send_message(alice, secret_key, receiver):
     alice.send_classical(receiver, "-1:" + encrypted_msg_to_eve, await_ack=False)
 
 
-def _send_key_to_controller(key: str):
+def _send_key_to_controller(key: str, pair=None, binary=True):
+    """
+    Pushes a packed key string to the controller. pair=(requester, peer) targets
+    that pair's key pool; binary=False falls back to the legacy KEY:<packed> text push.
+    With --shm the key is written straight into the key service's shared store.
+    """
+    if shm_store is not None:
+        data = key.encode('latin-1')
+        depth = shm_store.put(data, len(data) * 8, pair or DEFAULT_PAIR)
+        print(f"Stored key in shared key store: {len(data) * 8} bits, pool depth {depth} bits")
+        return
     s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
     s.settimeout(10.0)
     try:
         s.connect(('127.0.0.1', 7001))
-        s.sendall(f"KEY:{key}".encode('utf-8'))
-        resp = s.recv(1024).decode('utf-8').strip()
+        if binary:
+            data = key.encode('latin-1')
+            requester, peer = pair if pair else ('', '')
+            s.sendall(qkd_frame.encode_keys([(random.getrandbits(64), data, len(data) * 8)], requester, peer))
+            frame = qkd_frame.recv_frame(s)
+            if frame is None or frame[0] != qkd_frame.MSG_ACK:
+                raise qkd_frame.FrameError("no ACK frame from controller")
+            status, n_keys, n_bits = qkd_frame.decode_ack(frame[1])
+            resp = f"ACK:{qkd_frame.STATUS_NAMES.get(status, status)}:keys={n_keys}:bits={n_bits}"
+        else:
+            if pair:
+                s.sendall(f"PAIR:{pair[0]}:{pair[1]}:KEY:{key}".encode('utf-8'))
+            else:
+                s.sendall(f"KEY:{key}".encode('utf-8'))
+            # EOF ends the push, so the controller need not wait for more segments
+            s.shutdown(socket.SHUT_WR)
+            resp = s.recv(1024).decode('utf-8').strip()
         print(f"Received acknowledgment from SDN Controller: {resp}")
     except Exception as e:
         print(f"Failed to push key to SDN Controller: {e}")
     finally:
         s.close()
 
-def main():
+def run_batch_qkd(key_size, intercept=0.0, loss=0.0):
+    """Generates the sifted key with the vectorized engine and pushes it to the controller."""
+    start = time.time()
+    result = bb84_batch.generate_sifted_key(key_size, intercept=intercept, loss=loss)
+    elapsed = time.time() - start
+    print(f"Batch BB84: {result.n_sent} qubits sent, {result.n_received} received, "
+          f"{result.n_sifted} sifted, QBER={result.qber:.4f}")
+    print(f"Batch BB84: {len(result.alice_key)} key bits in {elapsed:.3f}s "
+          f"({len(result.alice_key) / max(elapsed, 1e-9) / 1e6:.2f} Mbit/s)")
+    if key_size <= 64:
+        print(f"Alice sifted key: {result.alice_key.tolist()}")
+        print(f"Eve sifted key:   {result.receiver_key.tolist()}")
+    key_string = key_array_to_key_string(result.alice_key)
+    _send_key_to_controller(key_string)
+    return result
+
+def run_qunetsim_qkd(key_size=16, protocol='stopwait', window=WINDOW_SIZE, push=True):
+    """
+    One QuNetSim BB84 run between Alice and Eve. Returns (alice_key, eve_key) as
+    lists of bits. Network is a per-process singleton, so runs cannot overlap
+    in one process (qkd_sweep.py gives each run its own).
+    """
     network = Network.get_instance()
     nodes = ['Alice', 'Bob', 'Eve', 'SDN_Controller']
     network.delay = 0.0
@@ -170,19 +345,27 @@ def main():
     network.add_host(host_eve)
     network.add_host(host_controller)
 
-    key_size = 16
     secret_key = np.random.randint(2, size=key_size)
-    key_string = key_array_to_key_string(np.random.randint(2, size=key_size))
+    keys = {}
 
     def alice_func(alice):
-        sifted_key = alice_qkd(alice, secret_key, host_eve.host_id)
+        if protocol == 'window':
+            sifted_key = alice_qkd_windowed(alice, key_size, host_eve.host_id, window)
+        else:
+            sifted_key = alice_qkd(alice, secret_key, host_eve.host_id)
+        keys['alice'] = sifted_key
         key_string = key_array_to_key_string(sifted_key)
         print(f"Alice sifted key: {sifted_key}")
-        _send_key_to_controller(key_string)
+        if push:
+            _send_key_to_controller(key_string)
         alice_send_message(alice, sifted_key, host_eve.host_id)
 
     def eve_func(eve):
-        eve_key = eve_qkd(eve, key_size, host_alice.host_id)
+        if protocol == 'window':
+            eve_key = eve_qkd_windowed(eve, key_size, host_alice.host_id)
+        else:
+            eve_key = eve_qkd(eve, key_size, host_alice.host_id)
+        keys['eve'] = eve_key
         print(f"Eve sifted key:   {eve_key}")
         eve_receive_message(eve, eve_key, host_alice.host_id)
 
@@ -200,6 +383,44 @@ def main():
     host_eve.stop()
     host_controller.stop()
     network.stop(True)
+    return list(keys.get('alice', [])), list(keys.get('eve', []))
+
+def main(engine='qunetsim', key_size=16, intercept=0.0, loss=0.0, protocol='stopwait', window=WINDOW_SIZE):
+    if engine == 'batch':
+        run_batch_qkd(key_size, intercept, loss)
+        return
+    run_qunetsim_qkd(key_size, protocol, window)
+
+def probability(text):
+    """argparse type: a probability in [0, 1]."""
+    value = float(text)
+    if not 0.0 <= value <= 1.0:
+        raise argparse.ArgumentTypeError(f"{text} is not in [0, 1]")
+    return value
+
+def loss_probability(text):
+    """argparse type: a channel loss probability in [0, 1); with loss 1 no key is ever sifted."""
+    value = float(text)
+    if not 0.0 <= value < 1.0:
+        raise argparse.ArgumentTypeError(f"{text} is not in [0, 1)")
+    return value
 
 if __name__ == '__main__':
-    main()
\ No newline at end of file
+    parser = argparse.ArgumentParser(description='Simulate QKD and push the sifted key to the SDN controller.')
+    parser.add_argument('--engine', choices=['qunetsim', 'batch'], default='qunetsim',
+                        help='qunetsim: per-qubit QuNetSim hosts; batch: vectorized NumPy BB84')
+    parser.add_argument('--key-size', type=int, default=16, help='sifted key bits')
+    parser.add_argument('--intercept', type=probability, default=0.0,
+                        help='batch engine: intercept-resend probability of an eavesdropper')
+    parser.add_argument('--loss', type=loss_probability, default=0.0,
+                        help='batch engine: channel loss probability, below 1')
+    parser.add_argument('--protocol', choices=['stopwait', 'window'], default='stopwait',
+                        help='qunetsim engine: per-bit stop-and-wait or sliding-window sifting')
+    parser.add_argument('--window', type=int, default=WINDOW_SIZE, help='qubits per sliding window')
+    parser.add_argument('--shm', default=None, metavar='NAME',
+                        help="write keys straight into key_service.py's shared store instead of TCP")
+    args = parser.parse_args()
+    if args.shm:
+        from shm_key_store import SharedKeyStore
+        shm_store = SharedKeyStore.attach(args.shm)
+    main(args.engine, args.key_size, args.intercept, args.loss, args.protocol, args.window)
\ No newline at end of file
@@ -3,17 +3,90 @@ from ryu.base import app_manager
 from ryu.controller import ofp_event
 from ryu.controller.handler import CONFIG_DISPATCHER, MAIN_DISPATCHER, set_ev_cls
 from ryu.ofproto import ofproto_v1_3
-from ryu.lib.packet import packet, ethernet
+from ryu.lib.packet import packet, ethernet, arp
 from ryu.topology import event
+from ryu.lib import hub
 import networkx as nx
-import socket
+import itertools
+import os
+import sys
 import threading
-import re
 import time
 
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import qkd_frame
+from key_store import KeyStore, DEFAULT_PAIR
+from shm_key_store import SharedKeyStore
+from key_ingest import KeyIngestServer, packed_to_bitstring, split_key_pair, parse_text_key_payload
+from qkd_frame import bitstring_to_bytes, bytes_to_bitstring
+from flow_manager import FlowManager
+from metrics import Registry, MetricsServer
+from contact_plan import ContactPlan, PlanStore, host_ip, host_mac, HOST_PORT
+from sim_clock import query_clock, SIM_CLOCK_HOST
+
 QKD_LISTEN_HOST = '127.0.0.1'
 QKD_LISTEN_PORT = 7001
+# Name of a key_service.py shared-memory store; when set, that process ingests the keys
+KEY_SERVICE_SHM = os.environ.get('KEY_SERVICE_SHM', '')
 QKD_ETHER_TYPE = 0x88B5
+ETH_TYPE_IPV4 = 0x0800
+ETH_TYPE_ARP = 0x0806
+QKD_DEFAULT_REQ_BITS = 16 # served when REQ_KEY does not name a size
+# Delay before a key reply is sent; the reply is scheduled on a green thread so
+# the packet-in handler never blocks. Override with the QKD_REPLY_DELAY_SEC env var.
+QKD_REPLY_DELAY_SEC = float(os.environ.get('QKD_REPLY_DELAY_SEC', 0.5))
+# Binary key replies are split so each 0x88B5 frame, headers, names and the
+# correlation wrapper included, stays within the link MTU
+QKD_LINK_MTU = 1500
+QKD_MAX_KEY_BYTES_PER_FRAME = 1400
+# Table-miss split by EtherType: anything unclassified is dropped at priority 0,
+# ARP/IPv4 misses go to the controller at MISS priority, QKD requests from hosts
+# always do, and 0x88B5 frames arriving over inter-switch ports are dropped.
+MISS_FLOW_PRIORITY = 1
+QKD_REQUEST_FLOW_PRIORITY = 100
+QKD_TRUNK_DROP_FLOW_PRIORITY = 101
+# Priority of the per-destination forwarding flows; they expire when unused
+FORWARD_FLOW_PRIORITY = 10
+FORWARD_IDLE_TIMEOUT_SEC = 120
+# Contact plan (same files as dynamic_sat_net.py), followed on the emulation's
+# virtual clock (sim_clock.py). In realtime mode the flows of the current topology
+# segment sit at PLAN_ACTIVE priority; those whose route changes at the next handover
+# have a hard timeout there, and their replacements are pushed CONTACT_PRELOAD_SEC
+# earlier at PLAN_NEXT priority and take over as soon as the active ones expire.
+# In afap/step mode the controller polls the clock and swaps the changed flows when
+# a boundary is crossed.
+CONTACT_PLAN_DIR = os.path.dirname(os.path.abspath(__file__))
+CONTACT_PLAN_NODES_CSV = os.environ.get('CONTACT_PLAN_NODES_CSV', os.path.join(CONTACT_PLAN_DIR, 'mininet_nodes.csv'))
+CONTACT_PLAN_INTERVALS_CSV = os.environ.get('CONTACT_PLAN_INTERVALS_CSV',
+                                            os.path.join(CONTACT_PLAN_DIR, 'mininet_access_intervals.csv'))
+# Compiled plan directory (python3 contact_plan.py ...); when set, used instead of the CSVs
+CONTACT_PLAN_STORE = os.environ.get('CONTACT_PLAN_STORE', '')
+# Simulated window, as passed to dynamic_sat_net.py --start/--end (it decides which links exist)
+CONTACT_PLAN_START_SEC = float(os.environ.get('CONTACT_PLAN_START_SEC', 0))
+CONTACT_PLAN_END_SEC = float(os.environ.get('CONTACT_PLAN_END_SEC', 'inf'))
+SIM_CLOCK_PORT = int(os.environ.get('SIM_CLOCK_PORT', 7002))
+# Used only when the clock is unreachable: simulated seconds per wall second since the first switch connected
+CONTACT_PLAN_TIME_SCALE = float(os.environ.get('CONTACT_PLAN_TIME_SCALE', 60))
+CONTACT_PRELOAD_SEC = 1.0
+CONTACT_PLAN_SYNC_SEC = 5.0 # longest wait between clock re-syncs in realtime mode
+CONTACT_PLAN_POLL_SEC = 0.05 # clock poll period in afap/step mode
+PLAN_NEXT_FLOW_PRIORITY = 20
+PLAN_ACTIVE_FLOW_PRIORITY = 30
+MAX_HARD_TIMEOUT_SEC = 65535
+# Fast failover: forwarding flows output through a FAST_FAILOVER group per destination
+# switch whose buckets are the primary next hop and up to FAILOVER_BACKUPS loop-free
+# alternates, so the switch moves traffic itself when a watched port goes down
+FAST_FAILOVER = os.environ.get('FAST_FAILOVER', '1') != '0'
+FAILOVER_BACKUPS = 2
+# Group ID = block of the flow set using the group + destination dpid
+FAILOVER_GROUP_BASE = {FORWARD_FLOW_PRIORITY: 0, PLAN_NEXT_FLOW_PRIORITY: 1 << 20, PLAN_ACTIVE_FLOW_PRIORITY: 2 << 20}
+# Prometheus text endpoint (/metrics) and sampling profiler toggle (/profile/start, /profile/stop);
+# METRICS_PORT=0 disables it, CONTROLLER_PROFILE=1 starts the profiler with the controller
+METRICS_HOST = '127.0.0.1'
+METRICS_PORT = int(os.environ.get('METRICS_PORT', 9108))
+CONTROLLER_PROFILE = os.environ.get('CONTROLLER_PROFILE', '0') == '1'
+# Pre-seed the ARP proxy and host locations with h_sN = 10.0.0.N (contact_plan.py); set to 0 to learn only
+ARP_PRESEED = os.environ.get('ARP_PRESEED', '1') != '0'
 
 class SatelliteController(app_manager.RyuApp):
     OFP_VERSIONS = [ofproto_v1_3.OFP_VERSION]
@@ -23,100 +96,147 @@ class SatelliteController(app_manager.RyuApp):
         self.mac_to_port = {}
         self.net = nx.DiGraph()
         self.switches = {}
-        # qkd_keys will hold {'packed': <str or None>, 'bits': <'0101...' or None>, 'n_bits': <int or None>}
-        self.qkd_keys = {}
+        self.flows = FlowManager()
+        # Path-based forwarding: host MAC -> (dpid, port) where it attaches, ports used by
+        # inter-switch links, and shortest paths cached per (src_dpid, dst_dpid) together
+        # with an edge index and the destination MACs whose flows follow each path
+        self.hosts = {}
+        self.switch_ports = set()
+        self.path_cache = {}
+        self.path_edges = {}
+        self.path_macs = {}
+        # Fast failover: hop counts to each destination switch over self.net (dropped on every
+        # link change) and the primary next hop of every forwarding group, per (dpid, dst_dpid)
+        self.failover_dists = {}
+        self.failover_groups = {}
+        # Contact-plan routing: ports learned via LLDP override the planned ones
+        self.link_ports = {}
+        self.contact_plan = self._load_contact_plan()
+        self.plan_routes = {}
+        self.plan_dists = {}
+        self.plan_backups = {}
+        self.plan_anchor = None # wall time at which simulated time was 0
+        self.plan_speed = CONTACT_PLAN_TIME_SCALE
+        self.plan_mode = 'realtime'
+        self.plan_segment = None
+        self.plan_install_mode = None # clock mode of the last full active install
+        # ARP proxy: IP -> MAC bindings answered by the controller
+        self.arp_table = {}
+        self.arp_stats = {'answered': 0, 'flooded': 0, 'learned': 0}
+        if ARP_PRESEED and self.contact_plan is not None:
+            self._preseed_hosts()
+        # Per (requester, peer) key pools; pushes without a pair go to the shared pool
+        self.key_store = self._attach_key_service() if KEY_SERVICE_SHM else None
+        self.key_server = None
+        if self.key_store is None:
+            self.key_store = KeyStore()
+            self.key_server = KeyIngestServer(self.key_store, QKD_LISTEN_HOST, QKD_LISTEN_PORT,
+                                              text_handler=self._handle_text_key_push, logger=self.logger,
+                                              on_store=self._observe_binary_push)
+        self._key_ids = itertools.count(1)
+        self._text_keys_received = 0
+        self._init_metrics()
 
         # Start key listener thread
-        key_listener_thread = threading.Thread(target=self._key_listener_worker, daemon=True)
-        key_listener_thread.start()
+        if self.key_server is not None:
+            key_listener_thread = threading.Thread(target=self._key_listener_worker, daemon=True)
+            key_listener_thread.start()
+
+    # ---------- Metrics ----------
+    def _init_metrics(self):
+        m = self.metrics = Registry()
+        self.m_packet_in = m.histogram('qsdn_packet_in_seconds',
+                                       'Packet-in handling time by EtherType branch (_count = packet-ins)', ['branch'])
+        self.m_key_push = m.histogram('qsdn_key_push_seconds', 'Time to store one key push', ['path'])
+        self.m_flow_install = m.histogram('qsdn_flow_install_seconds',
+                                          'Time to install a path, reroute or contact-plan segment', ['kind'])
+        self.m_req_key = m.counter('qsdn_req_key_total', 'REQ_KEY requests by result', ['result'])
+        if self.key_server is not None:
+            m.callback('qsdn_keys_received_total', 'Keys pushed to the controller',
+                       lambda: {('binary',): self.key_server.counters['keys'], ('text',): self._text_keys_received},
+                       ['path'], kind='counter')
+            m.callback('qsdn_key_ingest_events_total', 'Key ingestion server counters',
+                       lambda: {(k,): v for k, v in list(self.key_server.counters.items())}, ['event'], kind='counter')
+        m.callback('qsdn_key_store_events_total', 'Key store counters',
+                   lambda: {(k,): v for k, v in self.key_store.stats().items() if k in self.key_store.counters},
+                   ['event'], kind='counter')
+        m.callback('qsdn_key_store_depth_bits', 'Key material held per requester:peer pool',
+                   lambda: {(k,): v for k, v in self.key_store.stats()['pool_depth_bits'].items()}, ['pair'])
+        # Scrapes run on the metrics thread: read the flow manager through its locked snapshots only
+        m.callback('qsdn_flowmods_total', 'Flow manager counters (FlowMods, deletes, suppressed, barriers...)',
+                   lambda: {(k,): v for k, v in self.flows.stats().items() if k in self.flows.counters},
+                   ['event'], kind='counter')
+        m.callback('qsdn_flowmod_rate', 'FlowMods per second over the last 10 s', self.flows.flowmod_rate)
+        m.callback('qsdn_flow_table_entries', 'Flows installed per switch',
+                   lambda: {(str(dpid),): n for dpid, n in self.flows.stats()['table_occupancy'].items()}, ['dpid'])
+        m.callback('qsdn_topology_size', 'Topology graph and path cache sizes',
+                   lambda: {('switches',): self.net.number_of_nodes(), ('links',): self.net.number_of_edges() // 2,
+                            ('hosts',): len(self.hosts), ('cached_paths',): len(self.path_cache),
+                            ('arp_entries',): len(self.arp_table)}, ['item'])
+        if METRICS_PORT:
+            try:
+                self.metrics_server = MetricsServer(m, METRICS_HOST, METRICS_PORT)
+            except OSError as e:
+                self.logger.warning("Metrics endpoint not started on %s:%s: %s", METRICS_HOST, METRICS_PORT, e)
+                return
+            threading.Thread(target=self.metrics_server.serve_forever, daemon=True).start()
+            self.logger.info("Metrics on http://%s:%s/metrics", *self.metrics_server.address)
+            if CONTROLLER_PROFILE:
+                self.metrics_server.profiler.start()
 
-    # ---------- Helper: convert packed string to bitstring ----------
+    def _observe_binary_push(self, seconds, n_keys, n_bits):
+        self.m_key_push.observe(seconds, path='binary')
+
+    # ---------- Legacy text push parsing (see key_ingest.py) ----------
     def _packed_to_bitstring(self, packed: str) -> str:
-        """Convert packed string (bytes/chars where each char contains 8 bits) to bitstring '0101...'."""
-        return ''.join(f'{ord(c):08b}' for c in packed)
+        return packed_to_bitstring(packed)
+
+    def _split_key_pair(self, data: str):
+        return split_key_pair(data)
 
     def _parse_incoming_key_payload(self, data: str):
-        """
-        Handle incoming TCP payloads. Accepts:
-         - KEY:<bitstring>
-         - KEY:<packed_string>   (packed chars)
-         - KEYLEN:<n>:<data>     (data either packed or bits)
-        Returns tuple (packed_or_raw, bits_string, n_bits_or_none)
-        """
-        # Normalize
-        data = data.strip()
-        # KEYLEN:<n>:<data>
-        if data.startswith('KEYLEN:'):
-            parts = data.split(':', 2)
-            if len(parts) == 3:
-                try:
-                    n_bits = int(parts[1])
-                except ValueError:
-                    n_bits = None
-                payload = parts[2]
-                # If payload looks like only 0/1 then treat as bitstring
-                if re.fullmatch(r'[01]+', payload):
-                    bits = payload
-                    packed = None
-                else:
-                    packed = payload
-                    bits = self._packed_to_bitstring(packed)
-                # Trim to n_bits if given
-                if n_bits is not None:
-                    bits = bits[:n_bits]
-                return packed, bits, n_bits
-        # KEY:<data>
-        if data.startswith('KEY:'):
-            payload = data.split(':', 1)[1]
-            # If payload looks like bits only -> it's already a bitstring
-            if re.fullmatch(r'[01]+', payload):
-                return None, payload, len(payload)
-            else:
-                # packed chars -> convert
-                packed = payload
-                bits = self._packed_to_bitstring(packed)
-                return packed, bits, len(bits)
-        # Unknown format
-        return None, None, None
+        return parse_text_key_payload(data)
 
     # ---------- TCP listener for pushed QKD keys ----------
+    def _attach_key_service(self):
+        """Maps the key service's shared-memory store, or returns None to keep keys in-process."""
+        try:
+            store = SharedKeyStore.attach(KEY_SERVICE_SHM)
+        except (FileNotFoundError, ValueError) as e:
+            self.logger.error("Key service store %r not available (%s); ingesting keys in-process", KEY_SERVICE_SHM, e)
+            return None
+        self.logger.info("Serving QKD keys from key service store %r (%d pair slots of %d bits)",
+                         KEY_SERVICE_SHM, store.slots, store.max_bits_per_pair)
+        return store
+
     def _key_listener_worker(self):
-        s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-        s.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
-        s.bind((QKD_LISTEN_HOST, QKD_LISTEN_PORT))
-        s.listen(5)
+        # One selector loop serves every producer connection (see key_ingest.py)
+        self.key_server.bind()
         self.logger.info("SDN Controller listening for QKD keys on %s:%s", QKD_LISTEN_HOST, QKD_LISTEN_PORT)
-        while True:
-            conn, addr = s.accept()
-            # handle each connection in worker thread to avoid blocking listener
-            threading.Thread(target=self._handle_qkd_key_push, args=(conn,), daemon=True).start()
+        self.key_server.serve_forever()
 
-    def _handle_qkd_key_push(self, conn):
-        """Handles an incoming key and sends an acknowledgment including parsed bit length."""
+    def _handle_text_key_push(self, data: str) -> bytes:
+        """Stores a legacy text key push and returns the reply, including the parsed bit length."""
+        with self.m_key_push.time(path='text'):
+            return self._store_text_key_push(data)
+
+    def _store_text_key_push(self, data: str) -> bytes:
         try:
-            data = conn.recv(65535).decode('utf-8', errors='ignore').strip()
+            pair, data = self._split_key_pair(data)
             packed, bits, n_bits = self._parse_incoming_key_payload(data)
             if bits is not None:
-                # store both representations
-                self.qkd_keys['packed'] = packed
-                self.qkd_keys['bits'] = bits
-                self.qkd_keys['n_bits'] = n_bits if n_bits is not None else len(bits)
-                nbits_val = self.qkd_keys['n_bits']
-                self.logger.info("Received QKD key: stored %d bits (packed len=%s)", nbits_val, None if packed is None else len(packed))
+                nbits_val = len(bits)
+                depth = self.key_store.put(bitstring_to_bytes(bits), nbits_val, pair)
+                self._text_keys_received += 1
+                self.logger.info("Received QKD key: stored %d bits for %s:%s (packed len=%s, pool depth=%d bits)",
+                                 nbits_val, pair[0], pair[1], None if packed is None else len(packed), depth)
                 # ACK with explicit bit length so client can confirm
-                ack = f"ACK:OK:bits={nbits_val}".encode('utf-8')
-                conn.sendall(ack)
-            else:
-                self.logger.warning("Rejected QKD push (bad format): %s", data[:120])
-                conn.sendall(b"ERR:BAD_FORMAT")
+                return f"ACK:OK:bits={nbits_val}".encode('utf-8')
+            self.logger.warning("Rejected QKD push (bad format): %s", data[:120])
+            return b"ERR:BAD_FORMAT"
         except Exception as e:
             self.logger.exception("Failed to handle QKD key push: %s", e)
-            try:
-                conn.sendall(b"ERR:EXCEPTION")
-            except Exception:
-                pass
-        finally:
-            conn.close()
+            return b"ERR:EXCEPTION"
 
     # ---------- Ryu lifecycle / flow helpers ----------
     @set_ev_cls(ofp_event.EventOFPSwitchFeatures, CONFIG_DISPATCHER)
@@ -124,124 +244,664 @@ class SatelliteController(app_manager.RyuApp):
         datapath = ev.msg.datapath
         parser = datapath.ofproto_parser
         ofproto = datapath.ofproto
-        match = parser.OFPMatch()
-        actions = [parser.OFPActionOutput(ofproto.OFPP_CONTROLLER, ofproto.OFPCML_NO_BUFFER)]
-        self.add_flow(datapath, 0, match, actions)
+        to_controller = [parser.OFPActionOutput(ofproto.OFPP_CONTROLLER, ofproto.OFPCML_NO_BUFFER)]
+        trunk_ports = {port for (u, _), port in self.link_ports.items() if u == datapath.id}
+        if self.contact_plan is not None:
+            trunk_ports |= {port for (u, _), port in self.contact_plan.ports.items() if u == datapath.id}
+        # A (re)connecting switch starts from an empty table
+        self.flows.reset(datapath.id)
+        for key in [k for k in self.failover_groups if k[0] == datapath.id]:
+            del self.failover_groups[key]
+        with self.flows.batch():
+            if FAST_FAILOVER:
+                self.flows.delete_groups(datapath)
+            self.add_flow(datapath, 0, {}, [], kind='classify')
+            for eth_type in (ETH_TYPE_ARP, ETH_TYPE_IPV4):
+                self.add_flow(datapath, MISS_FLOW_PRIORITY, {'eth_type': eth_type}, to_controller, kind='classify')
+            self.add_flow(datapath, QKD_REQUEST_FLOW_PRIORITY, {'eth_type': QKD_ETHER_TYPE}, to_controller,
+                          kind='classify')
+            for port in trunk_ports:
+                self._drop_qkd_on_trunk(datapath, port)
         self.switches[datapath.id] = datapath
         self.net.add_node(datapath.id)
         self.logger.info("Switch %s connected", datapath.id)
+        if self.contact_plan is not None and self.plan_anchor is None:
+            # Fallback anchor if the clock is unreachable: the link manager starts right after the switches connect
+            self.plan_anchor = time.time()
+            hub.spawn(self._contact_plan_worker)
 
-    def add_flow(self, datapath, priority, match, actions):
-        ofproto = datapath.ofproto
-        parser = datapath.ofproto_parser
-        inst = [parser.OFPInstructionActions(ofproto.OFPIT_APPLY_ACTIONS, actions)]
-        mod = parser.OFPFlowMod(datapath=datapath, priority=priority, match=match, instructions=inst)
-        datapath.send_msg(mod)
+    def add_flow(self, datapath, priority, match, actions, kind='forward', idle_timeout=0, hard_timeout=0):
+        """match is a dict of OXM fields; duplicates of live flows are not re-sent (see flow_manager.py)."""
+        return self.flows.add(datapath, priority, match, actions, kind=kind,
+                              idle_timeout=idle_timeout, hard_timeout=hard_timeout)
+
+    def _drop_qkd_on_trunk(self, datapath, port):
+        """Key requests only come from hosts; 0x88B5 frames on inter-switch ports die in the switch."""
+        self.add_flow(datapath, QKD_TRUNK_DROP_FLOW_PRIORITY, {'in_port': port, 'eth_type': QKD_ETHER_TYPE}, [],
+                      kind='classify')
+
+    def delete_flow(self, datapath, priority, match):
+        self.flows.delete(datapath, priority, match)
+
+    @set_ev_cls(ofp_event.EventOFPFlowRemoved, MAIN_DISPATCHER)
+    def flow_removed_handler(self, ev):
+        msg = ev.msg
+        self.flows.flow_removed(msg.datapath.id, msg.cookie)
 
     @set_ev_cls(event.EventLinkAdd)
     def link_add_handler(self, ev):
         src = ev.link.src
         dst = ev.link.dst
-        self.net.add_edge(src.dpid, dst.dpid, port=src.port_no)
-        self.net.add_edge(dst.dpid, src.dpid, port=dst.port_no)
-        self.logger.info("Link added: %s <-> %s", src.dpid, dst.dpid)
+        stale = set()
+        for u, v, port in ((src.dpid, dst.dpid, src.port_no), (dst.dpid, src.dpid, dst.port_no)):
+            if self.net.has_edge(u, v) and self.net[u][v]['port'] != port:
+                # Same switches, different ports: paths over the old edge carry a wrong out port
+                stale |= self.path_edges.get((u, v), set())
+                self.switch_ports.discard((u, self.net[u][v]['port']))
+            self.net.add_edge(u, v, port=port)
+            self.switch_ports.add((u, port))
+            self.link_ports[(u, v)] = port
+            if u in self.switches:
+                self._drop_qkd_on_trunk(self.switches[u], port)
+        self.failover_dists.clear()
+        stale |= self._paths_shortened_by(src.dpid, dst.dpid)
+        stale |= self._paths_shortened_by(dst.dpid, src.dpid)
+        with self.flows.batch():
+            self._reroute(stale)
+            n_groups = self._refresh_failover_groups()
+        self.logger.info("Link added: %s <-> %s (%d cached paths invalidated, %d failover groups updated)",
+                         src.dpid, dst.dpid, len(stale), n_groups)
 
     @set_ev_cls(event.EventLinkDelete)
     def link_del_handler(self, ev):
         src = ev.link.src
         dst = ev.link.dst
-        if self.net.has_edge(src.dpid, dst.dpid):
-            self.net.remove_edge(src.dpid, dst.dpid)
-        if self.net.has_edge(dst.dpid, src.dpid):
-            self.net.remove_edge(dst.dpid, src.dpid)
-        self.logger.info("Link removed: %s <-> %s", src.dpid, dst.dpid)
+        stale = set()
+        for u, v in ((src.dpid, dst.dpid), (dst.dpid, src.dpid)):
+            if self.net.has_edge(u, v):
+                self.switch_ports.discard((u, self.net[u][v]['port']))
+                self.net.remove_edge(u, v)
+            stale |= self.path_edges.get((u, v), set())
+        self.failover_dists.clear()
+        # The switches already moved traffic to a backup bucket; this makes it the primary
+        with self.flows.batch():
+            self._reroute(stale)
+            n_groups = self._refresh_failover_groups()
+        self.logger.info("Link removed: %s <-> %s (%d cached paths invalidated, %d failover groups updated)",
+                         src.dpid, dst.dpid, len(stale), n_groups)
+
+    # ---------- Contact-plan route pre-installation ----------
+    def _load_contact_plan(self):
+        try:
+            if CONTACT_PLAN_STORE:
+                plan = ContactPlan.from_store(PlanStore.open(CONTACT_PLAN_STORE),
+                                              CONTACT_PLAN_START_SEC, CONTACT_PLAN_END_SEC)
+            else:
+                plan = ContactPlan.from_csv(CONTACT_PLAN_NODES_CSV, CONTACT_PLAN_INTERVALS_CSV,
+                                            CONTACT_PLAN_START_SEC, CONTACT_PLAN_END_SEC)
+        except (OSError, ValueError, KeyError) as e:
+            self.logger.warning("Contact plan not loaded (%s); relying on LLDP link events only", e)
+            return None
+        self.logger.info("Loaded contact plan: %d switches, %d topology segments",
+                         len(plan.dpids), len(plan.segments))
+        for (dpid, _), port in plan.ports.items():
+            self.switch_ports.add((dpid, port))
+        return plan
+
+    def _sync_plan_clock(self):
+        """Re-anchors the plan on the emulation clock; returns the current simulated time."""
+        try:
+            state = query_clock(SIM_CLOCK_HOST, SIM_CLOCK_PORT, timeout=0.5)
+        except (OSError, ValueError):
+            return (time.time() - self.plan_anchor) * self.plan_speed
+        self.plan_mode = state['mode']
+        self.plan_speed = state['speed']
+        self.plan_anchor = time.time() - state['time'] / self.plan_speed
+        return state['time']
+
+    def _plan_wall_time(self, sim_time):
+        return self.plan_anchor + sim_time / self.plan_speed
+
+    def _plan_routes(self, links):
+        """
+        Next hops towards every switch in the topology formed by links:
+        {dst_dpid: {src_dpid: next_hop_dpid}} (src == dst maps to itself).
+        Cached per link set, since passes repeat the same topologies.
+        """
+        routes = self.plan_routes.get(links)
+        if routes is None:
+            graph = nx.Graph()
+            graph.add_nodes_from(self.contact_plan.dpids)
+            graph.add_edges_from(links)
+            routes = {}
+            dists = {}
+            for dst, paths in nx.all_pairs_shortest_path(graph):
+                routes[dst] = {src: path[-2] if len(path) > 1 else dst for src, path in paths.items()}
+                dists[dst] = {src: len(path) - 1 for src, path in paths.items()}
+            self.plan_routes[links] = routes
+            self.plan_dists[links] = dists
+        return routes
+
+    def _plan_backups(self, links, keep):
+        """
+        Loop-free alternates in the topology formed by links: {dst_dpid: {src_dpid: [hops]}}.
+        Links in keep (still up in the following segment) go first, so a switch that
+        fails over just before a pass boundary lands on a link that stays.
+        """
+        key = (links, keep)
+        backups = self.plan_backups.get(key)
+        if backups is None:
+            routes = self._plan_routes(links)
+            neighbors = {}
+            for u, v in links:
+                neighbors.setdefault(u, []).append(v)
+                neighbors.setdefault(v, []).append(u)
+            backups = {}
+            for dst, next_hops in routes.items():
+                dist = self.plan_dists[links][dst]
+                backups[dst] = {src: self._loop_free_alternates(neighbors.get(src, ()), dist, src, hop, keep)
+                                for src, hop in next_hops.items() if src != dst}
+            self.plan_backups[key] = backups
+        return backups
+
+    def _plan_port(self, src, next_hop):
+        return self.link_ports.get((src, next_hop), self.contact_plan.ports.get((src, next_hop)))
+
+    def _plan_hops(self, index, dst, src):
+        """Next hop of src towards dst in plan segment index, then its failover alternates; None without a route."""
+        segments = self.contact_plan.segments
+        if index >= len(segments):
+            return None
+        links = segments[index][2]
+        next_hop = self._plan_routes(links).get(dst, {}).get(src)
+        if next_hop is None or not FAST_FAILOVER:
+            return next_hop if next_hop is None else (next_hop,)
+        keep = segments[index + 1][2] if index + 1 < len(segments) else links
+        return (next_hop, *self._plan_backups(links, keep).get(dst, {}).get(src, []))
+
+    def _install_plan_segment(self, index, priority, macs=None, since=None):
+        """
+        Installs eth_dst flows of plan segment index for every known host (or only macs).
+        With since, the segment whose flows are in place, only the differences are sent.
+
+        In realtime, an active flow whose route changes at the next handover gets a hard
+        timeout at that handover and falls through to the pre-installed one; the others
+        are permanent until their route changes.
+        """
+        start = time.perf_counter()
+        _, end, links = self.contact_plan.segments[index]
+        timed = end != float('inf') and self.plan_mode == 'realtime'
+        # Nearest second; the promotion at the handover replaces or withdraws whatever is left
+        hard_timeout = min(MAX_HARD_TIMEOUT_SEC, max(1, round(self._plan_wall_time(end) - time.time()))) if timed else 0
+        if priority == PLAN_ACTIVE_FLOW_PRIORITY and macs is None:
+            self.plan_install_mode = self.plan_mode
+        routes = self._plan_routes(links)
+        n_flows = 0
+        with self.flows.batch():
+            for mac in (macs if macs is not None else list(self.hosts)):
+                dst, host_port = self.hosts[mac]
+                for src in routes.get(dst, {}):
+                    datapath = self.switches.get(src)
+                    if datapath is None:
+                        continue
+                    hops = self._plan_hops(index, dst, src)
+                    expires = timed and (priority != PLAN_ACTIVE_FLOW_PRIORITY
+                                         or self._plan_hops(index + 1, dst, src) != hops)
+                    if since is not None and self._plan_hops(since, dst, src) == hops:
+                        # Unchanged: the flow in place stays unless it has to start expiring now
+                        if priority != PLAN_ACTIVE_FLOW_PRIORITY or not expires:
+                            continue
+                    if src == dst:
+                        action = datapath.ofproto_parser.OFPActionOutput(host_port)
+                    else:
+                        ports = [self._plan_port(src, hop) for hop in hops]
+                        if ports[0] is None:
+                            continue
+                        action = self._failover_action(datapath, priority, dst,
+                                                       [port for port in ports if port is not None])
+                    self.add_flow(datapath, priority, {'eth_dst': mac}, [action], kind='plan',
+                                  hard_timeout=hard_timeout if expires else 0)
+                    n_flows += 1
+        self.m_flow_install.observe(time.perf_counter() - start, kind='plan')
+        return n_flows
+
+    def _withdraw_plan_flows(self, old_index, new_index):
+        """Deletes active plan flows on switches that have no route in the new segment."""
+        old_routes = self._plan_routes(self.contact_plan.segments[old_index][2])
+        new_routes = self._plan_routes(self.contact_plan.segments[new_index][2])
+        for mac, (dst, _) in list(self.hosts.items()):
+            for src in set(old_routes.get(dst, {})) - set(new_routes.get(dst, {})):
+                datapath = self.switches.get(src)
+                if datapath is not None:
+                    self.delete_flow(datapath, PLAN_ACTIVE_FLOW_PRIORITY, {'eth_dst': mac})
+
+    def _contact_plan_worker(self):
+        segments = self.contact_plan.segments
+        index = self.contact_plan.segment_index(self._sync_plan_clock())
+        self._install_plan_segment(index, PLAN_ACTIVE_FLOW_PRIORITY)
+        self.plan_segment = index
+        while index + 1 < len(segments):
+            boundary = segments[index + 1][0]
+            preloaded = False
+            while True:
+                sim_now = self._sync_plan_clock()
+                if sim_now >= boundary:
+                    break
+                if self.plan_mode != 'realtime':
+                    hub.sleep(CONTACT_PLAN_POLL_SEC)
+                    continue
+                wall_left = (boundary - sim_now) / self.plan_speed
+                if not preloaded and wall_left <= CONTACT_PRELOAD_SEC:
+                    # Only routes that change; the others stay on their permanent active flows
+                    n_flows = self._install_plan_segment(index + 1, PLAN_NEXT_FLOW_PRIORITY, since=index)
+                    preloaded = True
+                    self.logger.info("Pre-installed %d flows for plan segment %d (sim %.0fs, %d links)",
+                                     n_flows, index + 1, boundary, len(segments[index + 1][2]))
+                wait = wall_left if preloaded else wall_left - CONTACT_PRELOAD_SEC
+                hub.sleep(min(max(wait, 0.0), CONTACT_PLAN_SYNC_SEC))
+            # afap can cross several boundaries between two polls
+            upcoming = max(index + 1, self.contact_plan.segment_index(sim_now))
+            # A diff is only valid against flows installed for the previous segment in the same clock mode
+            since = index if upcoming == index + 1 and self.plan_install_mode == self.plan_mode else None
+            with self.flows.batch():
+                self._withdraw_plan_flows(index, upcoming)
+                # Changed routes are promoted from the pre-installed flows (in realtime their
+                # active flows have just expired); unchanged ones keep their active flow
+                n_flows = self._install_plan_segment(upcoming, PLAN_ACTIVE_FLOW_PRIORITY, since=since)
+            self.logger.debug("Promoted %d flows for plan segment %d", n_flows, upcoming)
+            index = upcoming
+            self.plan_segment = index
+        self.logger.info("Contact plan exhausted at sim %.0fs", segments[index][0])
+
+    # ---------- ARP proxy ----------
+    def _preseed_hosts(self):
+        """Binds h_sN's IP and MAC and places it on port HOST_PORT of switch N."""
+        for dpid in self.contact_plan.dpids:
+            mac = host_mac(dpid)
+            self.arp_table[host_ip(dpid)] = mac
+            self.hosts[mac] = (dpid, HOST_PORT)
+        self.logger.info("ARP proxy pre-seeded with %d hosts", len(self.contact_plan.dpids))
+
+    def _handle_arp(self, datapath, in_port, pkt):
+        """
+        Learns the sender's binding and answers requests for known IPs directly
+        out of in_port. Returns False when the frame still has to be forwarded.
+        """
+        arp_pkt = pkt.get_protocol(arp.arp)
+        if arp_pkt is None:
+            return False
+        if arp_pkt.src_ip != '0.0.0.0' and self.arp_table.get(arp_pkt.src_ip) != arp_pkt.src_mac:
+            self.arp_table[arp_pkt.src_ip] = arp_pkt.src_mac
+            self.arp_stats['learned'] += 1
+        if arp_pkt.opcode != arp.ARP_REQUEST:
+            return False
+        target_mac = self.arp_table.get(arp_pkt.dst_ip)
+        if target_mac is None or arp_pkt.dst_ip == arp_pkt.src_ip:
+            return False
+
+        reply = packet.Packet()
+        reply.add_protocol(ethernet.ethernet(dst=arp_pkt.src_mac, src=target_mac, ethertype=ETH_TYPE_ARP))
+        reply.add_protocol(arp.arp(opcode=arp.ARP_REPLY, src_mac=target_mac, src_ip=arp_pkt.dst_ip,
+                                   dst_mac=arp_pkt.src_mac, dst_ip=arp_pkt.src_ip))
+        reply.serialize()
+        ofproto = datapath.ofproto
+        parser = datapath.ofproto_parser
+        out = parser.OFPPacketOut(datapath=datapath, buffer_id=ofproto.OFP_NO_BUFFER,
+                                  in_port=ofproto.OFPP_CONTROLLER,
+                                  actions=[parser.OFPActionOutput(in_port)], data=reply.data)
+        datapath.send_msg(out)
+        self.arp_stats['answered'] += 1
+        return True
+
+    # ---------- Path-based forwarding ----------
+    def _get_path(self, src_dpid, dst_dpid):
+        """Shortest switch path src -> dst over self.net, cached per pair; None if unreachable."""
+        key = (src_dpid, dst_dpid)
+        if key in self.path_cache:
+            return self.path_cache[key]
+        try:
+            path = nx.shortest_path(self.net, src_dpid, dst_dpid)
+        except (nx.NetworkXNoPath, nx.NodeNotFound):
+            path = None
+        self.path_cache[key] = path
+        for edge in zip(path or (), (path or ())[1:]):
+            self.path_edges.setdefault(edge, set()).add(key)
+        return path
+
+    def _paths_shortened_by(self, u, v):
+        """Cached pairs (including unreachable ones) that a new edge u -> v makes shorter."""
+        if not self.path_cache:
+            return set()
+        to_u = nx.single_source_shortest_path_length(self.net.reverse(copy=False), u)
+        from_v = nx.single_source_shortest_path_length(self.net, v)
+        inf = float('inf')
+        shortened = set()
+        for (s, d), path in self.path_cache.items():
+            hops = len(path) - 1 if path is not None else inf
+            if to_u.get(s, inf) + 1 + from_v.get(d, inf) < hops:
+                shortened.add((s, d))
+        return shortened
+
+    def _reroute(self, keys):
+        """Drops the given cached paths and moves the flows that followed them to fresh paths."""
+        start = time.perf_counter()
+        for key in keys:
+            old_path = self.path_cache.pop(key, None)
+            for edge in zip(old_path or (), (old_path or ())[1:]):
+                users = self.path_edges.get(edge)
+                if users is not None:
+                    users.discard(key)
+                    if not users:
+                        del self.path_edges[edge]
+            macs = self.path_macs.pop(key, set())
+            if not macs:
+                continue
+            for mac in macs:
+                for dpid in old_path or ():
+                    datapath = self.switches.get(dpid)
+                    if datapath is not None:
+                        self.delete_flow(datapath, FORWARD_FLOW_PRIORITY, {'eth_dst': mac})
+            new_path = self._get_path(*key)
+            if new_path is None:
+                # Remember the destinations so the flows return when a link comes back
+                self.path_macs[key] = macs
+                self.logger.info("No path %s -> %s after topology change; flows removed", key[0], key[1])
+                continue
+            for mac in macs:
+                if mac in self.hosts:
+                    self._install_path(new_path, mac)
+        self.m_flow_install.observe(time.perf_counter() - start, kind='reroute')
+
+    def _install_path(self, path, dst_mac):
+        """
+        Installs eth_dst flows on every switch of path in one pass, ending at the
+        port where dst_mac attaches. Returns the out port on the first switch.
+        """
+        start = time.perf_counter()
+        _, host_port = self.hosts[dst_mac]
+        dst = path[-1]
+        first_port = None
+        with self.flows.batch():
+            for dpid, next_hop in self._failover_tree(path) + [(dst, None)]:
+                ports = [host_port] if next_hop is None else self._forward_ports(dpid, dst, next_hop)
+                if first_port is None:
+                    first_port = ports[0]
+                datapath = self.switches.get(dpid)
+                if datapath is None:
+                    continue
+                if next_hop is None:
+                    action = datapath.ofproto_parser.OFPActionOutput(host_port)
+                else:
+                    action = self._failover_action(datapath, FORWARD_FLOW_PRIORITY, dst, ports)
+                    self.failover_groups[(dpid, dst)] = next_hop
+                self.add_flow(datapath, FORWARD_FLOW_PRIORITY, {'eth_dst': dst_mac}, [action],
+                              idle_timeout=FORWARD_IDLE_TIMEOUT_SEC)
+        self.path_macs.setdefault((path[0], path[-1]), set()).add(dst_mac)
+        self.logger.debug("Installed path %s for %s", path, dst_mac)
+        self.m_flow_install.observe(time.perf_counter() - start, kind='path')
+        return first_port
+
+    # ---------- Fast-failover groups ----------
+    def _loop_free_alternates(self, neighbors, dist, node, primary, keep=None):
+        """
+        Backup next hops of node towards the destination of dist: neighbours other
+        than primary that are no farther from it than node, so their own shortest
+        path never comes back through node or over the node-primary link. Closest
+        first; neighbours over links in keep (dpid tuples, u < v) before the others.
+        """
+        hops = dist.get(node)
+        if hops is None:
+            return []
+        alternates = [w for w in neighbors if w != primary and dist.get(w, hops + 1) <= hops]
+        alternates.sort(key=lambda w: (keep is not None and tuple(sorted((node, w))) not in keep, dist[w], w))
+        return alternates[:FAILOVER_BACKUPS]
+
+    def _failover_action(self, datapath, priority, dst, ports):
+        """Group action over ports (primary first) for flows of priority towards dst; plain output without FF."""
+        parser = datapath.ofproto_parser
+        if not FAST_FAILOVER:
+            return parser.OFPActionOutput(ports[0])
+        group_id = FAILOVER_GROUP_BASE[priority] + dst
+        self.flows.set_failover_group(datapath, group_id, ports)
+        return parser.OFPActionGroup(group_id)
+
+    def _net_dist(self, dst):
+        """Hop counts to dst over self.net, cached until the next link change."""
+        dist = self.failover_dists.get(dst)
+        if dist is None:
+            dist = nx.single_source_shortest_path_length(self.net.reverse(copy=False), dst)
+            self.failover_dists[dst] = dist
+        return dist
+
+    def _shortest_next_hop(self, dpid, dist):
+        return min((w for w in self.net.successors(dpid) if dist.get(w) == dist[dpid] - 1), default=None)
+
+    def _forward_ports(self, dpid, dst, primary):
+        """Out port towards primary, then those of its loop-free alternates over self.net."""
+        if not FAST_FAILOVER:
+            return [self.net[dpid][primary]['port']]
+        backups = self._loop_free_alternates(self.net.successors(dpid), self._net_dist(dst), dpid, primary)
+        return [self.net[dpid][hop]['port'] for hop in [primary] + backups]
+
+    def _failover_tree(self, path):
+        """
+        (dpid, next hop) for every switch of path except the last, then for the
+        switches on the alternates' own shortest paths, so traffic a group diverts
+        finds flows all the way to the destination.
+        """
+        hops = list(zip(path, path[1:]))
+        if not FAST_FAILOVER or len(path) < 2:
+            return hops
+        dst = path[-1]
+        dist = self._net_dist(dst)
+        covered = set(path)
+        for dpid, primary in list(hops):
+            for node in self._loop_free_alternates(self.net.successors(dpid), dist, dpid, primary):
+                while node != dst and node not in covered:
+                    covered.add(node)
+                    next_hop = self._shortest_next_hop(node, dist)
+                    hops.append((node, next_hop))
+                    node = next_hop
+        return hops
+
+    def _refresh_failover_groups(self):
+        """
+        Re-derives the buckets of every forwarding group after a link change; only
+        groups whose ports changed are sent. Returns the number of GroupMods.
+        """
+        if not FAST_FAILOVER:
+            return 0
+        sent = 0
+        group_base = FAILOVER_GROUP_BASE[FORWARD_FLOW_PRIORITY]
+        for (dpid, dst), primary in list(self.failover_groups.items()):
+            datapath = self.switches.get(dpid)
+            dist = self._net_dist(dst)
+            if datapath is None or dpid not in dist:
+                # Cut off from dst: keep the buckets, the link may come back
+                continue
+            if dist.get(primary) != dist[dpid] - 1 or not self.net.has_edge(dpid, primary):
+                primary = self._shortest_next_hop(dpid, dist)
+                self.failover_groups[(dpid, dst)] = primary
+            if self.flows.set_failover_group(datapath, group_base + dst, self._forward_ports(dpid, dst, primary)):
+                sent += 1
+        return sent
 
     # ---------- Packet-in handler (handles REQ_KEY via ethertype) ----------
     @set_ev_cls(ofp_event.EventOFPPacketIn, MAIN_DISPATCHER)
     def _packet_in_handler(self, ev):
-        msg = ev.msg
+        start = time.perf_counter()
+        branch = self._handle_packet_in(ev.msg)
+        self.m_packet_in.observe(time.perf_counter() - start, branch=branch)
+
+    def _handle_packet_in(self, msg):
+        """Returns the EtherType branch taken, for the packet-in histogram."""
         datapath = msg.datapath
         dpid = datapath.id
         ofproto = datapath.ofproto
         parser = datapath.ofproto_parser
         in_port = msg.match['in_port']
-        pkt = packet.Packet(msg.data)
-        eth = pkt.get_protocol(ethernet.ethernet)
-
-        # Try to decode textual payload safely
-        try:
-            payload = msg.data[14:].decode('utf-8', errors='ignore').strip()
-        except Exception:
-            payload = None
-
-        # safeguard: drop reflected KEY payloads to avoid loops
-        if payload:
-            if payload.startswith('KEY:') or payload.startswith('KEYLEN:'):
-                self.logger.debug("Dropping potential reflected/looped QKD payload: %s", payload[:120])
-                return
-                # don't return here; we still want to handle ethertype packets further down if needed
-                # but if ethertype is QKD_ETHER_TYPE we will handle below.
-
-        # Handle QKD control EtherType packets
-        if eth.ethertype == QKD_ETHER_TYPE:
-            try:
-                payload = msg.data[14:].decode('utf-8', errors='ignore').strip()
-                parts = payload.split(':')
-                if len(parts) >= 1 and parts[0] == 'REQ_KEY':
-                    self.logger.info("Received QKD REQ_KEY on dpid=%s port=%s from %s", dpid, in_port, eth.src)
-                    if 'bits' in self.qkd_keys and self.qkd_keys['bits']:
-                        bits = self.qkd_keys['bits']
-                        reply = f"KEY:{bits}".encode('utf-8')
-                        self.logger.info("Serving QKD key (%d bits) to requester (dpid=%s).", len(bits), dpid)
-                    else:
-                        reply = b"ERR:NO_KEY_AVAILABLE"
-                        self.logger.warning("No QKD key available to serve request.")
-                    # Flood the reply so it reaches the host
-                    actions = [parser.OFPActionOutput(ofproto.OFPP_FLOOD)]
-                    out = parser.OFPPacketOut(
-                        datapath=datapath,
-                        buffer_id=ofproto.OFP_NO_BUFFER,
-                        in_port=ofproto.OFPP_CONTROLLER,
-                        actions=actions,
-                        data=self._craft_eth(eth.src, eth.dst, QKD_ETHER_TYPE, reply)
-                    )
-                    time.sleep(0.5)
-                    datapath.send_msg(out)
-                else:
-                    self.logger.warning("Bad QKD payload or unexpected format: %s", payload)
-            except Exception as e:
-                self.logger.exception("QKD handling failed: %s", e)
-            return
+        data = msg.data
+        # EtherType straight from the raw frame; only ARP goes through the packet parser
+        ethertype = int.from_bytes(data[12:14], 'big')
+        if ethertype == QKD_ETHER_TYPE:
+            self._handle_qkd_request(datapath, in_port, data)
+            return 'qkd'
+        if ethertype != ETH_TYPE_ARP and ethertype != ETH_TYPE_IPV4:
+            return 'other'
 
         # ---------------- Standard forwarding (ARP/IP) ----------------
-        dst = eth.dst
-        src = eth.src
-        dpid = datapath.id
+        dst = data[0:6].hex(':')
+        src = data[6:12].hex(':')
         self.mac_to_port.setdefault(dpid, {})
         self.mac_to_port[dpid][src] = in_port
+        # Hosts attach on ports that carry no inter-switch link
+        if (dpid, in_port) not in self.switch_ports and self.hosts.get(src) != (dpid, in_port):
+            self.hosts[src] = (dpid, in_port)
+            if self.plan_segment is not None:
+                self._install_plan_segment(self.plan_segment, PLAN_ACTIVE_FLOW_PRIORITY, macs=[src])
 
         # ARP handling
-        if eth.ethertype == 0x0806:
+        if ethertype == ETH_TYPE_ARP:
             self.logger.debug("ARP packet on dpid=%s, port=%s", dpid, in_port)
+            if self._handle_arp(datapath, in_port, packet.Packet(data)):
+                return 'arp'
+            # Unknown target, or a reply: deliver like unicast traffic when the destination is known
             out_port = ofproto.OFPP_FLOOD
+            if dst in self.hosts:
+                path = self._get_path(dpid, self.hosts[dst][0])
+                if path is not None:
+                    out_port = self._install_path(path, dst)
+            if out_port == ofproto.OFPP_FLOOD:
+                self.arp_stats['flooded'] += 1
             actions = [parser.OFPActionOutput(out_port)]
             out = parser.OFPPacketOut(datapath=datapath, buffer_id=msg.buffer_id, in_port=in_port, actions=actions, data=msg.data)
             datapath.send_msg(out)
-            return
+            return 'arp'
 
         # IPv4 handling
-        if eth.ethertype == 0x0800:
+        if ethertype == ETH_TYPE_IPV4:
+            src_ip = '.'.join(str(b) for b in data[26:30])
+            if src_ip not in self.arp_table:
+                self.arp_table[src_ip] = src
+                self.arp_stats['learned'] += 1
             out_port = None
-            if dst in self.mac_to_port.get(dpid, {}):
+            path = self._get_path(dpid, self.hosts[dst][0]) if dst in self.hosts else None
+            if path is not None:
+                # Whole path installed at once; later packets never reach the controller
+                out_port = self._install_path(path, dst)
+            elif dst in self.mac_to_port.get(dpid, {}):
                 out_port = self.mac_to_port[dpid][dst]
+                self.add_flow(datapath, FORWARD_FLOW_PRIORITY, {'eth_dst': dst},
+                              [parser.OFPActionOutput(out_port)], idle_timeout=FORWARD_IDLE_TIMEOUT_SEC)
             else:
+                # Unknown destination: flood this packet only, so the next one comes back here
                 out_port = ofproto.OFPP_FLOOD
             actions = [parser.OFPActionOutput(out_port)]
-            match = parser.OFPMatch(eth_dst=dst)
-            self.add_flow(datapath, 1, match, actions)
             out = parser.OFPPacketOut(datapath=datapath, buffer_id=msg.buffer_id, in_port=in_port, actions=actions, data=msg.data)
             datapath.send_msg(out)
-            return
+            return 'ipv4'
+
+    def _handle_qkd_request(self, datapath, in_port, data):
+        """Serves a REQ_KEY frame (the only 0x88B5 traffic the switches send to the controller)."""
+        dpid = datapath.id
+        requester_mac = data[6:12].hex(':')
+        try:
+            payload = data[14:].decode('utf-8', errors='ignore').strip()
+            parts = payload.split(':')
+            if len(parts) >= 1 and parts[0] == 'REQ_KEY':
+                # REQ_KEY:<requester>:<peer>:<size>[:v1[:<correlation id>]]; v1 asks for binary KEYS frames
+                binary = len(parts) >= 5 and parts[4] == qkd_frame.REQ_BINARY_FLAG
+                tag = int(parts[5]) if binary and len(parts) >= 6 and parts[5].isdigit() else None
+                pair = (parts[1], parts[2]) if len(parts) >= 3 else DEFAULT_PAIR
+                try:
+                    n_bits = int(parts[3]) if len(parts) >= 4 else QKD_DEFAULT_REQ_BITS
+                except ValueError:
+                    n_bits = QKD_DEFAULT_REQ_BITS
+                self.logger.info("Received QKD REQ_KEY on dpid=%s port=%s from %s (%s:%s, %d bits)",
+                                 dpid, in_port, requester_mac, pair[0], pair[1], n_bits)
+                # Checked before any bits leave the pool: a reply that cannot be encoded would lose them
+                chunk_bytes = self._key_chunk_bytes(pair, tag) if binary else 1
+                if chunk_bytes <= 0:
+                    replies = [qkd_frame.encode_ack(qkd_frame.STATUS_BAD_FORMAT) if binary else b"ERR:BAD_FORMAT"]
+                    if tag is not None:
+                        replies = [qkd_frame.encode_tagged(tag, reply) for reply in replies]
+                    self.m_req_key.inc(result='bad_format')
+                    self.logger.warning("Rejected QKD REQ_KEY: names of %d/%d bytes do not fit a reply frame",
+                                        len(pair[0].encode('utf-8')), len(pair[1].encode('utf-8')))
+                    self._send_qkd_replies(datapath, in_port, data, requester_mac, replies)
+                    return
+                try:
+                    key = self.key_store.take(n_bits, pair)
+                except ValueError as e:
+                    # Names the shared-memory store cannot hold (shm_key_store.SHM_NAME_BYTES)
+                    self.logger.warning("Rejected QKD REQ_KEY: %s", e)
+                    key = None
+                if key is not None:
+                    if binary:
+                        replies = self._binary_key_replies(key, n_bits, pair, chunk_bytes)
+                    else:
+                        replies = [f"KEY:{bytes_to_bitstring(key, n_bits)}".encode('utf-8')]
+                    self.m_req_key.inc(result='served')
+                    self.logger.info("Serving QKD key (%d bits) to requester (dpid=%s), %d bits left for %s:%s.",
+                                     n_bits, dpid, self.key_store.depth(pair), pair[0], pair[1])
+                else:
+                    if binary:
+                        replies = [qkd_frame.encode_ack(qkd_frame.STATUS_NO_KEY)]
+                    else:
+                        replies = [b"ERR:NO_KEY_AVAILABLE"]
+                    self.m_req_key.inc(result='no_key')
+                    self.logger.warning("No QKD key available to serve request (%s:%s, %d bits).", pair[0], pair[1], n_bits)
+                if tag is not None:
+                    # Lets the requester keep several requests in flight (ogs_key_daemon.py)
+                    replies = [qkd_frame.encode_tagged(tag, reply) for reply in replies]
+                self._send_qkd_replies(datapath, in_port, data, requester_mac, replies)
+            else:
+                self.m_req_key.inc(result='bad_format')
+                self.logger.warning("Bad QKD payload or unexpected format: %s", payload)
+        except Exception as e:
+            self.logger.exception("QKD handling failed: %s", e)
+
+    def _send_qkd_replies(self, datapath, in_port, request, requester_mac, replies):
+        # Straight back out of the requester's port; replies never cross inter-switch links
+        ofproto = datapath.ofproto
+        parser = datapath.ofproto_parser
+        actions = [parser.OFPActionOutput(in_port)]
+        for reply in replies:
+            out = parser.OFPPacketOut(
+                datapath=datapath,
+                buffer_id=ofproto.OFP_NO_BUFFER,
+                in_port=ofproto.OFPP_CONTROLLER,
+                actions=actions,
+                data=self._craft_eth(requester_mac, request[0:6].hex(':'), QKD_ETHER_TYPE, reply)
+            )
+            self._send_qkd_reply(datapath, out)
+
+    @staticmethod
+    def _key_chunk_bytes(pair, tag):
+        """Key bytes per binary reply frame for pair; 0 if the names do not fit a frame."""
+        if any(len(name.encode('utf-8')) > qkd_frame.MAX_NAME_BYTES for name in pair):
+            return 0
+        overhead = qkd_frame.keys_overhead(*pair)
+        if tag is not None:
+            overhead += qkd_frame.HEADER.size + qkd_frame.TAG.size
+        return min(QKD_MAX_KEY_BYTES_PER_FRAME, QKD_LINK_MTU - overhead)
+
+    def _binary_key_replies(self, key: bytes, n_bits: int, pair, chunk_bytes=QKD_MAX_KEY_BYTES_PER_FRAME):
+        """Splits served key material into MTU-sized KEYS frames, one key ID per frame."""
+        frames = []
+        chunk_bits = chunk_bytes * 8
+        for offset in range(0, n_bits, chunk_bits):
+            bits = min(chunk_bits, n_bits - offset)
+            data = key[offset // 8:offset // 8 + (bits + 7) // 8]
+            frames.append(qkd_frame.encode_keys([(next(self._key_ids), data, bits)], pair[0], pair[1]))
+        return frames
+
+    def _send_qkd_reply(self, datapath, out):
+        """Sends a key reply after QKD_REPLY_DELAY_SEC without blocking event dispatch."""
+        if QKD_REPLY_DELAY_SEC > 0:
+            hub.spawn_after(QKD_REPLY_DELAY_SEC, datapath.send_msg, out)
+        else:
+            datapath.send_msg(out)
 
     def _craft_eth(self, dst_mac: str, src_mac: str, eth_type: int, payload: bytes) -> bytes:
         def mac_to_bytes(mac: str) -> bytes:
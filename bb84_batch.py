@@ -0,0 +1,114 @@
+# -*- coding: utf-8 -*-
+"""
+Vectorized BB84 engine.
+
+Same roles as alice_qkd / eve_qkd in QKD_sdn.py (Alice sends, the receiver
+measures and both sift on matching bases), but N qubits are handled per
+NumPy operation instead of one QuNetSim Qubit and several classical
+messages per bit. Supports channel loss and an optional intercept-resend
+eavesdropper, and estimates the QBER on a sacrificed sample of the sifted key.
+"""
+
+from collections import namedtuple
+
+import numpy as np
+
+BATCH_QUBITS = 1 << 20 # qubits simulated per vectorized round
+QBER_SAMPLE_FRACTION = 0.1 # share of sifted bits disclosed to estimate the QBER
+
+BB84Result = namedtuple('BB84Result', [
+    'alice_key', # sifted key kept by Alice (np.uint8 array of 0/1)
+    'receiver_key', # sifted key kept by the receiver
+    'qber', # error rate measured on the disclosed sample
+    'n_sent', # qubits sent by Alice
+    'n_received', # qubits that survived channel loss
+    'n_sifted', # bits with matching bases, before the QBER sample is removed
+])
+
+
+def check_channel(intercept, loss):
+    """ValueError unless 0 <= intercept <= 1 and 0 <= loss < 1 (with loss 1 no qubit ever arrives)."""
+    if not 0.0 <= intercept <= 1.0:
+        raise ValueError(f"intercept probability must be in [0, 1], got {intercept}")
+    if not 0.0 <= loss < 1.0:
+        raise ValueError(f"loss probability must be in [0, 1), got {loss}")
+
+
+def bb84_round(n_qubits, rng, intercept=0.0, loss=0.0):
+    """
+    Simulates one batch of n_qubits. Returns (alice_bits, receiver_bits, n_arrived):
+    the bits at positions where the qubit arrived and both sides used the same
+    basis, and the number of qubits that survived the channel.
+    intercept: probability that an eavesdropper measures and resends each qubit.
+    loss: probability that a qubit is lost in the channel.
+    """
+    alice_bits = rng.integers(0, 2, n_qubits, dtype=np.uint8)
+    alice_bases = rng.integers(0, 2, n_qubits, dtype=np.uint8)
+
+    # State on the channel: (bit, basis) as prepared by Alice or resent by the eavesdropper
+    channel_bits = alice_bits.copy()
+    channel_bases = alice_bases.copy()
+    if intercept > 0:
+        tapped = rng.random(n_qubits) < intercept
+        eve_bases = rng.integers(0, 2, n_qubits, dtype=np.uint8)
+        eve_bits = np.where(eve_bases == alice_bases, alice_bits,
+                            rng.integers(0, 2, n_qubits, dtype=np.uint8))
+        channel_bits = np.where(tapped, eve_bits, channel_bits)
+        channel_bases = np.where(tapped, eve_bases, channel_bases)
+
+    received = rng.random(n_qubits) >= loss if loss > 0 else np.ones(n_qubits, dtype=bool)
+
+    receiver_bases = rng.integers(0, 2, n_qubits, dtype=np.uint8)
+    receiver_bits = np.where(receiver_bases == channel_bases, channel_bits,
+                             rng.integers(0, 2, n_qubits, dtype=np.uint8))
+
+    # Sifting: the receiver announces its bases, Alice answers with the matches
+    keep = received & (receiver_bases == alice_bases)
+    return alice_bits[keep], receiver_bits[keep], int(received.sum())
+
+
+def generate_sifted_key(key_size, intercept=0.0, loss=0.0, qber_sample=QBER_SAMPLE_FRACTION,
+                        batch_qubits=BATCH_QUBITS, seed=None):
+    """
+    Runs batches until key_size sifted bits remain after the QBER sample is
+    removed. Returns a BB84Result with keys of exactly key_size bits.
+    """
+    check_channel(intercept, loss)
+    if not 0.0 <= qber_sample < 1.0:
+        raise ValueError(f"qber_sample must be in [0, 1), got {qber_sample}")
+    rng = np.random.default_rng(seed)
+    alice_parts, receiver_parts = [], []
+    n_sent = n_received = n_sifted = 0
+    # Enough sifted bits for the key plus the disclosed sample
+    needed = int(np.ceil(key_size / (1.0 - qber_sample)))
+    while n_sifted < needed:
+        # About half of the arriving qubits survive sifting; size the round accordingly
+        expected = 2.2 * (needed - n_sifted) / max(1.0 - loss, 1e-6)
+        n_qubits = int(min(batch_qubits, max(64, expected)))
+        alice_bits, receiver_bits, arrived = bb84_round(n_qubits, rng, intercept, loss)
+        alice_parts.append(alice_bits)
+        receiver_parts.append(receiver_bits)
+        n_sent += n_qubits
+        n_received += arrived
+        n_sifted += len(alice_bits)
+
+    alice_sifted = np.concatenate(alice_parts)
+    receiver_sifted = np.concatenate(receiver_parts)
+
+    # Disclose a random sample to estimate the QBER; those bits are discarded
+    sample = np.zeros(len(alice_sifted), dtype=bool)
+    n_sample = len(alice_sifted) - needed + int(np.ceil(needed * qber_sample))
+    if qber_sample > 0 and n_sample > 0:
+        sample[rng.choice(len(alice_sifted), size=n_sample, replace=False)] = True
+        qber = float(np.mean(alice_sifted[sample] != receiver_sifted[sample]))
+    else:
+        qber = float('nan')
+
+    return BB84Result(
+        alice_key=alice_sifted[~sample][:key_size],
+        receiver_key=receiver_sifted[~sample][:key_size],
+        qber=qber,
+        n_sent=n_sent,
+        n_received=n_received,
+        n_sifted=n_sifted,
+    )
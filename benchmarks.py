@@ -0,0 +1,373 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+"""
+Offline benchmarks for the project's hot paths; no Mininet, switches or network.
+
+Groups (--only selects some):
+ - key_parse:   SatelliteController._parse_incoming_key_payload and
+                _packed_to_bitstring over key sizes (needs Ryu importable);
+ - packet_in:   _packet_in_handler driven by stub datapaths and synthetic
+                ARP / IPv4 / 0x88B5 frames over chains of switches (needs Ryu);
+ - qkd_helpers: qkd_otp packing/XOR and bb84_batch key generation over key
+                sizes, plus the QKD_sdn string wrappers when QuNetSim imports;
+ - link_manager: contact-plan tick evaluation (LinkSchedule, plus
+                SatelliteNetwork._link_manager on an afap clock when Mininet
+                imports) over synthetic interval tables of growing size, and
+                loading them from DataFrames vs a compiled PlanStore.
+A group whose dependencies are missing is skipped.
+
+Every result is the best of --repeat runs, in seconds per operation. --save
+writes them as a JSON baseline; --compare reads one back and flags results
+more than --threshold slower (exit status 1 if any).
+
+usage: python3 benchmarks.py [--quick] [--only packet_in,key_parse] [--save base.json] [--compare base.json]
+"""
+
+import argparse
+import contextlib
+import io
+import json
+import logging
+import os
+import platform
+import random
+import struct
+import sys
+import tempfile
+import time
+import types
+
+import numpy as np
+import pandas as pd
+
+from contact_plan import ContactPlan, LinkSchedule, PlanStore, canonical_names, host_ip, host_mac
+
+KEY_SIZES = (256, 4096, 65536) # bits
+CHAIN_LENGTHS = (4, 16, 64) # switches in the packet-in topology
+PLAN_SIZES = ((10, 200), (100, 5000), (300, 20000)) # (nodes, access intervals)
+REGRESSION_THRESHOLD = 0.25 # fraction slower than the baseline that counts as a regression
+PLAN_DURATION_SEC = 86400
+
+
+def measure(fn, n_ops, repeat):
+    """Best-of-repeat seconds per operation; fn() performs n_ops operations."""
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - start)
+    return best / n_ops
+
+
+def result(results, group, name, params, sec_per_op, n_ops):
+    key = f"{group}.{name}[" + ','.join(f'{k}={v}' for k, v in params.items()) + "]"
+    results[key] = {'group': group, 'params': params, 'sec_per_op': sec_per_op,
+                    'ops_per_sec': 1 / sec_per_op if sec_per_op else None, 'n_ops': n_ops}
+    print(f"    {key:<66} {sec_per_op * 1e6:12.2f} us/op {1 / sec_per_op:14.0f} ops/s")
+
+
+def _random_bits(n_bits, rng):
+    return ''.join(rng.choice('01') for _ in range(n_bits))
+
+
+# ---------- Controller ----------
+class StubDatapath:
+    """Enough of a Ryu Datapath for the handlers: real OpenFlow 1.3 messages, discarded on send."""
+
+    def __init__(self, dpid):
+        from ryu.ofproto import ofproto_v1_3, ofproto_v1_3_parser
+        self.id = dpid
+        self.ofproto = ofproto_v1_3
+        self.ofproto_parser = ofproto_v1_3_parser
+        self.sent = 0
+
+    def send_msg(self, msg):
+        self.sent += 1
+
+
+def _controller():
+    """A SatelliteController without contact plan, metrics endpoint or fixed key port."""
+    import SDNcontroller
+    SDNcontroller.CONTACT_PLAN_NODES_CSV = os.devnull
+    SDNcontroller.METRICS_PORT = 0
+    SDNcontroller.QKD_LISTEN_PORT = 0
+    SDNcontroller.QKD_REPLY_DELAY_SEC = 0
+    SDNcontroller.ARP_PRESEED = False
+    return SDNcontroller.SatelliteController()
+
+
+def _packet_in(datapath, in_port, data):
+    msg = types.SimpleNamespace(datapath=datapath, data=data, match={'in_port': in_port},
+                                buffer_id=datapath.ofproto.OFP_NO_BUFFER)
+    return types.SimpleNamespace(msg=msg)
+
+
+def _mac_bytes(mac):
+    return bytes.fromhex(mac.replace(':', ''))
+
+
+def _arp_request(src_dpid, dst_dpid):
+    src_mac = _mac_bytes(host_mac(src_dpid))
+    arp = struct.pack('!HHBBH6s4s6s4s', 1, 0x0800, 6, 4, 1, src_mac, bytes(map(int, host_ip(src_dpid).split('.'))),
+                      b'\x00' * 6, bytes(map(int, host_ip(dst_dpid).split('.'))))
+    return b'\xff' * 6 + src_mac + b'\x08\x06' + arp
+
+
+def _ipv4(src_dpid, dst_dpid):
+    header = struct.pack('!BBHHHBBH4s4s', 0x45, 0, 20, 0, 0, 64, 17, 0,
+                         bytes(map(int, host_ip(src_dpid).split('.'))), bytes(map(int, host_ip(dst_dpid).split('.'))))
+    return _mac_bytes(host_mac(dst_dpid)) + _mac_bytes(host_mac(src_dpid)) + b'\x08\x00' + header
+
+
+def _chain(ctl, n_switches):
+    """Switches 1..n in a line; host of switch i on port 1, port 2 towards i-1, port 3 towards i+1."""
+    datapaths = {dpid: StubDatapath(dpid) for dpid in range(1, n_switches + 1)}
+    for datapath in datapaths.values():
+        ctl.switch_features_handler(types.SimpleNamespace(msg=types.SimpleNamespace(datapath=datapath)))
+    for u in range(1, n_switches):
+        link = types.SimpleNamespace(src=types.SimpleNamespace(dpid=u, port_no=3),
+                                     dst=types.SimpleNamespace(dpid=u + 1, port_no=2))
+        ctl.link_add_handler(types.SimpleNamespace(link=link))
+    # Every host announces itself once, as it would with its first ARP
+    for dpid, datapath in datapaths.items():
+        ctl._packet_in_handler(_packet_in(datapath, 1, _arp_request(dpid, dpid % n_switches + 1)))
+    return datapaths
+
+
+def bench_key_parse(results, repeat, quick):
+    ctl = _controller()
+    rng = random.Random(1)
+    for n_bits in KEY_SIZES[:2] if quick else KEY_SIZES:
+        bits = _random_bits(n_bits, rng)
+        packed = np.packbits(np.frombuffer(bits.encode('ascii'), dtype=np.uint8) - ord('0')).tobytes().decode('latin-1')
+        payloads = {
+            'KEY_bits': f'KEY:{bits}',
+            'KEY_packed': f'KEY:{packed}',
+            'KEYLEN_packed': f'KEYLEN:{n_bits}:{packed}',
+        }
+        n_ops = max(10, 200000 // n_bits)
+        for fmt, payload in payloads.items():
+            sec = measure(lambda: [ctl._parse_incoming_key_payload(payload) for _ in range(n_ops)], n_ops, repeat)
+            result(results, 'key_parse', 'parse_incoming_key_payload', {'bits': n_bits, 'format': fmt}, sec, n_ops)
+        sec = measure(lambda: [ctl._packed_to_bitstring(packed) for _ in range(n_ops)], n_ops, repeat)
+        result(results, 'key_parse', 'packed_to_bitstring', {'bits': n_bits}, sec, n_ops)
+
+
+def bench_packet_in(results, repeat, quick):
+    for n_switches in CHAIN_LENGTHS[:2] if quick else CHAIN_LENGTHS:
+        ctl = _controller()
+        datapaths = _chain(ctl, n_switches)
+        rng = random.Random(n_switches)
+        pairs = [tuple(rng.sample(range(1, n_switches + 1), 2)) for _ in range(256)]
+        n_ops = len(pairs)
+        frames = {
+            'arp_proxy': [(src, _arp_request(src, dst)) for src, dst in pairs],
+            'ipv4': [(src, _ipv4(src, dst)) for src, dst in pairs],
+        }
+        for kind, packets in frames.items():
+            def run():
+                for src, data in packets:
+                    ctl._packet_in_handler(_packet_in(datapaths[src], 1, data))
+            run() # first pass installs the paths; measure the steady state
+            result(results, 'packet_in', kind, {'switches': n_switches}, measure(run, n_ops, repeat), n_ops)
+
+        n_bits = 256
+        request = _mac_bytes('ff:ff:ff:ff:ff:ff') + _mac_bytes(host_mac(1)) + b'\x88\xb5' + \
+            f'REQ_KEY:OGS1:OGS2:{n_bits}'.encode('ascii')
+        key = os.urandom(n_bits // 8)
+
+        def serve_keys():
+            for _ in range(n_ops):
+                ctl.key_store.put(key, n_bits, ('OGS1', 'OGS2'))
+            for _ in range(n_ops):
+                ctl._packet_in_handler(_packet_in(datapaths[1], 1, request))
+        result(results, 'packet_in', 'qkd_req_key', {'switches': n_switches}, measure(serve_keys, n_ops, repeat), n_ops)
+
+
+# ---------- QKD helpers ----------
+def bench_qkd_helpers(results, repeat, quick):
+    import bb84_batch
+    import qkd_otp
+    try:
+        import QKD_sdn
+    except ImportError:
+        QKD_sdn = None
+        print("    (QuNetSim not importable: QKD_sdn string wrappers skipped, qkd_otp/bb84_batch only)")
+
+    rng = np.random.default_rng(1)
+    for n_bits in KEY_SIZES[:2] if quick else KEY_SIZES:
+        key_array = rng.integers(0, 2, n_bits, dtype=np.uint8)
+        key_bytes = qkd_otp.key_array_to_bytes(key_array)
+        data = bytes(rng.integers(0, 256, len(key_bytes), dtype=np.uint8))
+        n_ops = max(10, 400000 // n_bits)
+        cases = {
+            'otp_key_array_to_bytes': lambda: qkd_otp.key_array_to_bytes(key_array),
+            'otp_key_array_to_bitstring': lambda: qkd_otp.key_array_to_bitstring(key_array),
+            'otp_encrypt_bytes': lambda: qkd_otp.encrypt_bytes(key_bytes, data),
+            'bb84_sifted_key': lambda: bb84_batch.generate_sifted_key(n_bits, seed=1),
+        }
+        if QKD_sdn is not None:
+            key_string = key_bytes.decode('latin-1')
+            text = data.decode('latin-1')
+            cases.update({
+                'key_array_to_key_string': lambda: QKD_sdn.key_array_to_key_string(key_array),
+                'key_array_to_key_string_full': lambda: QKD_sdn.key_array_to_key_string_full(key_array, 4 * len(key_string)),
+                'key_string_to_bitstring': lambda: QKD_sdn.key_string_to_bitstring(key_string),
+                'encrypt': lambda: QKD_sdn.encrypt(key_string, text),
+                'decrypt': lambda: QKD_sdn.decrypt(key_string, text),
+            })
+        for name, fn in cases.items():
+            sec = measure(lambda: [fn() for _ in range(n_ops)], n_ops, repeat)
+            result(results, 'qkd_helpers', name, {'bits': n_bits}, sec, n_ops)
+
+
+# ---------- Link manager ----------
+def synthetic_plan(n_nodes, n_intervals, duration=PLAN_DURATION_SEC, seed=1):
+    """Random nodes/intervals DataFrames shaped like mininet_nodes.csv / mininet_access_intervals.csv."""
+    rng = np.random.default_rng(seed)
+    names = [f'SAT {i}' for i in range(n_nodes)]
+    src = rng.integers(0, n_nodes, n_intervals)
+    dst = (src + rng.integers(1, n_nodes, n_intervals)) % n_nodes
+    start = rng.uniform(0, duration, n_intervals)
+    nodes_df = pd.DataFrame({'NodeName': names})
+    intervals_df = pd.DataFrame({'Source': [names[i] for i in src], 'Target': [names[i] for i in dst],
+                                 'StartTime': start, 'EndTime': start + rng.uniform(60, 3000, n_intervals)})
+    return nodes_df, intervals_df
+
+
+class _NullApplier:
+    max_apply_sec = 0.0
+
+    def apply(self, changes):
+        for _ in changes:
+            pass
+        return 0.0
+
+
+def bench_link_manager(results, repeat, quick):
+    try:
+        import dynamic_sat_net
+        from sim_clock import VirtualClock
+    except ImportError:
+        dynamic_sat_net = None
+        print("    (Mininet not importable: SatelliteNetwork._link_manager skipped, LinkSchedule only)")
+
+    for n_nodes, n_intervals in PLAN_SIZES[:2] if quick else PLAN_SIZES:
+        nodes_df, intervals_df = synthetic_plan(n_nodes, n_intervals)
+        name_map = canonical_names(nodes_df['NodeName'])
+        params = {'nodes': n_nodes, 'intervals': n_intervals}
+        n_events = 2 * n_intervals
+
+        sec = measure(lambda: LinkSchedule(intervals_df, name_map), 1, repeat)
+        result(results, 'link_manager', 'schedule_build', params, sec, 1)
+
+        def replay():
+            schedule = LinkSchedule(intervals_df, name_map)
+            event_time = schedule.next_event_time()
+            while event_time is not None:
+                schedule.advance(event_time)
+                event_time = schedule.next_event_time()
+        result(results, 'link_manager', 'schedule_replay_per_event', params, measure(replay, n_events, repeat), n_events)
+
+        sec = measure(lambda: ContactPlan(nodes_df, intervals_df), 1, repeat)
+        result(results, 'link_manager', 'contact_plan_build', params, sec, 1)
+
+        with tempfile.TemporaryDirectory() as plan_dir:
+            PlanStore.from_frames(name_map, intervals_df).save(plan_dir)
+            sec = measure(lambda: LinkSchedule.from_store(PlanStore.open(plan_dir)), 1, repeat)
+            result(results, 'link_manager', 'schedule_build_store', params, sec, 1)
+            sec = measure(lambda: ContactPlan.from_store(PlanStore.open(plan_dir)), 1, repeat)
+            result(results, 'link_manager', 'contact_plan_build_store', params, sec, 1)
+
+        if dynamic_sat_net is not None:
+            def run_manager():
+                # The real loop on an afap clock; link changes go to a no-op applier
+                net = dynamic_sat_net.SatelliteNetwork.__new__(dynamic_sat_net.SatelliteNetwork)
+                net.schedule = LinkSchedule(intervals_df, name_map)
+                net.links = {pair: None for pair in net.schedule.all_pairs}
+                net.active_links = set()
+                net.current_sim_time = 0
+                net.end_time = float('inf')
+                net.clock = VirtualClock('afap')
+                net.link_applier = _NullApplier()
+                with contextlib.redirect_stdout(io.StringIO()):
+                    net._link_manager()
+            result(results, 'link_manager', 'link_manager_per_event', params,
+                   measure(run_manager, n_events, repeat), n_events)
+
+
+GROUPS = {
+    'key_parse': bench_key_parse,
+    'packet_in': bench_packet_in,
+    'qkd_helpers': bench_qkd_helpers,
+    'link_manager': bench_link_manager,
+}
+
+
+def run(groups, repeat, quick):
+    results = {}
+    logging.disable(logging.WARNING) # handlers log every request; keep the timing about the code
+    try:
+        for group in groups:
+            print(f"[*] {group}")
+            try:
+                GROUPS[group](results, repeat, quick)
+            except ImportError as e:
+                print(f"    skipped: {e}")
+    finally:
+        logging.disable(logging.NOTSET)
+    return results
+
+
+def compare(results, baseline, threshold):
+    """Prints the change of every result present in both; returns the keys that regressed."""
+    regressions = []
+    print(f"\n[*] Compared with baseline ({baseline['meta'].get('created', '?')}), threshold +{threshold:.0%}")
+    for key, current in results.items():
+        previous = baseline['results'].get(key)
+        if previous is None:
+            continue
+        ratio = current['sec_per_op'] / previous['sec_per_op']
+        flag = ''
+        if ratio > 1 + threshold:
+            flag = '  REGRESSION'
+            regressions.append(key)
+        elif ratio < 1 / (1 + threshold):
+            flag = '  faster'
+        print(f"    {key:<66} {ratio:6.2f}x{flag}")
+    missing = sorted(set(baseline['results']) - set(results))
+    if missing:
+        print(f"    {len(missing)} baseline results not run (skipped group or --only)")
+    return regressions
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Offline benchmarks for the controller, QKD helpers and link manager.')
+    parser.add_argument('--only', default=','.join(GROUPS), help='comma-separated groups: ' + ', '.join(GROUPS))
+    parser.add_argument('--repeat', type=int, default=5, help='runs per benchmark, best one kept')
+    parser.add_argument('--quick', action='store_true', help='smaller sizes only')
+    parser.add_argument('--save', default=None, help='write the results as a JSON baseline')
+    parser.add_argument('--compare', default=None, help='JSON baseline to compare against')
+    parser.add_argument('--threshold', type=float, default=REGRESSION_THRESHOLD,
+                        help='slowdown fraction reported as a regression')
+    args = parser.parse_args()
+
+    groups = [g.strip() for g in args.only.split(',') if g.strip()]
+    unknown = [g for g in groups if g not in GROUPS]
+    if unknown:
+        parser.error(f"unknown group(s): {', '.join(unknown)}")
+
+    results = run(groups, args.repeat, args.quick)
+    if args.save:
+        meta = {'created': time.strftime('%Y-%m-%dT%H:%M:%S'), 'python': platform.python_version(),
+                'machine': platform.machine(), 'platform': platform.platform(), 'quick': args.quick,
+                'repeat': args.repeat}
+        with open(args.save, 'w') as f:
+            json.dump({'meta': meta, 'results': results}, f, indent=2, sort_keys=True)
+        print(f"\n[*] Baseline written to {args.save}")
+    if args.compare:
+        with open(args.compare) as f:
+            regressions = compare(results, json.load(f), args.threshold)
+        if regressions:
+            print(f"[!] {len(regressions)} regression(s)")
+            sys.exit(1)
@@ -0,0 +1,340 @@
+# -*- coding: utf-8 -*-
+"""
+Contact plan shared by the Mininet topology and the SDN controller.
+
+Both sides read mininet_nodes.csv / mininet_access_intervals.csv, name node
+i (CSV order, from 1) switch 's<i>' with dpid i, and create the inter-switch
+links in link_order(). With each switch's test host on port 1, the port
+numbers of every link are therefore known before the link ever comes up.
+The test host 'h_s<i>' gets host_ip(i) and host_mac(i).
+
+For long missions the CSVs can be compiled once into a PlanStore directory
+(python3 contact_plan.py <nodes.csv> <intervals.csv> <plan_dir>): integer
+node IDs, start-sorted interval arrays and the node-name dictionary as .npy
+files that are memory-mapped on load, so startup skips CSV parsing and only
+the intervals of the upcoming horizon are ever touched.
+"""
+
+import argparse
+import json
+import os
+import threading
+
+import numpy as np
+import pandas as pd
+
+HOST_PORT = 1 # switch port of each switch's test host (its first link)
+HOST_PREFIX_LEN = 16 # room for constellations beyond 254 nodes
+PLAN_FORMAT_VERSION = 1
+PLAN_HORIZON_SEC = 6 * 3600.0 # simulated seconds of link events materialized at a time
+PLAN_CHUNK_ROWS = 1 << 20 # intervals scanned per step when collecting node pairs
+PLAN_ARRAYS = ('u', 'v', 'start', 'end', 'end_cummax')
+
+
+class PlanStore:
+    """
+    Access intervals as arrays sorted by start time: u < v are the dpids of the
+    two nodes, start/end in simulated seconds, and end_cummax the running
+    maximum of end, which bounds the rows a time window can overlap. name_map
+    is canonical_names() of the node list. Arrays are memory-mapped by open().
+    """
+    def __init__(self, name_map, u, v, start, end, end_cummax=None):
+        self.name_map = name_map
+        self.u = u
+        self.v = v
+        self.start = start
+        self.end = end
+        self.end_cummax = np.maximum.accumulate(end) if end_cummax is None else end_cummax
+        self.last_time = float(self.end_cummax[-1]) if len(end) else float('-inf')
+
+    @classmethod
+    def from_frames(cls, name_map, intervals_df):
+        """Intervals DataFrame (stripped column names) with node names resolved once through name_map."""
+        ids = {raw: dpid_of(canonical) for raw, canonical in name_map.items()}
+        src = intervals_df['Source'].astype(str).str.strip().map(ids).to_numpy(dtype=float)
+        dst = intervals_df['Target'].astype(str).str.strip().map(ids).to_numpy(dtype=float)
+        start = intervals_df['StartTime'].to_numpy(dtype=float)
+        end = intervals_df['EndTime'].to_numpy(dtype=float)
+        # Unknown nodes map to NaN, which fails every comparison
+        keep = (src == src) & (dst == dst) & (src != dst) & (start < end)
+        src, dst, start, end = src[keep], dst[keep], start[keep], end[keep]
+        order = np.argsort(start, kind='stable')
+        u = np.minimum(src, dst)[order].astype(np.int32)
+        v = np.maximum(src, dst)[order].astype(np.int32)
+        return cls(dict(name_map), u, v, start[order], end[order])
+
+    @classmethod
+    def from_csv(cls, nodes_csv, intervals_csv):
+        intervals_df = pd.read_csv(intervals_csv)
+        intervals_df.columns = intervals_df.columns.str.strip()
+        return cls.from_frames(canonical_names(pd.read_csv(nodes_csv)['NodeName']), intervals_df)
+
+    @classmethod
+    def open(cls, path):
+        with open(os.path.join(path, 'meta.json')) as f:
+            meta = json.load(f)
+        if meta.get('version') != PLAN_FORMAT_VERSION:
+            raise ValueError(f"{path}: contact plan format {meta.get('version')}, expected {PLAN_FORMAT_VERSION}")
+        arrays = {name: np.load(os.path.join(path, f'{name}.npy'), mmap_mode='r') for name in PLAN_ARRAYS}
+        # Entry i is the raw name of dpid i + 1; '' where a duplicate name took a later dpid
+        names = np.load(os.path.join(path, 'node_names.npy'))
+        name_map = {str(name): f's{i}' for i, name in enumerate(names, start=1) if name}
+        return cls(name_map, **arrays)
+
+    def save(self, path):
+        os.makedirs(path, exist_ok=True)
+        names = [''] * max((dpid_of(c) for c in self.name_map.values()), default=0)
+        for raw, canonical in self.name_map.items():
+            names[dpid_of(canonical) - 1] = raw
+        np.save(os.path.join(path, 'node_names.npy'), np.array(names, dtype=str))
+        for name in PLAN_ARRAYS:
+            np.save(os.path.join(path, f'{name}.npy'), np.ascontiguousarray(getattr(self, name)))
+        meta = {'version': PLAN_FORMAT_VERSION, 'nodes': len(names), 'intervals': len(self.start),
+                'first_time': float(self.start[0]) if len(self.start) else None,
+                'last_time': self.last_time if len(self.start) else None}
+        with open(os.path.join(path, 'meta.json'), 'w') as f:
+            json.dump(meta, f, indent=1)
+
+    def window_rows(self, t0, t1):
+        """Row range [lo, hi) holding every interval with end >= t0 and start < t1 (plus some that end earlier)."""
+        lo = int(np.searchsorted(self.end_cummax, t0, side='left'))
+        hi = int(np.searchsorted(self.start, t1, side='left'))
+        return lo, max(lo, hi)
+
+    def pairs(self, t0, t1):
+        """(u, v) dpid pairs with an interval overlapping [t0, t1), scanned in chunks."""
+        lo, hi = self.window_rows(t0, t1)
+        codes = np.empty(0, dtype=np.int64)
+        for first in range(lo, hi, PLAN_CHUNK_ROWS):
+            last = min(hi, first + PLAN_CHUNK_ROWS)
+            live = np.asarray(self.end[first:last]) > t0
+            chunk = (np.asarray(self.u[first:last], dtype=np.int64)[live] << 32) | np.asarray(self.v[first:last])[live]
+            codes = np.union1d(codes, chunk)
+        return [(int(code >> 32), int(code & 0xFFFFFFFF)) for code in codes]
+
+
+class LinkSchedule:
+    """
+    Access intervals compiled into a time-sorted up/down event timeline.
+
+    Each interval contributes a +1 event at StartTime and a -1 event at EndTime
+    for its canonical node pair. advance() consumes only the events up to the
+    requested time, so a tick costs O(events in the step), not O(intervals).
+    Intervals outside the simulated window [start_time, end_time) are dropped,
+    so their links never show up in all_pairs. Events are materialized one
+    horizon (PLAN_HORIZON_SEC of simulated time) at a time from the interval
+    arrays, which may be a memory-mapped PlanStore (from_store()). Loading a
+    horizon moves the cursor, so next_event_time() and advance() hold a lock:
+    the clock server asks for the next event while the link manager advances.
+    """
+    def __init__(self, intervals_df, name_map, start_time=0.0, end_time=float('inf'), horizon=PLAN_HORIZON_SEC):
+        self._setup(PlanStore.from_frames(name_map, intervals_df), start_time, end_time, horizon)
+
+    @classmethod
+    def from_store(cls, store, start_time=0.0, end_time=float('inf'), horizon=PLAN_HORIZON_SEC):
+        schedule = cls.__new__(cls)
+        schedule._setup(store, start_time, end_time, horizon)
+        return schedule
+
+    def _setup(self, store, start_time, end_time, horizon):
+        self.store = store
+        self.start_time = float(start_time)
+        self.end_time = float(end_time)
+        self.horizon = horizon
+        self._pairs = {} # (u, v) -> frozenset of canonical names
+        self._links = {} # frozenset of canonical names -> (u, v)
+        self.all_pairs = {self._pair(link) for link in store.pairs(self.start_time, self.end_time)}
+        self._loaded_until = self.start_time
+        self._times = self._deltas = self._events = []
+        self._lock = threading.Lock()
+        self._cursor = 0
+        self._counts = {}
+        self.active = set()
+        self.active_links = set() # self.active as (dpid_u, dpid_v) tuples, u < v
+
+    def _pair(self, link):
+        pair = self._pairs.get(link)
+        if pair is None:
+            pair = self._pairs[link] = frozenset((f's{link[0]}', f's{link[1]}'))
+            self._links[pair] = link
+        return pair
+
+    def _load_next(self):
+        """Materializes the events of the next non-empty horizon; False once the window is exhausted."""
+        store = self.store
+        while self._loaded_until < self.end_time and self._loaded_until <= store.last_time:
+            h0 = self._loaded_until
+            h1 = min(h0 + self.horizon, self.end_time)
+            self._loaded_until = h1
+            lo, hi = store.window_rows(h0, h1)
+            start = np.asarray(store.start[lo:hi])
+            end = np.asarray(store.end[lo:hi])
+            live = end > self.start_time
+            # Intervals already running at start_time come up at start_time
+            ups = live if h0 == self.start_time else live & (start >= h0)
+            downs = live & (end >= h0) & (end < h1)
+            if not ups.any() and not downs.any():
+                continue
+            times = np.concatenate([np.maximum(start[ups], self.start_time), end[downs]])
+            deltas = np.concatenate([np.ones(ups.sum(), dtype=np.int8), -np.ones(downs.sum(), dtype=np.int8)])
+            u = np.asarray(store.u[lo:hi])
+            v = np.asarray(store.v[lo:hi])
+            order = np.lexsort((deltas, times))
+            # Python lists: advance() walks them one event at a time
+            self._times = times[order].tolist()
+            self._deltas = deltas[order].tolist()
+            self._events = [self._pair(link) for link in zip(np.concatenate([u[ups], u[downs]])[order].tolist(),
+                                                             np.concatenate([v[ups], v[downs]])[order].tolist())]
+            self._cursor = 0
+            return True
+        return False
+
+    def next_event_time(self):
+        """Simulated time of the next pending event, or None when exhausted."""
+        with self._lock:
+            if self._cursor >= len(self._times) and not self._load_next():
+                return None
+            return self._times[self._cursor]
+
+    def advance(self, sim_time):
+        """
+        Apply every event with time <= sim_time (intervals are [start, end)).
+        Returns (links_to_bring_up, links_to_bring_down) relative to the
+        previous call.
+        """
+        with self._lock:
+            touched = set()
+            counts = self._counts
+            while self._cursor < len(self._times) or self._load_next():
+                times, deltas, events = self._times, self._deltas, self._events
+                i = self._cursor
+                while i < len(times) and times[i] <= sim_time:
+                    node_pair = events[i]
+                    counts[node_pair] = counts.get(node_pair, 0) + deltas[i]
+                    touched.add(node_pair)
+                    i += 1
+                self._cursor = i
+                if i < len(times):
+                    break
+
+            links_up, links_down = set(), set()
+            for node_pair in touched:
+                if counts[node_pair] > 0:
+                    if node_pair not in self.active:
+                        links_up.add(node_pair)
+                elif node_pair in self.active:
+                    links_down.add(node_pair)
+            if links_up or links_down:
+                self.active |= links_up
+                self.active -= links_down
+                self.active_links |= {self._links[pair] for pair in links_up}
+                self.active_links -= {self._links[pair] for pair in links_down}
+            return links_up, links_down
+
+
+def canonical_names(node_names):
+    """Raw node names in CSV order -> canonical switch names 's1', 's2', ..."""
+    return {str(name).strip(): f's{i}' for i, name in enumerate(node_names, start=1)}
+
+
+def dpid_of(canonical_name):
+    """Mininet derives the datapath ID from the digits of the switch name."""
+    return int(canonical_name[1:])
+
+
+def link_order(pairs):
+    """Order in which inter-switch links are created; fixes their port numbers."""
+    return sorted(pairs, key=lambda pair: sorted(dpid_of(name) for name in pair))
+
+
+def host_ip(dpid):
+    """10.0.0.N up to N = 255, then 10.0.1.0 ...; all hosts share one HOST_PREFIX_LEN subnet."""
+    return f'10.0.{dpid >> 8}.{dpid & 0xff}'
+
+
+def host_mac(dpid):
+    """Same MAC Mininet would pick with autoSetMacs for host_ip(dpid)."""
+    return ':'.join(f'{b:02x}' for b in dpid.to_bytes(6, 'big'))
+
+
+def planned_ports(pairs, first_port=HOST_PORT + 1):
+    """
+    (dpid_u, dpid_v) -> port on u facing v, for links created in link_order()
+    after each switch's host link took port 1.
+    """
+    next_port = {}
+    ports = {}
+    for pair in link_order(pairs):
+        u, v = sorted(dpid_of(name) for name in pair)
+        for a, b in ((u, v), (v, u)):
+            ports[(a, b)] = next_port.get(a, first_port)
+            next_port[a] = ports[(a, b)] + 1
+    return ports
+
+
+class ContactPlan:
+    """
+    The access intervals as a sequence of topology segments.
+
+    segments[i] = (start, end, links) where links is the frozenset of
+    (dpid_u, dpid_v) tuples (u < v) up during [start, end); the last segment
+    ends at infinity. start_time/end_time must match the window the
+    emulation runs, since they decide which links (and ports) exist.
+    """
+    def __init__(self, nodes_df, intervals_df, start_time=0.0, end_time=float('inf')):
+        intervals_df = intervals_df.copy()
+        intervals_df.columns = intervals_df.columns.str.strip()
+        store = PlanStore.from_frames(canonical_names(nodes_df['NodeName']), intervals_df)
+        self._build(store, start_time, end_time)
+
+    def _build(self, store, start_time, end_time):
+        self.name_map = store.name_map
+        self.dpids = sorted(dpid_of(name) for name in self.name_map.values())
+
+        schedule = LinkSchedule.from_store(store, start_time, end_time)
+        self.ports = planned_ports(schedule.all_pairs)
+
+        self.segments = []
+        topologies = {} # passes repeat: segments with the same links share one frozenset
+        start = float(start_time)
+        links = frozenset()
+        while True:
+            event_time = schedule.next_event_time()
+            if event_time is None or event_time >= end_time:
+                break
+            if event_time > start:
+                self.segments.append((start, event_time, links))
+            schedule.advance(event_time)
+            start = max(start, event_time)
+            links = frozenset(schedule.active_links)
+            links = topologies.setdefault(links, links)
+        self.segments.append((start, float('inf'), links))
+
+    @classmethod
+    def from_csv(cls, nodes_csv, intervals_csv, start_time=0.0, end_time=float('inf')):
+        return cls(pd.read_csv(nodes_csv), pd.read_csv(intervals_csv), start_time, end_time)
+
+    @classmethod
+    def from_store(cls, store, start_time=0.0, end_time=float('inf')):
+        """From a PlanStore, e.g. PlanStore.open(plan_dir)."""
+        plan = cls.__new__(cls)
+        plan._build(store, start_time, end_time)
+        return plan
+
+    def segment_index(self, sim_time):
+        """Index of the segment containing sim_time."""
+        for i, (start, end, _) in enumerate(self.segments):
+            if start <= sim_time < end:
+                return i
+        return 0
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Compile the contact-plan CSVs into a memory-mappable PlanStore.')
+    parser.add_argument('nodes_csv')
+    parser.add_argument('intervals_csv')
+    parser.add_argument('plan_dir')
+    args = parser.parse_args()
+    store = PlanStore.from_csv(args.nodes_csv, args.intervals_csv)
+    store.save(args.plan_dir)
+    print(f"Compiled {len(store.start)} intervals between {len(store.name_map)} nodes into {args.plan_dir}")
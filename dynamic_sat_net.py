@@ -2,7 +2,11 @@
 # -*- coding: utf-8 -*-
 
 import time
+import argparse
+import shlex
+import subprocess
 import threading
+from concurrent.futures import ThreadPoolExecutor
 import pandas as pd
 from mininet.net import Mininet
 from mininet.node import RemoteController, OVSKernelSwitch
@@ -10,10 +14,15 @@ from mininet.link import Link
 from mininet.cli import CLI
 from mininet.log import setLogLevel
 from mininet.node import Node
+from contact_plan import LinkSchedule, PlanStore, canonical_names, dpid_of, planned_ports, host_ip, host_mac, HOST_PREFIX_LEN
+from sim_clock import VirtualClock, ClockServer, MODES, SIM_CLOCK_HOST, SIM_CLOCK_PORT, check_speed
 
 # --- Simulation Parameters ---
 SIM_START_TIME_SEC = 0
-TIME_SCALE_FACTOR = 60 #1 sec of simulation time equal to 60 sec of real time
+SIM_END_TIME_SEC = float('inf') # links only active after this are not created
+TIME_SCALE_FACTOR = 60 # realtime clock speed: simulated seconds per wall-clock second
+LINK_APPLY_WORKERS = 8 # namespaces configured concurrently per tick
+BUILD_WORKERS = 16 # switches/hosts created and configured concurrently at startup
 
 class LinuxRouter(Node):
     """A Node with IP forwarding enabled."""
@@ -25,16 +34,109 @@ class LinuxRouter(Node):
         self.cmd('sysctl net.ipv4.ip_forward=0')
         super(LinuxRouter, self).terminate()
 
+class ParallelMininet(Mininet):
+    """Mininet whose host configuration runs on a thread pool; each host has its own shell."""
+    def __init__(self, *args, build_workers=BUILD_WORKERS, **kwargs):
+        self.build_workers = build_workers
+        super(ParallelMininet, self).__init__(*args, **kwargs)
+
+    def configHosts(self):
+        def config(host):
+            if host.defaultIntf():
+                host.configDefault()
+            else:
+                # Don't configure nonexistent intf
+                host.configDefault(ip=None, mac=None)
+        with ThreadPoolExecutor(max_workers=self.build_workers) as executor:
+            list(executor.map(config, self.hosts))
+
+class LinkStateApplier:
+    """
+    Applies every link transition of one tick in a single pass.
+
+    Interface changes are grouped by network namespace and each group is sent
+    as one `ip -batch` invocation; groups run concurrently. Switch interfaces
+    of OVSKernelSwitch live in the root namespace and share one batch.
+    """
+    def __init__(self, max_workers=LINK_APPLY_WORKERS):
+        self.executor = ThreadPoolExecutor(max_workers=max_workers)
+        self.last_apply_sec = 0.0
+        self.max_apply_sec = 0.0
+
+    def apply(self, changes):
+        """
+        changes: iterable of (Link, 'up'|'down'). Blocks until all namespaces
+        are configured and returns the wall-clock apply latency in seconds.
+        """
+        batches = {}
+        for link, status in changes:
+            for intf in (link.intf1, link.intf2):
+                node = intf.node
+                key = node if node.inNamespace else None
+                batches.setdefault(key, []).append(f'link set dev {intf.name} {status}')
+        if not batches:
+            return 0.0
+
+        start = time.time()
+        futures = [self.executor.submit(self._run_batch, node, cmds) for node, cmds in batches.items()]
+        for future in futures:
+            future.result()
+        elapsed = time.time() - start
+
+        self.last_apply_sec = elapsed
+        self.max_apply_sec = max(self.max_apply_sec, elapsed)
+        return elapsed
+
+    @staticmethod
+    def _run_batch(node, cmds):
+        if node is None:
+            script = '\n'.join(cmds) + '\n'
+            result = subprocess.run(['ip', '-force', '-batch', '-'], input=script,
+                                    capture_output=True, text=True)
+            output = result.stderr
+        else:
+            lines = ' '.join(shlex.quote(cmd) for cmd in cmds)
+            output = node.cmd(f"printf '%s\\n' {lines} | ip -force -batch -")
+        if output and output.strip():
+            print(f"[!] ip -batch reported: {output.strip()}")
+
+def link_rounds(link_pairs):
+    """
+    Splits links into rounds in which no switch appears twice (greedy edge
+    colouring). Creating a link configures both switches through their single
+    shell and updates their interface tables, so only links of one round may be
+    created concurrently.
+    """
+    rounds = [] # [(link pairs, switches used)]
+    for link_pair in sorted(link_pairs, key=lambda pair: sorted(map(dpid_of, pair))):
+        for links, used in rounds:
+            if used.isdisjoint(link_pair):
+                break
+        else:
+            links, used = [], set()
+            rounds.append((links, used))
+        links.append(link_pair)
+        used.update(link_pair)
+    return [links for links, _ in rounds]
+
 class SatelliteNetwork:
     """
     Manages the dynamic satellite network topology in Mininet.
     """
-    def __init__(self):
-        self.nodes_df = pd.read_csv('mininet_nodes.csv')
-        self.intervals_df = pd.read_csv('mininet_access_intervals.csv')
-        self.intervals_df.columns = self.intervals_df.columns.str.strip()
+    def __init__(self, clock_mode='realtime', speed=TIME_SCALE_FACTOR, clock_port=SIM_CLOCK_PORT,
+                 start_time=SIM_START_TIME_SEC, end_time=SIM_END_TIME_SEC, build_workers=BUILD_WORKERS,
+                 plan_dir=None):
+        if plan_dir:
+            # Compiled plan (contact_plan.py): memory-mapped, no CSV parsing
+            self.plan = PlanStore.open(plan_dir)
+        else:
+            nodes_df = pd.read_csv('mininet_nodes.csv')
+            intervals_df = pd.read_csv('mininet_access_intervals.csv')
+            intervals_df.columns = intervals_df.columns.str.strip()
+            self.plan = PlanStore.from_frames(canonical_names(nodes_df['NodeName']), intervals_df)
 
-        self.net = Mininet(controller=None, switch=OVSKernelSwitch, build=False, link=Link) 
+        self.net = ParallelMininet(controller=None, switch=OVSKernelSwitch, build=False, link=Link,
+                                   build_workers=build_workers)
         
         self.net.addController('c0',
                                controller=RemoteController,
@@ -44,106 +146,137 @@ class SatelliteNetwork:
         self.switches = {}
         self.name_map = {}
         self.active_links = set()
-        self.current_sim_time = SIM_START_TIME_SEC
+        self.start_time = start_time
+        self.end_time = end_time
+        self.build_workers = build_workers
+        self.startup_times = {}
+        self.current_sim_time = start_time
         self.hosts = {}
+        self.links = {}
+        self.schedule = None
+        self.link_applier = LinkStateApplier()
+        # Link events fire at their exact simulated time; other processes read/drive the clock over clock_port
+        self.clock = VirtualClock(clock_mode, speed, start_time)
+        self.clock_server = ClockServer(self.clock, SIM_CLOCK_HOST, clock_port,
+                                        next_event=lambda: self.schedule.next_event_time() if self.schedule else None)
 
     def _link_manager(self):
         """
         The core loop that manages link state. It only toggles link status up/down.
         """
-        print(f"[*] Link manager started. Timescale: {TIME_SCALE_FACTOR}x")
+        print(f"[*] Link manager started. Clock: {self.clock.mode}, {self.clock.speed:g}x")
         
         while True:
-            should_be_active = set()
-            for index, row in self.intervals_df.iterrows():
-                start_sec = row['StartTime']
-                end_sec = row['EndTime']
-                
-                if start_sec <= self.current_sim_time < end_sec:
-                    orig_name1 = str(row['Source']).strip()
-                    orig_name2 = str(row['Target']).strip()
-                    
-                    if orig_name1 in self.name_map and orig_name2 in self.name_map:
-                        canon_name1 = self.name_map[orig_name1]
-                        canon_name2 = self.name_map[orig_name2]
-                        if canon_name1 != canon_name2:
-                            node_pair = frozenset([canon_name1, canon_name2])
-                            should_be_active.add(node_pair)
-
-            links_to_bring_up = should_be_active - self.active_links
-            links_to_bring_down = self.active_links - should_be_active
+            event_time = self.schedule.next_event_time()
+            if event_time is None or event_time >= self.end_time:
+                print(f"[*] SIM_TIME: {self.current_sim_time}s | contact plan exhausted")
+                return
+            # Sleeps (realtime), jumps (afap) or waits for a STEP (step) until the next boundary
+            self.clock.wait_until(event_time)
+            self.current_sim_time = event_time
+            links_to_bring_up, links_to_bring_down = self.schedule.advance(self.current_sim_time)
 
+            changes = []
             for link_pair in links_to_bring_up:
                 node1, node2 = list(link_pair)
                 print(f"[*] SIM_TIME: {self.current_sim_time}s | LINK UP: {node1}-{node2}")
-                self.net.configLinkStatus(node1, node2, 'up')
+                changes.append((self.links[link_pair], 'up'))
                 self.active_links.add(link_pair)
 
             for link_pair in links_to_bring_down:
                 node1, node2 = list(link_pair)
                 print(f"[*] SIM_TIME: {self.current_sim_time}s | LINK DOWN: {node1}-{node2}")
-                self.net.configLinkStatus(node1, node2, 'down')
+                changes.append((self.links[link_pair], 'down'))
                 self.active_links.remove(link_pair)
-            
-            time.sleep(1)
-            self.current_sim_time += TIME_SCALE_FACTOR
+
+            if changes:
+                elapsed = self.link_applier.apply(changes)
+                print(f"[*] SIM_TIME: {self.current_sim_time}s | applied {len(changes)} link changes "
+                      f"in {elapsed * 1000:.1f} ms (max {self.link_applier.max_apply_sec * 1000:.1f} ms)")
+                lag = self.clock.now() - self.current_sim_time
+                if self.clock.mode == 'realtime' and lag > self.clock.speed:
+                    print(f"[!] Link changes are running {lag:.0f} simulated seconds behind the clock")
+
+    def _add_node(self, canonical_name, dpid):
+        """Switch, test host and the host link (the switch's first port); one per worker."""
+        # Batched: one ovs-vsctl call starts every switch
+        switch = self.net.addSwitch(canonical_name, batch=True)
+        host_name = f'h_{canonical_name}'
+        # Fixed MAC so the controller can pre-seed its ARP proxy (contact_plan.py)
+        host = self.net.addHost(host_name, ip=host_ip(dpid), prefixLen=HOST_PREFIX_LEN, mac=host_mac(dpid))
+        self.net.addLink(host, switch)
+        return canonical_name, switch, host_name, host
 
     def run(self):
         """
-        Builds the network, pre-creates all links in a "down" state, and runs the simulation.
+        Builds the network and runs the simulation. Nodes are created concurrently;
+        only links active at some point of the window are created, already in their
+        state at the start time.
         """
-        print("[*] Building network with nodes as switches...")
-        
-        ip_counter = 1
-        for index, row in self.nodes_df.iterrows():
-            raw_node_name = str(row['NodeName']).strip()
-            canonical_name = f's{ip_counter}'
-            self.name_map[raw_node_name] = canonical_name
-
-            switch = self.net.addSwitch(canonical_name)
-            self.switches[canonical_name] = switch
-            
-            host_name = f'h_{canonical_name}'
-            ip_address = f'10.0.0.{ip_counter}'
-            host = self.net.addHost(host_name, ip=ip_address, prefixLen=24)
-            self.net.addLink(host, switch)
-            self.hosts[host_name] = host
-            
-            print(f"    - Added switch: {canonical_name} (from '{raw_node_name}') with test host: {host_name}")
-            ip_counter += 1
-
-        print("\n[*] Pre-creating all possible links in 'down' state...")
-        all_link_pairs = set()
-        for index, row in self.intervals_df.iterrows():
-            orig_name1 = str(row['Source']).strip()
-            orig_name2 = str(row['Target']).strip()
-
-            if orig_name1 in self.name_map and orig_name2 in self.name_map:
-                canon_name1 = self.name_map[orig_name1]
-                canon_name2 = self.name_map[orig_name2]
-                if canon_name1 != canon_name2:
-                    all_link_pairs.add(frozenset([canon_name1, canon_name2]))
-        
-        for link_pair in all_link_pairs:
-            node1, node2 = list(link_pair)
-            self.net.addLink(self.switches[node1], self.switches[node2])
-            time.sleep(0.01)
-        
-        print(f"[*] Total of {len(all_link_pairs)} inter-switch links pre-created.")
+        build_start = time.time()
+        print(f"[*] Building network with nodes as switches ({self.build_workers} workers)...")
+
+        self.name_map = self.plan.name_map
+        with ThreadPoolExecutor(max_workers=self.build_workers) as executor:
+            futures = [executor.submit(self._add_node, canonical_name, dpid_of(canonical_name))
+                       for canonical_name in self.name_map.values()]
+            for future in futures:
+                canonical_name, switch, host_name, host = future.result()
+                self.switches[canonical_name] = switch
+                self.hosts[host_name] = host
+        # Workers finish in any order; keep Mininet's lists in dpid order
+        self.net.switches.sort(key=lambda node: int(node.name[1:]))
+        self.net.hosts.sort(key=lambda node: int(node.name[3:]))
+        print(f"    - Added {len(self.switches)} switches, each with a test host h_<switch>")
+        self.startup_times['nodes'] = time.time() - build_start
+
+        phase_start = time.time()
+        self.schedule = LinkSchedule.from_store(self.plan, self.start_time, self.end_time)
+        all_link_pairs = self.schedule.all_pairs
+        links_up, _ = self.schedule.advance(self.start_time)
+        self.active_links = set(links_up)
+        self.current_sim_time = self.start_time
+
+        # Explicit ports, the ones the controller predicts (contact_plan.py), so links can be
+        # created concurrently, one round of switch-disjoint links at a time (link_rounds()).
+        # Links active at the start are created up, the rest down (forced down again after start).
+        ports = planned_ports(all_link_pairs)
+
+        def add_link(link_pair):
+            node1, node2 = sorted(link_pair, key=dpid_of)
+            dpid1, dpid2 = dpid_of(node1), dpid_of(node2)
+            up = link_pair in links_up
+            return link_pair, self.net.addLink(self.switches[node1], self.switches[node2],
+                                               port1=ports[(dpid1, dpid2)], port2=ports[(dpid2, dpid1)],
+                                               params1={'up': up}, params2={'up': up})
+
+        rounds = link_rounds(all_link_pairs)
+        with ThreadPoolExecutor(max_workers=self.build_workers) as executor:
+            for links in rounds:
+                self.links.update(executor.map(add_link, links))
+        self.startup_times['links'] = time.time() - phase_start
+        print(f"[*] {len(all_link_pairs)} inter-switch links created in {len(rounds)} rounds ({len(links_up)} up at "
+              f"{self.start_time:g}s); links never active before {self.end_time:g}s were skipped.")
 
         print("\n[*] Starting network...")
+        phase_start = time.time()
         self.net.start()
+        # Switch start-up may bring every port up; put the inactive links back down before the clock runs
+        links_down = [link_pair for link_pair in all_link_pairs if link_pair not in links_up]
+        elapsed = self.link_applier.apply((self.links[link_pair], 'down') for link_pair in links_down)
+        print(f"[*] {len(links_down)} inactive links set down in {elapsed * 1000:.1f} ms")
+        self.startup_times['start'] = time.time() - phase_start
+        self.startup_times['total'] = time.time() - build_start
+        print("[*] Startup: " + ", ".join(f"{phase} {sec:.2f}s" for phase, sec in self.startup_times.items()))
 
-        print("\n[*] Setting all inter-switch links to DOWN state initially...")
-        for link_pair in all_link_pairs:
-            node1, node2 = list(link_pair)
-            self.net.configLinkStatus(node1, node2, 'down')
+        clock_host, clock_port = self.clock_server.start()
+        print(f"[*] Simulation clock on {clock_host}:{clock_port} (python3 sim_clock.py time|pause|resume|step)")
 
         manager_thread = threading.Thread(target=self._link_manager)
         manager_thread.daemon = True
         manager_thread.start()
 
-        print("\n[*] Network is running. All links are initially down.")
+        print("\n[*] Network is running.")
         print("[*] The network is for internal testing only. Hosts cannot reach the internet.\n")
 
         CLI(self.net)
@@ -152,6 +285,26 @@ class SatelliteNetwork:
         self.net.stop()
 
 if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Dynamic satellite network emulation.')
+    parser.add_argument('--clock', choices=MODES, default='realtime',
+                        help='realtime (--speed x), afap (jump from event to event) or step (paused)')
+    parser.add_argument('--speed', type=float, default=TIME_SCALE_FACTOR,
+                        help='simulated seconds per wall-clock second in realtime mode')
+    parser.add_argument('--clock-port', type=int, default=SIM_CLOCK_PORT)
+    parser.add_argument('--start', type=float, default=SIM_START_TIME_SEC, help='simulated start time (s)')
+    parser.add_argument('--end', type=float, default=SIM_END_TIME_SEC,
+                        help='simulated end time (s); links only active later are not created')
+    parser.add_argument('--build-workers', type=int, default=BUILD_WORKERS,
+                        help='switches/hosts created and configured concurrently')
+    parser.add_argument('--plan', default=None, metavar='DIR',
+                        help='compiled contact plan (python3 contact_plan.py) instead of the CSVs')
+    args = parser.parse_args()
+    try:
+        check_speed(args.speed)
+    except ValueError as e:
+        parser.error(f"--speed: {e}")
+
     setLogLevel('info')
-    sat_net = SatelliteNetwork()
+    sat_net = SatelliteNetwork(args.clock, args.speed, args.clock_port, args.start, args.end, args.build_workers,
+                               args.plan)
     sat_net.run()
\ No newline at end of file
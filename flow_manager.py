@@ -0,0 +1,239 @@
+# -*- coding: utf-8 -*-
+"""
+Flow-table bookkeeping for the SDN controller.
+
+FlowManager remembers every flow it installed per datapath, keyed by
+(priority, match). An install identical to a live permanent or idle-timeout
+flow is not sent again; hard-timeout installs are always sent because they
+restart the timer on purpose. Each flow gets a cookie whose top byte encodes
+its kind (COOKIE_KINDS), flows with a timeout ask the switch for a
+FlowRemoved message so the record goes away with the flow, and batch()
+delimits a group of modifications with one barrier per touched switch.
+FAST_FAILOVER groups are tracked the same way: set_failover_group() only
+sends a GroupMod when the bucket ports change.
+
+The read-only counters (occupancy(), flowmod_rate(), stats()) are also called
+from the metrics HTTP thread, so the tables, the cookie index and the rate
+window are guarded by one lock and expired records are only pruned by the
+controller thread.
+"""
+
+import contextlib
+import time
+from collections import deque
+
+try:
+    # Ryu monkey-patches threading; metrics scrapes arrive on a real thread
+    from eventlet import patcher as _patcher
+    _threading = _patcher.original('threading')
+except ImportError:
+    import threading as _threading
+
+COOKIE_KINDS = {
+    'classify': 1, # table-miss / EtherType classification
+    'forward': 2, # reactive shortest-path and MAC-learning flows
+    'plan': 3, # contact-plan flows
+}
+COOKIE_KIND_SHIFT = 56
+FLOWMOD_RATE_WINDOW_SEC = 10
+
+
+class _FlowRecord:
+    __slots__ = ('cookie', 'actions_key', 'idle_timeout', 'hard_timeout', 'expires')
+
+    def __init__(self, cookie, actions_key, idle_timeout, hard_timeout, now):
+        self.cookie = cookie
+        self.actions_key = actions_key
+        self.idle_timeout = idle_timeout
+        self.hard_timeout = hard_timeout
+        self.expires = now + hard_timeout if hard_timeout else None
+
+
+class FlowManager:
+    """
+    Installs and deletes flows on behalf of the controller.
+
+    Matches are passed as dicts of OXM fields (e.g. {'eth_dst': mac}) so they
+    can be used as table keys.
+    """
+
+    def __init__(self, clock=time.monotonic):
+        self.clock = clock
+        self.lock = _threading.Lock() # guards tables, _by_cookie, _recent and counters
+        self.tables = {} # dpid -> {(priority, match_key): _FlowRecord}
+        self.groups = {} # dpid -> {group_id: bucket ports}
+        self._by_cookie = {} # cookie -> (dpid, key)
+        self._seq = 0
+        self._batch_depth = 0
+        self._batch_datapaths = {}
+        self._recent = deque() # (second, flowmods sent in that second)
+        self.counters = {
+            'flowmods': 0,
+            'groupmods': 0,
+            'deletes': 0,
+            'suppressed': 0,
+            'barriers': 0,
+            'batches': 0,
+            'flows_removed': 0,
+        }
+
+    # ---------- installs / deletes ----------
+    def add(self, datapath, priority, match, actions, kind='forward', idle_timeout=0, hard_timeout=0):
+        """Installs a flow unless the same one is already live. Returns True if a FlowMod was sent."""
+        now = self.clock()
+        key = (priority, tuple(sorted(match.items())))
+        actions_key = str(actions)
+        with self.lock:
+            table = self.tables.setdefault(datapath.id, {})
+            self._prune(table, now)
+            record = table.get(key)
+            if (record is not None and not hard_timeout and record.hard_timeout == 0
+                    and record.actions_key == actions_key and record.idle_timeout == idle_timeout):
+                self.counters['suppressed'] += 1
+                return False
+            self._seq += 1
+            cookie = (COOKIE_KINDS[kind] << COOKIE_KIND_SHIFT) | self._seq
+
+        ofproto = datapath.ofproto
+        parser = datapath.ofproto_parser
+        flags = ofproto.OFPFF_SEND_FLOW_REM if idle_timeout or hard_timeout else 0
+        inst = [parser.OFPInstructionActions(ofproto.OFPIT_APPLY_ACTIONS, actions)]
+        mod = parser.OFPFlowMod(datapath=datapath, cookie=cookie, priority=priority,
+                                match=parser.OFPMatch(**match), instructions=inst, flags=flags,
+                                idle_timeout=idle_timeout, hard_timeout=hard_timeout)
+        datapath.send_msg(mod)
+
+        with self.lock:
+            table = self.tables.setdefault(datapath.id, {})
+            record = table.get(key)
+            if record is not None:
+                self._by_cookie.pop(record.cookie, None)
+            table[key] = _FlowRecord(cookie, actions_key, idle_timeout, hard_timeout, now)
+            self._by_cookie[cookie] = (datapath.id, key)
+        self._sent(datapath, now)
+        return True
+
+    def delete(self, datapath, priority, match):
+        """Strict delete of one flow (same priority and match)."""
+        ofproto = datapath.ofproto
+        parser = datapath.ofproto_parser
+        mod = parser.OFPFlowMod(datapath=datapath, command=ofproto.OFPFC_DELETE_STRICT, priority=priority,
+                                out_port=ofproto.OFPP_ANY, out_group=ofproto.OFPG_ANY,
+                                match=parser.OFPMatch(**match))
+        datapath.send_msg(mod)
+        with self.lock:
+            record = self.tables.get(datapath.id, {}).pop((priority, tuple(sorted(match.items()))), None)
+            if record is not None:
+                self._by_cookie.pop(record.cookie, None)
+            self.counters['deletes'] += 1
+        self._sent(datapath, self.clock())
+
+    def set_failover_group(self, datapath, group_id, ports):
+        """
+        FAST_FAILOVER group with one bucket per port, in order, each watching its
+        own port's liveness. Returns True if a GroupMod was sent.
+        """
+        groups = self.groups.setdefault(datapath.id, {})
+        ports = tuple(ports)
+        if groups.get(group_id) == ports:
+            with self.lock:
+                self.counters['suppressed'] += 1
+            return False
+        ofproto = datapath.ofproto
+        parser = datapath.ofproto_parser
+        buckets = [parser.OFPBucket(watch_port=port, watch_group=ofproto.OFPG_ANY,
+                                    actions=[parser.OFPActionOutput(port)]) for port in ports]
+        command = ofproto.OFPGC_MODIFY if group_id in groups else ofproto.OFPGC_ADD
+        datapath.send_msg(parser.OFPGroupMod(datapath=datapath, command=command, type_=ofproto.OFPGT_FF,
+                                             group_id=group_id, buckets=buckets))
+        groups[group_id] = ports
+        self._sent(datapath, self.clock(), 'groupmods')
+        return True
+
+    def delete_groups(self, datapath):
+        """Deletes every group on the switch, e.g. ones left by an earlier controller run."""
+        ofproto = datapath.ofproto
+        parser = datapath.ofproto_parser
+        datapath.send_msg(parser.OFPGroupMod(datapath=datapath, command=ofproto.OFPGC_DELETE,
+                                             group_id=ofproto.OFPG_ALL))
+        self.groups.pop(datapath.id, None)
+        self._sent(datapath, self.clock(), 'groupmods')
+
+    def flow_removed(self, dpid, cookie):
+        """Drops the record of a flow the switch reported as removed (timeout or delete)."""
+        with self.lock:
+            self.counters['flows_removed'] += 1
+            entry = self._by_cookie.pop(cookie, None)
+            if entry is not None and entry[0] == dpid:
+                self.tables.get(dpid, {}).pop(entry[1], None)
+
+    def reset(self, dpid):
+        """Forgets a switch's flows and groups, e.g. when it (re)connects with an empty table."""
+        self.groups.pop(dpid, None)
+        with self.lock:
+            for record in self.tables.pop(dpid, {}).values():
+                self._by_cookie.pop(record.cookie, None)
+
+    # ---------- batching ----------
+    @contextlib.contextmanager
+    def batch(self):
+        """Groups the modifications made inside; each touched switch gets one barrier at the end."""
+        self._batch_depth += 1
+        try:
+            yield self
+        finally:
+            self._batch_depth -= 1
+            if self._batch_depth == 0 and self._batch_datapaths:
+                datapaths = list(self._batch_datapaths.values())
+                self._batch_datapaths.clear()
+                for datapath in datapaths:
+                    datapath.send_msg(datapath.ofproto_parser.OFPBarrierRequest(datapath))
+                    with self.lock:
+                        self.counters['barriers'] += 1
+                with self.lock:
+                    self.counters['batches'] += 1
+
+    def _sent(self, datapath, now, counter='flowmods'):
+        if self._batch_depth:
+            self._batch_datapaths[datapath.id] = datapath
+        second = int(now)
+        with self.lock:
+            self.counters[counter] += 1
+            if self._recent and self._recent[-1][0] == second:
+                self._recent[-1][1] += 1
+            else:
+                self._recent.append([second, 1])
+            while self._recent[0][0] <= second - FLOWMOD_RATE_WINDOW_SEC:
+                self._recent.popleft()
+
+    def _prune(self, table, now):
+        """Drops hard-timeout records past their expiry. Controller thread only, with the lock held."""
+        for key in [k for k, r in table.items() if r.expires is not None and r.expires <= now]:
+            self._by_cookie.pop(table.pop(key).cookie, None)
+
+    # ---------- counters (safe to call from other threads) ----------
+    def occupancy(self, dpid):
+        """Flows believed installed on dpid, not counting hard-timeout flows past their expiry."""
+        now = self.clock()
+        with self.lock:
+            return self._live(self.tables.get(dpid, {}), now)
+
+    @staticmethod
+    def _live(table, now):
+        return sum(1 for r in table.values() if r.expires is None or r.expires > now)
+
+    def flowmod_rate(self):
+        """FlowMods per second over the last FLOWMOD_RATE_WINDOW_SEC."""
+        second = int(self.clock())
+        with self.lock:
+            sent = sum(count for s, count in self._recent if s > second - FLOWMOD_RATE_WINDOW_SEC)
+        return sent / FLOWMOD_RATE_WINDOW_SEC
+
+    def stats(self):
+        """Snapshot of the counters, the FlowMod rate and per-switch occupancy."""
+        now = self.clock()
+        with self.lock:
+            stats = dict(self.counters)
+            stats['table_occupancy'] = {dpid: self._live(table, now) for dpid, table in self.tables.items()}
+        stats['flowmod_rate'] = self.flowmod_rate()
+        return stats
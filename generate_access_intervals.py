@@ -0,0 +1,258 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+"""
+Python replacement for SimulateScenario.m / ExportDataToCSV.m.
+
+Reads every satellite from a TLE file, propagates all of them with SGP4 over
+the scenario time grid in fixed-size time chunks (so memory stays bounded for
+multi-day runs), computes the elevation seen from each OGS and writes
+mininet_nodes.csv / mininet_access_intervals.csv in the format consumed by
+SatelliteNetwork. Results are cached on disk keyed by TLE contents and
+scenario parameters.
+
+usage: python3 generate_access_intervals.py [--tle telesat.tle] [--hours 24] ...
+"""
+
+import argparse
+import hashlib
+import json
+import os
+import shutil
+import time
+from datetime import datetime, timezone
+
+import numpy as np
+import pandas as pd
+from sgp4.api import Satrec, SatrecArray, jday
+
+# --- Scenario defaults (same as SimulateScenario.m) ---
+TLE_FILE = 'telesat.tle'
+START_TIME = datetime(2025, 7, 20, 13, 22, 15, tzinfo=timezone.utc)
+DURATION_HOURS = 24
+SAMPLE_TIME_SEC = 60
+MIN_ELEVATION_DEG = 30
+CHUNK_SAMPLES = 720 # time samples propagated per chunk
+CACHE_DIR = '.access_cache'
+
+NODES_CSV = 'mininet_nodes.csv'
+INTERVALS_CSV = 'mininet_access_intervals.csv'
+
+# name, latitude (deg), longitude (deg), altitude (m)
+GROUND_STATIONS = [
+    ('OGS 1', 33.9164, -118.3541, 0.0), # Hawthorne, California
+    ('OGS 2', 47.6740, -122.1215, 0.0), # Redmond, Washington
+]
+
+WGS84_A_KM = 6378.137
+WGS84_F = 1 / 298.257223563
+
+
+def read_tle(path):
+    """Returns a list of (name, line1, line2) for every satellite in a 2- or 3-line TLE file."""
+    with open(path) as f:
+        lines = [line.rstrip() for line in f if line.strip()]
+    sats = []
+    i = 0
+    while i < len(lines):
+        if lines[i].startswith('1 ') and i + 1 < len(lines) and lines[i + 1].startswith('2 '):
+            name, line1, line2 = f'SAT {len(sats) + 1}', lines[i], lines[i + 1]
+            i += 2
+        else:
+            name, line1, line2 = lines[i].strip(), lines[i + 1], lines[i + 2]
+            i += 3
+        sats.append((name, line1, line2))
+    return sats
+
+
+def geodetic_to_ecef(lat_deg, lon_deg, alt_m):
+    """WGS84 geodetic position -> (ECEF position in km, local 'up' unit vector)."""
+    lat, lon = np.radians(lat_deg), np.radians(lon_deg)
+    e2 = WGS84_F * (2 - WGS84_F)
+    n = WGS84_A_KM / np.sqrt(1 - e2 * np.sin(lat) ** 2)
+    alt_km = alt_m / 1000.0
+    pos = np.array([(n + alt_km) * np.cos(lat) * np.cos(lon),
+                    (n + alt_km) * np.cos(lat) * np.sin(lon),
+                    (n * (1 - e2) + alt_km) * np.sin(lat)])
+    up = np.array([np.cos(lat) * np.cos(lon), np.cos(lat) * np.sin(lon), np.sin(lat)])
+    return pos, up
+
+
+def gmst_rad(jd, fr):
+    """Greenwich mean sidereal time (IAU 1982) for arrays of split Julian dates."""
+    t_ut1 = ((jd - 2451545.0) + fr) / 36525.0
+    gmst_sec = (67310.54841 + (876600.0 * 3600 + 8640184.812866) * t_ut1
+                + 0.093104 * t_ut1 ** 2 - 6.2e-6 * t_ut1 ** 3)
+    return np.mod(gmst_sec * (2 * np.pi / 86400.0), 2 * np.pi)
+
+
+def teme_to_ecef(r_teme, jd, fr):
+    """Rotates TEME positions of shape (n_sat, n_time, 3) into ECEF (polar motion ignored)."""
+    theta = gmst_rad(jd, fr)
+    cos_t, sin_t = np.cos(theta), np.sin(theta)
+    x, y, z = r_teme[..., 0], r_teme[..., 1], r_teme[..., 2]
+    return np.stack([cos_t * x + sin_t * y, -sin_t * x + cos_t * y, z], axis=-1)
+
+
+def elevation_deg(r_ecef, gs_pos, gs_up):
+    """Elevation of every satellite sample above the local horizon of one ground station."""
+    rel = r_ecef - gs_pos
+    rng = np.linalg.norm(rel, axis=-1)
+    return np.degrees(np.arcsin(np.clip(rel @ gs_up / rng, -1.0, 1.0)))
+
+
+def compute_access_intervals(sats, ground_stations, start_time, duration_sec,
+                             sample_sec, min_elevation_deg, chunk_samples=CHUNK_SAMPLES):
+    """
+    Propagates all satellites over [0, duration_sec] in chunks of chunk_samples
+    and returns the access intervals as a DataFrame. Crossing times are
+    linearly interpolated between samples on the elevation curve.
+    """
+    satrecs = [Satrec.twoline2rv(line1, line2) for _, line1, line2 in sats]
+    sat_array = SatrecArray(satrecs)
+    revs_per_sec = np.array([s.no_kozai / (2 * np.pi) / 60.0 for s in satrecs])
+    jd0, fr0 = jday(start_time.year, start_time.month, start_time.day,
+                    start_time.hour, start_time.minute, start_time.second)
+    gs_geo = [geodetic_to_ecef(lat, lon, alt) for _, lat, lon, alt in ground_stations]
+
+    n_sat, n_gs = len(sats), len(ground_stations)
+    times = np.arange(0.0, duration_sec + sample_sec / 2, sample_sec)
+    # Per (gs, sat) carry state between chunks
+    prev_t = None
+    prev_el = np.full((n_gs, n_sat), -90.0)
+    open_start = np.full((n_gs, n_sat), np.nan)
+    found = []
+
+    def close(g, s, t_start, t_end):
+        found.append((s, g, t_start, t_end))
+
+    for c0 in range(0, len(times), chunk_samples):
+        t_chunk = times[c0:c0 + chunk_samples]
+        jd = np.full(t_chunk.shape, jd0)
+        fr = fr0 + t_chunk / 86400.0
+        err, r_teme, _ = sat_array.sgp4(jd, fr)
+        r_ecef = teme_to_ecef(r_teme, jd, fr)
+
+        for g, (gs_pos, gs_up) in enumerate(gs_geo):
+            el = elevation_deg(r_ecef, gs_pos, gs_up)
+            el[err != 0] = -90.0
+            if prev_t is None:
+                # Satellites already visible at scenario start open at t=0
+                for s in np.nonzero(el[:, 0] >= min_elevation_deg)[0]:
+                    open_start[g, s] = t_chunk[0]
+                el_full, t_full = el, t_chunk
+            else:
+                el_full = np.concatenate([prev_el[g][:, None], el], axis=1)
+                t_full = np.concatenate([[prev_t], t_chunk])
+
+            vis = el_full >= min_elevation_deg
+            sat_idx, col = np.nonzero(vis[:, 1:] != vis[:, :-1])
+            if len(sat_idx):
+                el_a, el_b = el_full[sat_idx, col], el_full[sat_idx, col + 1]
+                frac = np.clip((min_elevation_deg - el_a) / (el_b - el_a), 0.0, 1.0)
+                t_cross = t_full[col] + frac * (t_full[col + 1] - t_full[col])
+                rising = vis[sat_idx, col + 1]
+                for s, t_c, up in zip(sat_idx, t_cross, rising):
+                    if up:
+                        open_start[g, s] = t_c
+                    else:
+                        close(g, s, open_start[g, s], t_c)
+                        open_start[g, s] = np.nan
+            prev_el[g] = el[:, -1]
+        prev_t = t_chunk[-1]
+
+    # Intervals still open at the end of the scenario close at the stop time
+    for g, s in zip(*np.nonzero(~np.isnan(open_start))):
+        close(g, s, open_start[g, s], times[-1])
+
+    found.sort()
+    rows = []
+    interval_number = {}
+    for s, g, t_start, t_end in found:
+        t_start, t_end = int(round(t_start)), int(round(t_end))
+        if t_end <= t_start:
+            continue
+        key = (s, g)
+        interval_number[key] = interval_number.get(key, 0) + 1
+        rows.append({
+            'Source': sats[s][0],
+            'Target': ground_stations[g][0],
+            'IntervalNumber': interval_number[key],
+            'StartTime': t_start,
+            'EndTime': t_end,
+            'Duration': t_end - t_start,
+            'StartOrbit': 1 + int(revs_per_sec[s] * t_start),
+            'EndOrbit': 1 + int(revs_per_sec[s] * t_end),
+        })
+    columns = ['Source', 'Target', 'IntervalNumber', 'StartTime', 'EndTime', 'Duration', 'StartOrbit', 'EndOrbit']
+    return pd.DataFrame(rows, columns=columns)
+
+
+def cache_key(tle_path, params):
+    h = hashlib.sha256()
+    with open(tle_path, 'rb') as f:
+        h.update(f.read())
+    h.update(json.dumps(params, sort_keys=True).encode('utf-8'))
+    return h.hexdigest()[:16]
+
+
+def generate(tle_path=TLE_FILE, start_time=START_TIME, duration_hours=DURATION_HOURS,
+             sample_sec=SAMPLE_TIME_SEC, min_elevation_deg=MIN_ELEVATION_DEG,
+             max_sats=None, chunk_samples=CHUNK_SAMPLES, cache_dir=CACHE_DIR,
+             nodes_csv=NODES_CSV, intervals_csv=INTERVALS_CSV):
+    """Writes the nodes and intervals CSVs, reusing a cached result when one exists."""
+    params = {
+        'start': start_time.isoformat(),
+        'duration_hours': duration_hours,
+        'sample_sec': sample_sec,
+        'min_elevation_deg': min_elevation_deg,
+        'max_sats': max_sats,
+        'ground_stations': GROUND_STATIONS,
+    }
+    entry = os.path.join(cache_dir, cache_key(tle_path, params))
+    cached_nodes = os.path.join(entry, NODES_CSV)
+    cached_intervals = os.path.join(entry, INTERVALS_CSV)
+
+    if os.path.exists(cached_nodes) and os.path.exists(cached_intervals):
+        print(f"[*] Using cached access intervals from {entry}")
+    else:
+        sats = read_tle(tle_path)
+        if max_sats is not None:
+            sats = sats[:max_sats]
+        # Node names follow the MATLAB export: SAT <i> in TLE order, then the OGS names
+        sats = [(f'SAT {i + 1}', line1, line2) for i, (_, line1, line2) in enumerate(sats)]
+        print(f"[*] Propagating {len(sats)} satellites over {duration_hours} h "
+              f"({sample_sec} s samples, {chunk_samples} samples per chunk)...")
+        start = time.time()
+        intervals = compute_access_intervals(sats, GROUND_STATIONS, start_time,
+                                             duration_hours * 3600, sample_sec,
+                                             min_elevation_deg, chunk_samples)
+        print(f"[*] Found {len(intervals)} access intervals in {time.time() - start:.2f}s")
+
+        nodes = pd.DataFrame({'NodeName': [name for name, _, _ in sats] + [gs[0] for gs in GROUND_STATIONS]})
+        os.makedirs(entry, exist_ok=True)
+        nodes.to_csv(cached_nodes, index=False)
+        intervals.to_csv(cached_intervals, index=False)
+        with open(os.path.join(entry, 'params.json'), 'w') as f:
+            json.dump(dict(params, tle=os.path.abspath(tle_path)), f, indent=2)
+
+    shutil.copyfile(cached_nodes, nodes_csv)
+    shutil.copyfile(cached_intervals, intervals_csv)
+    print(f"[*] Wrote {nodes_csv} and {intervals_csv}")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Generate Mininet access intervals from a TLE file.')
+    parser.add_argument('--tle', default=TLE_FILE)
+    parser.add_argument('--start', default=START_TIME.strftime('%Y-%m-%dT%H:%M:%S'),
+                        help='scenario start time (UTC, ISO format)')
+    parser.add_argument('--hours', type=float, default=DURATION_HOURS)
+    parser.add_argument('--sample', type=float, default=SAMPLE_TIME_SEC, help='sample time in seconds')
+    parser.add_argument('--min-elevation', type=float, default=MIN_ELEVATION_DEG)
+    parser.add_argument('--max-sats', type=int, default=None, help='only use the first N satellites')
+    parser.add_argument('--chunk', type=int, default=CHUNK_SAMPLES, help='time samples per propagation chunk')
+    parser.add_argument('--cache-dir', default=CACHE_DIR)
+    args = parser.parse_args()
+
+    start_time = datetime.fromisoformat(args.start).replace(tzinfo=timezone.utc)
+    generate(args.tle, start_time, args.hours, args.sample, args.min_elevation,
+             args.max_sats, args.chunk, args.cache_dir)
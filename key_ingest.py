@@ -0,0 +1,391 @@
+# -*- coding: utf-8 -*-
+"""
+Selector-based key ingestion server for the SDN controller.
+
+A single thread multiplexes every producer connection. Producers keep their
+connection open and may pipeline any number of binary KEYS frames
+(qkd_frame.py); each frame is answered with one ACK frame, in order. When the
+target key pool has no room for a frame, the server stops reading from that
+connection until consumers free enough bits (TCP flow control then pushes
+back on the producer) and answers STATUS_FULL if that takes longer than
+BACKPRESSURE_TIMEOUT_SEC. Legacy text pushes (one message per connection)
+are buffered until a newline, EOF or LEGACY_READ_TIMEOUT_SEC without new
+bytes, so a push split across TCP segments arrives whole. They are then
+passed to a text handler and the connection is closed after the reply;
+parse_text_key_push() understands every legacy format.
+"""
+
+import logging
+import re
+import selectors
+import socket
+import time
+
+import qkd_frame
+from key_store import DEFAULT_PAIR
+
+RECV_SIZE = 65536
+OUTBUF_LIMIT = 1024 * 1024 # stop reading from a producer that does not drain its ACKs
+BACKPRESSURE_TIMEOUT_SEC = 5.0
+BACKPRESSURE_POLL_SEC = 0.05
+LEGACY_READ_TIMEOUT_SEC = 0.2 # quiet time that ends a legacy push without newline or EOF
+LEGACY_MAX_BYTES = 16 * 1024 * 1024 # an 8 Mbit bitstring plus prefixes
+
+
+def packed_to_bitstring(packed: str) -> str:
+    """Convert packed string (bytes/chars where each char contains 8 bits) to bitstring '0101...'."""
+    try:
+        data = packed.encode('latin-1')
+    except UnicodeEncodeError:
+        return ''.join(f'{ord(c):08b}' for c in packed)
+    return qkd_frame.bytes_to_bitstring(data, len(data) * 8)
+
+
+def split_key_pair(data: str):
+    """
+    Strip an optional PAIR:<requester>:<peer>: prefix from a pushed payload.
+    Returns tuple ((requester, peer), remaining_payload).
+    """
+    data = data.strip()
+    if data.startswith('PAIR:'):
+        parts = data.split(':', 3)
+        if len(parts) == 4:
+            return (parts[1], parts[2]), parts[3]
+    return DEFAULT_PAIR, data
+
+
+def parse_text_key_payload(data: str):
+    """
+    Handle incoming TCP payloads. Accepts:
+     - KEY:<bitstring>
+     - KEY:<packed_string>   (packed chars)
+     - KEYLEN:<n>:<data>     (data either packed or bits)
+    Any of these may be prefixed with PAIR:<requester>:<peer>: (see split_key_pair).
+    Returns tuple (packed_or_raw, bits_string, n_bits_or_none)
+    """
+    # Normalize
+    data = data.strip()
+    # KEYLEN:<n>:<data>
+    if data.startswith('KEYLEN:'):
+        parts = data.split(':', 2)
+        if len(parts) == 3:
+            try:
+                n_bits = int(parts[1])
+            except ValueError:
+                n_bits = None
+            payload = parts[2]
+            # If payload looks like only 0/1 then treat as bitstring
+            if re.fullmatch(r'[01]+', payload):
+                bits = payload
+                packed = None
+            else:
+                packed = payload
+                bits = packed_to_bitstring(packed)
+            # Trim to n_bits if given
+            if n_bits is not None:
+                bits = bits[:n_bits]
+            return packed, bits, n_bits
+    # KEY:<data>
+    if data.startswith('KEY:'):
+        payload = data.split(':', 1)[1]
+        # If payload looks like bits only -> it's already a bitstring
+        if re.fullmatch(r'[01]+', payload):
+            return None, payload, len(payload)
+        else:
+            # packed chars -> convert
+            packed = payload
+            bits = packed_to_bitstring(packed)
+            return packed, bits, len(bits)
+    # Unknown format
+    return None, None, None
+
+
+def parse_text_key_push(data: str):
+    """Whole legacy push -> (pair, packed_or_raw, bits_string); bits_string is None for a bad format."""
+    pair, data = split_key_pair(data)
+    packed, bits, _ = parse_text_key_payload(data)
+    return pair, packed, bits
+
+
+class _Connection:
+    __slots__ = ('sock', 'addr', 'inbuf', 'outbuf', 'pending', 'paused_since', 'mode', 'closing', 'events',
+                 'last_read')
+
+    def __init__(self, sock, addr):
+        self.sock = sock
+        self.addr = addr
+        self.inbuf = bytearray()
+        self.outbuf = bytearray()
+        self.pending = None # (pair, keys) waiting for room in the key store
+        self.paused_since = None
+        self.mode = None # 'frame' or 'legacy', decided by the first bytes received
+        self.closing = False
+        self.events = 0
+        self.last_read = time.monotonic()
+
+
+class KeyIngestServer:
+    """
+    Long-lived, pipelined key ingestion into a KeyStore.
+
+    text_handler(data: str) -> bytes handles legacy text pushes; without one
+    they are rejected with ERR:BAD_FORMAT. on_store(seconds, n_keys, n_bits)
+    is called after each stored KEYS frame.
+    """
+
+    def __init__(self, key_store, host, port, text_handler=None, logger=None,
+                 backpressure_timeout=BACKPRESSURE_TIMEOUT_SEC, on_store=None):
+        self.key_store = key_store
+        self.host = host
+        self.port = port
+        self.text_handler = text_handler
+        self.logger = logger or logging.getLogger(__name__)
+        self.backpressure_timeout = backpressure_timeout
+        self.on_store = on_store
+        self.selector = selectors.DefaultSelector()
+        self.listener = None
+        self.paused = set()
+        self.legacy_waiting = set() # legacy connections with a push that may not be complete yet
+        self._running = False
+        self.counters = {
+            'connections': 0,
+            'frames': 0,
+            'keys': 0,
+            'bits': 0,
+            'rejected': 0,
+            'backpressure_events': 0,
+        }
+
+    def bind(self):
+        """Binds the listening socket; returns the bound (host, port)."""
+        s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        s.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        s.bind((self.host, self.port))
+        s.listen(128)
+        s.setblocking(False)
+        self.listener = s
+        self.host, self.port = s.getsockname()[:2]
+        self.selector.register(s, selectors.EVENT_READ, None)
+        return self.host, self.port
+
+    def serve_forever(self):
+        if self.listener is None:
+            self.bind()
+        self._running = True
+        while self._running:
+            timeout = BACKPRESSURE_POLL_SEC if self.paused or self.legacy_waiting else 0.5
+            for key, mask in self.selector.select(timeout):
+                if key.data is None:
+                    self._accept()
+                    continue
+                conn = key.data
+                if mask & selectors.EVENT_READ:
+                    self._read(conn)
+                if mask & selectors.EVENT_WRITE and conn.sock is not None:
+                    self._write(conn)
+            if self.paused:
+                self._retry_paused()
+            if self.legacy_waiting:
+                self._flush_legacy()
+        self._shutdown()
+
+    def stop(self):
+        self._running = False
+
+    # ---------- connection handling ----------
+    def _accept(self):
+        while True:
+            try:
+                sock, addr = self.listener.accept()
+            except BlockingIOError:
+                return
+            sock.setblocking(False)
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            conn = _Connection(sock, addr)
+            self.counters['connections'] += 1
+            self._update_interest(conn)
+
+    def _read(self, conn):
+        try:
+            data = conn.sock.recv(RECV_SIZE)
+        except (BlockingIOError, InterruptedError):
+            return
+        except OSError:
+            self._close(conn)
+            return
+        if not data:
+            # Producer closed; flush what is left of the ACKs first
+            conn.closing = True
+            if conn.mode != 'frame' and conn.inbuf:
+                # EOF completes a legacy push
+                conn.mode = 'legacy'
+                self._process_legacy(conn, complete=True)
+            if not conn.outbuf and conn.pending is None:
+                self._close(conn)
+            else:
+                self._update_interest(conn)
+            return
+        conn.inbuf += data
+        conn.last_read = time.monotonic()
+        self._process(conn)
+
+    def _process(self, conn):
+        if conn.mode is None:
+            if len(conn.inbuf) < len(qkd_frame.MAGIC) and qkd_frame.MAGIC.startswith(conn.inbuf):
+                return
+            conn.mode = 'frame' if qkd_frame.is_frame(conn.inbuf) else 'legacy'
+        if conn.mode == 'legacy':
+            self._process_legacy(conn)
+            return
+
+        while conn.pending is None:
+            try:
+                frame = qkd_frame.decode_frame(conn.inbuf)
+                if frame is None:
+                    break
+                msg_type, payload, consumed = frame
+                del conn.inbuf[:consumed]
+                if msg_type != qkd_frame.MSG_KEYS:
+                    raise qkd_frame.FrameError(f"unexpected message type {msg_type}")
+                requester, peer, keys = qkd_frame.decode_keys(payload)
+            except qkd_frame.FrameError as e:
+                self.logger.warning("Rejected QKD push from %s (bad frame): %s", conn.addr, e)
+                self.counters['rejected'] += 1
+                conn.outbuf += qkd_frame.encode_ack(qkd_frame.STATUS_BAD_FORMAT)
+                conn.inbuf.clear()
+                conn.closing = True
+                break
+            pair = (requester, peer) if requester or peer else DEFAULT_PAIR
+            try:
+                stored = self._try_store(conn, pair, keys)
+            except ValueError as e:
+                # Pair names the store cannot hold (shm_key_store.py)
+                self.logger.warning("Rejected QKD push from %s: %s", conn.addr, e)
+                self.counters['rejected'] += 1
+                conn.outbuf += qkd_frame.encode_ack(qkd_frame.STATUS_BAD_FORMAT)
+                conn.inbuf.clear()
+                conn.closing = True
+                break
+            if not stored:
+                conn.pending = (pair, keys)
+                conn.paused_since = time.monotonic()
+                self.paused.add(conn)
+                self.counters['backpressure_events'] += 1
+                self.logger.debug("Key pool %s:%s full; pausing %s", pair[0], pair[1], conn.addr)
+        self._update_interest(conn)
+
+    def _process_legacy(self, conn, complete=False):
+        """Handles the legacy push once complete: at a newline, EOF or LEGACY_READ_TIMEOUT_SEC of quiet."""
+        newline = conn.inbuf.find(b'\n')
+        if not complete and newline < 0 and len(conn.inbuf) < LEGACY_MAX_BYTES:
+            self.legacy_waiting.add(conn)
+            return
+        self.legacy_waiting.discard(conn)
+        end = newline if newline >= 0 else len(conn.inbuf)
+        data = bytes(conn.inbuf[:end]).decode('utf-8', errors='ignore').strip()
+        conn.inbuf.clear()
+        if newline < 0 and end >= LEGACY_MAX_BYTES:
+            self.logger.warning("Rejected legacy QKD push from %s: over %d bytes", conn.addr, LEGACY_MAX_BYTES)
+            self.counters['rejected'] += 1
+            reply = b"ERR:BAD_FORMAT"
+        elif self.text_handler is not None:
+            reply = self.text_handler(data)
+        else:
+            reply = b"ERR:BAD_FORMAT"
+        conn.outbuf += reply
+        conn.closing = True
+        self._update_interest(conn)
+
+    def _flush_legacy(self):
+        now = time.monotonic()
+        for conn in list(self.legacy_waiting):
+            if now - conn.last_read >= LEGACY_READ_TIMEOUT_SEC:
+                self._process_legacy(conn, complete=True)
+
+    def _try_store(self, conn, pair, keys):
+        """Stores keys and queues an ACK if the pool has room for all of them."""
+        total_bits = sum(n_bits for _, _, n_bits in keys)
+        if total_bits > self.key_store.free_bits(pair):
+            return False
+        start = time.perf_counter()
+        for _, data, n_bits in keys:
+            self.key_store.put(data, n_bits, pair)
+        if self.on_store is not None:
+            self.on_store(time.perf_counter() - start, len(keys), total_bits)
+        self.counters['frames'] += 1
+        self.counters['keys'] += len(keys)
+        self.counters['bits'] += total_bits
+        conn.outbuf += qkd_frame.encode_ack(qkd_frame.STATUS_OK, len(keys), total_bits)
+        return True
+
+    def _retry_paused(self):
+        now = time.monotonic()
+        for conn in list(self.paused):
+            pair, keys = conn.pending
+            if self._try_store(conn, pair, keys):
+                stored = True
+            elif now - conn.paused_since > self.backpressure_timeout:
+                self.logger.warning("Key pool %s:%s still full after %.1fs; rejecting push from %s",
+                                    pair[0], pair[1], self.backpressure_timeout, conn.addr)
+                self.counters['rejected'] += 1
+                conn.outbuf += qkd_frame.encode_ack(qkd_frame.STATUS_FULL)
+                stored = True
+            else:
+                stored = False
+            if stored:
+                conn.pending = None
+                conn.paused_since = None
+                self.paused.discard(conn)
+                self._process(conn)
+
+    def _write(self, conn):
+        try:
+            sent = conn.sock.send(conn.outbuf)
+        except (BlockingIOError, InterruptedError):
+            return
+        except OSError:
+            self._close(conn)
+            return
+        del conn.outbuf[:sent]
+        if not conn.outbuf and conn.closing and conn.pending is None:
+            self._close(conn)
+        else:
+            self._update_interest(conn)
+
+    def _update_interest(self, conn):
+        """Reads unless paused or the ACK backlog is too large; writes while ACKs are queued."""
+        if conn.sock is None:
+            return
+        events = 0
+        if conn.pending is None and not conn.closing and len(conn.outbuf) < OUTBUF_LIMIT:
+            events |= selectors.EVENT_READ
+        if conn.outbuf:
+            events |= selectors.EVENT_WRITE
+        if events == conn.events:
+            return
+        if conn.events == 0:
+            self.selector.register(conn.sock, events, conn)
+        elif events == 0:
+            self.selector.unregister(conn.sock)
+        else:
+            self.selector.modify(conn.sock, events, conn)
+        conn.events = events
+
+    def _close(self, conn):
+        if conn.sock is None:
+            return
+        if conn.events:
+            self.selector.unregister(conn.sock)
+            conn.events = 0
+        self.paused.discard(conn)
+        self.legacy_waiting.discard(conn)
+        conn.sock.close()
+        conn.sock = None
+
+    def _shutdown(self):
+        for key in list(self.selector.get_map().values()):
+            if key.data is not None:
+                self._close(key.data)
+        self.selector.unregister(self.listener)
+        self.listener.close()
+        self.listener = None
@@ -0,0 +1,145 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+"""
+Local load generator for the controller's key ingestion path.
+
+Measures pushes/s and ACK latency for
+ - pipelined: the selector server (key_ingest.py) with long-lived producer
+   connections, each keeping up to --window KEYS frames in flight;
+ - per-connection: the previous design, one TCP connection and one server
+   thread per push.
+Both servers run in-process on ephemeral ports. --addr sends the pipelined
+load to a running controller instead.
+
+usage: python3 key_ingest_loadgen.py [--pushes 20000] [--producers 4] [--window 32] [--bits 256]
+"""
+
+import argparse
+import os
+import socket
+import threading
+import time
+from collections import deque
+
+import qkd_frame
+from key_ingest import KeyIngestServer
+from key_store import KeyStore
+
+
+def thread_per_connection_server(key_store, host='127.0.0.1'):
+    """Former _key_listener_worker design: accept, spawn a thread, read one push, ACK, close."""
+    s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    s.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    s.bind((host, 0))
+    s.listen(128)
+
+    def handle(conn):
+        try:
+            msg_type, payload = qkd_frame.recv_frame(conn)
+            requester, peer, keys = qkd_frame.decode_keys(payload)
+            total_bits = 0
+            for _, data, n_bits in keys:
+                key_store.put(data, n_bits, (requester, peer))
+                total_bits += n_bits
+            conn.sendall(qkd_frame.encode_ack(qkd_frame.STATUS_OK, len(keys), total_bits))
+        finally:
+            conn.close()
+
+    def accept_loop():
+        while True:
+            conn, _ = s.accept()
+            threading.Thread(target=handle, args=(conn,), daemon=True).start()
+
+    threading.Thread(target=accept_loop, daemon=True).start()
+    return s.getsockname()[:2]
+
+
+def _producer_pipelined(addr, pushes, window, frame, latencies, statuses):
+    s = socket.create_connection(addr)
+    s.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+    in_flight = deque()
+    sent = 0
+    while sent < pushes or in_flight:
+        while sent < pushes and len(in_flight) < window:
+            in_flight.append(time.perf_counter())
+            s.sendall(frame)
+            sent += 1
+        _, payload = qkd_frame.recv_frame(s)
+        latencies.append(time.perf_counter() - in_flight.popleft())
+        statuses.append(qkd_frame.decode_ack(payload)[0])
+    s.close()
+
+
+def _producer_per_connection(addr, pushes, frame, latencies, statuses):
+    for _ in range(pushes):
+        start = time.perf_counter()
+        s = socket.create_connection(addr)
+        s.sendall(frame)
+        _, payload = qkd_frame.recv_frame(s)
+        s.close()
+        latencies.append(time.perf_counter() - start)
+        statuses.append(qkd_frame.decode_ack(payload)[0])
+
+
+def run_load(addr, mode, pushes, producers, window, bits):
+    """Runs one load pattern; returns a result dict with pushes/s and latency percentiles."""
+    latencies, statuses, threads = [], [], []
+    per_producer = pushes // producers
+    for i in range(producers):
+        frame = qkd_frame.encode_keys([(i, os.urandom((bits + 7) // 8), bits)], f'LOAD{i}', 'PEER')
+        if mode == 'pipelined':
+            args = (addr, per_producer, window, frame, latencies, statuses)
+            target = _producer_pipelined
+        else:
+            args = (addr, per_producer, frame, latencies, statuses)
+            target = _producer_per_connection
+        threads.append(threading.Thread(target=target, args=args))
+
+    start = time.perf_counter()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    elapsed = time.perf_counter() - start
+
+    latencies.sort()
+    n = len(latencies)
+    return {
+        'mode': mode,
+        'pushes': n,
+        'failed': sum(1 for st in statuses if st != qkd_frame.STATUS_OK),
+        'seconds': elapsed,
+        'pushes_per_sec': n / elapsed,
+        'ack_p50_ms': latencies[n // 2] * 1000,
+        'ack_p99_ms': latencies[min(n - 1, int(n * 0.99))] * 1000,
+    }
+
+
+def print_result(r):
+    print(f"[*] {r['mode']:>15}: {r['pushes']} pushes in {r['seconds']:.2f}s = {r['pushes_per_sec']:.0f} pushes/s, "
+          f"ACK p50 {r['ack_p50_ms']:.3f} ms, p99 {r['ack_p99_ms']:.3f} ms, failed {r['failed']}")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Key ingestion load generator.')
+    parser.add_argument('--pushes', type=int, default=20000, help='total pushes per mode')
+    parser.add_argument('--producers', type=int, default=4, help='concurrent producers')
+    parser.add_argument('--window', type=int, default=32, help='frames in flight per pipelined producer')
+    parser.add_argument('--bits', type=int, default=256, help='key bits per push')
+    parser.add_argument('--addr', default=None, help='host:port of a running controller (pipelined mode only)')
+    args = parser.parse_args()
+
+    if args.addr:
+        host, port = args.addr.rsplit(':', 1)
+        print_result(run_load((host, int(port)), 'pipelined', args.pushes, args.producers, args.window, args.bits))
+    else:
+        capacity = args.pushes * args.bits
+        selector_store = KeyStore(max_bits_per_pair=capacity)
+        server = KeyIngestServer(selector_store, '127.0.0.1', 0)
+        selector_addr = server.bind()
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        threaded_addr = thread_per_connection_server(KeyStore(max_bits_per_pair=capacity))
+
+        print_result(run_load(threaded_addr, 'per-connection', args.pushes, args.producers, args.window, args.bits))
+        print_result(run_load(selector_addr, 'pipelined', args.pushes, args.producers, args.window, args.bits))
+        server.stop()
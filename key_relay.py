@@ -0,0 +1,380 @@
+# -*- coding: utf-8 -*-
+"""
+Reliable OGS1 -> OGS2 key relay over UDP.
+
+RelaySender numbers every KEYS datagram within a random session ID
+(qkd_frame.MSG_RELAY) and keeps it until OGS2 acknowledges it. RelayReceiver
+drains the socket in batches and answers each batch with one selective ACK
+per sender (qkd_frame.MSG_SACK): the next sequence number it expects plus
+the ranges it already holds beyond it. The sender drops everything covered,
+resends the gaps below the highest acknowledged sequence at once and
+anything else after a retransmission timeout that backs off while the link
+is down, so nothing is lost across outages and only the gaps travel twice.
+
+Received keys land in an IndexedKeyBuffer: consumers draw a key by the ID
+OGS1 used, or the oldest keys up to a number of bits. Duplicates are dropped
+by sequence number only; key IDs may repeat (controller IDs restart with the
+controller), so every key is kept. A full buffer stops acknowledging new
+datagrams, which makes the sender hold them back. Sender state idle for
+RELAY_SENDER_IDLE_SEC is retired, and the most recent RELAY_RETIRED_SENDERS
+retired states are kept so a sender back from a long outage resumes.
+"""
+
+import os
+import select
+import socket
+import time
+from collections import OrderedDict, deque
+
+import qkd_frame
+
+RELAY_PORT = 6000
+RELAY_WINDOW = 256 # unacknowledged datagrams per sender
+RELAY_MAX_DATAGRAM_KEY_BYTES = 1400 # key material per datagram
+RELAY_RTO_SEC = 0.2
+RELAY_MAX_RTO_SEC = 5.0
+RELAY_FLUSH_TIMEOUT_SEC = 10.0
+RECV_BATCH = 64 # datagrams drained per readable event
+MAX_SACK_RANGES = 64
+KEY_BUFFER_MAX_BITS = 64 * 1024 * 1024
+RELAY_SENDER_IDLE_SEC = 600.0 # sender state kept without datagrams (senders retransmit every RELAY_MAX_RTO_SEC)
+RELAY_RETIRED_SENDERS = 1024
+
+
+class IndexedKeyBuffer:
+    """
+    Received keys, oldest first, indexed by key ID. An ID may be held more than
+    once; get() serves the oldest key with it. Not thread-safe: owned by one
+    event loop.
+    """
+
+    def __init__(self, max_bits=KEY_BUFFER_MAX_BITS):
+        self.max_bits = max_bits
+        self.keys = OrderedDict() # entry number -> (key_id, key_bytes, n_bits, requester, peer)
+        self.by_id = {} # key_id -> deque of entry numbers, oldest first
+        self.bits = 0
+        self._entries = 0
+        self.counters = {'stored': 0, 'reused_ids': 0, 'served': 0}
+
+    def free_bits(self):
+        return self.max_bits - self.bits
+
+    def put(self, key_id, data, n_bits, requester='', peer=''):
+        entries = self.by_id.setdefault(key_id, deque())
+        if entries:
+            self.counters['reused_ids'] += 1
+        self._entries += 1
+        entries.append(self._entries)
+        self.keys[self._entries] = (key_id, bytes(data), n_bits, requester, peer)
+        self.bits += n_bits
+        self.counters['stored'] += 1
+
+    def get(self, key_id):
+        """Removes and returns the oldest (key_id, key_bytes, n_bits) with key_id, or None."""
+        entries = self.by_id.get(key_id)
+        if not entries:
+            return None
+        return self._pop(entries[0])
+
+    def _pop(self, entry):
+        key_id, data, n_bits, _, _ = self.keys.pop(entry)
+        entries = self.by_id[key_id]
+        entries.popleft() # entries of one ID leave oldest first, whichever way they are drawn
+        if not entries:
+            del self.by_id[key_id]
+        self.bits -= n_bits
+        self.counters['served'] += 1
+        return key_id, data, n_bits
+
+    def take(self, n_bits):
+        """Removes the oldest keys holding at least n_bits; returns them, or [] if there are not enough."""
+        if n_bits > self.bits:
+            return []
+        keys = []
+        got = 0
+        while got < n_bits:
+            keys.append(self._pop(next(iter(self.keys))))
+            got += keys[-1][2]
+        return keys
+
+
+def _pack_datagrams(keys, requester, peer, max_key_bytes=RELAY_MAX_DATAGRAM_KEY_BYTES):
+    """Groups keys into KEYS frames of at most max_key_bytes of key material (a larger key travels alone)."""
+    frames, group, size = [], [], 0
+    for key in keys:
+        n_bytes = (key[2] + 7) // 8
+        if group and size + n_bytes > max_key_bytes:
+            frames.append(qkd_frame.encode_keys(group, requester, peer))
+            group, size = [], 0
+        group.append(key)
+        size += n_bytes
+    if group:
+        frames.append(qkd_frame.encode_keys(group, requester, peer))
+    return frames
+
+
+class _Pending:
+    __slots__ = ('datagram', 'sent_at', 'rto', 'retries')
+
+    def __init__(self, datagram):
+        self.datagram = datagram
+        self.sent_at = None
+        self.rto = RELAY_RTO_SEC
+        self.retries = 0
+
+
+class RelaySender:
+    """
+    OGS1 side. send_keys() queues and sends; the owner calls handle_readable()
+    when sock is readable and poll() by next_timeout(), or flush() to block
+    until everything is acknowledged.
+    """
+
+    def __init__(self, dest, window=RELAY_WINDOW):
+        self.dest = dest
+        self.window = window
+        self.session = int.from_bytes(os.urandom(4), 'big')
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.sock.setblocking(False)
+        self.next_seq = 0
+        self.unacked = OrderedDict() # seq -> _Pending, in sequence order
+        self.backlog = deque() # datagrams waiting for window space
+        self.counters = {'datagrams': 0, 'keys': 0, 'retransmits': 0, 'acked': 0, 'sacks': 0}
+
+    def fileno(self):
+        return self.sock.fileno()
+
+    def send_keys(self, keys, requester='', peer=''):
+        keys = list(keys)
+        self.counters['keys'] += len(keys)
+        self.backlog.extend(_pack_datagrams(keys, requester, peer))
+        self._fill_window()
+
+    def _fill_window(self):
+        while self.backlog and len(self.unacked) < self.window:
+            frame = self.backlog.popleft()
+            pending = _Pending(qkd_frame.encode_relay(self.session, self.next_seq, frame))
+            self.unacked[self.next_seq] = pending
+            self.next_seq += 1
+            self.counters['datagrams'] += 1
+            self._transmit(pending)
+
+    def _transmit(self, pending):
+        pending.sent_at = time.monotonic()
+        try:
+            self.sock.sendto(pending.datagram, self.dest)
+        except OSError:
+            # Link down or buffer full: the retransmission timer covers it
+            pass
+
+    def handle_readable(self):
+        while True:
+            try:
+                data = self.sock.recv(65535)
+            except (BlockingIOError, ConnectionRefusedError):
+                break
+            try:
+                frame = qkd_frame.decode_frame(data) if qkd_frame.is_frame(data) else None
+                if frame is None or frame[0] != qkd_frame.MSG_SACK:
+                    continue
+                session, next_seq, ranges = qkd_frame.decode_sack(frame[1])
+            except qkd_frame.FrameError:
+                continue
+            if session == self.session:
+                self._on_sack(next_seq, ranges)
+        self._fill_window()
+
+    def _on_sack(self, next_seq, ranges):
+        self.counters['sacks'] += 1
+        acked = [seq for seq in self.unacked if seq < next_seq]
+        for first, last in ranges:
+            acked.extend(seq for seq in range(first, last + 1) if seq in self.unacked)
+        for seq in acked:
+            if self.unacked.pop(seq, None) is not None:
+                self.counters['acked'] += 1
+        if acked:
+            # The link is back: drop the outage backoff
+            for pending in self.unacked.values():
+                pending.rto = RELAY_RTO_SEC
+        if not ranges:
+            return
+        # Gaps below the highest range were lost, not just late: resend them now
+        highest = max(last for _, last in ranges)
+        now = time.monotonic()
+        for seq, pending in self.unacked.items():
+            if seq > highest:
+                break
+            if now - pending.sent_at >= RELAY_RTO_SEC / 4:
+                self.counters['retransmits'] += 1
+                self._transmit(pending)
+
+    def poll(self):
+        """Retransmits datagrams whose timer expired, with exponential backoff."""
+        now = time.monotonic()
+        for pending in self.unacked.values():
+            if now - pending.sent_at >= pending.rto:
+                pending.retries += 1
+                pending.rto = min(pending.rto * 2, RELAY_MAX_RTO_SEC)
+                self.counters['retransmits'] += 1
+                self._transmit(pending)
+
+    def next_timeout(self):
+        """Seconds until the next retransmission is due, or None when nothing is outstanding."""
+        if not self.unacked:
+            return None
+        now = time.monotonic()
+        return max(0.0, min(p.sent_at + p.rto for p in self.unacked.values()) - now)
+
+    @property
+    def idle(self):
+        return not self.unacked and not self.backlog
+
+    def flush(self, timeout=RELAY_FLUSH_TIMEOUT_SEC):
+        """Blocks until every datagram is acknowledged; returns False on timeout."""
+        deadline = time.monotonic() + timeout
+        while not self.idle:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return False
+            due = self.next_timeout()
+            wait = remaining if due is None else min(remaining, due)
+            readable, _, _ = select.select([self.sock], [], [], wait)
+            if readable:
+                self.handle_readable()
+            self.poll()
+        return True
+
+    def close(self):
+        self.sock.close()
+
+
+class _SenderState:
+    __slots__ = ('next_seq', 'received', 'last_seen')
+
+    def __init__(self):
+        self.next_seq = 0
+        self.received = set() # sequence numbers held beyond next_seq
+        self.last_seen = time.monotonic()
+
+    def ranges(self):
+        ranges = []
+        for seq in sorted(self.received):
+            if ranges and ranges[-1][1] == seq - 1:
+                ranges[-1][1] = seq
+            else:
+                ranges.append([seq, seq])
+        return [tuple(r) for r in ranges[:MAX_SACK_RANGES]]
+
+
+class RelayReceiver:
+    """
+    OGS2 side. drain() reads up to RECV_BATCH datagrams, stores their keys and
+    sends one SACK per sender; on_keys(requester, peer, keys, addr) is called for
+    every new KEYS payload. Legacy unsequenced KEYS frames and KEY:<bits> text
+    are stored too, without acknowledgement.
+    """
+
+    def __init__(self, buffer, host='0.0.0.0', port=RELAY_PORT, on_keys=None):
+        self.buffer = buffer
+        self.on_keys = on_keys
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.sock.bind((host, port))
+        self.sock.setblocking(False)
+        self.address = self.sock.getsockname()[:2]
+        self.senders = {} # (addr, session) -> _SenderState
+        self.retired = OrderedDict() # idle senders, most recently retired last
+        self._next_expiry = time.monotonic() + RELAY_SENDER_IDLE_SEC
+        self._legacy_ids = iter(range(1 << 62, 1 << 63)) # IDs for text keys, clear of real ones
+        self.counters = {'datagrams': 0, 'duplicates': 0, 'held_back': 0, 'sacks': 0, 'batches': 0, 'legacy': 0,
+                         'senders_retired': 0}
+
+    def fileno(self):
+        return self.sock.fileno()
+
+    def drain(self):
+        """Handles one batch of datagrams; returns how many were read."""
+        to_ack = {}
+        n = 0
+        while n < RECV_BATCH:
+            try:
+                data, addr = self.sock.recvfrom(65535)
+            except BlockingIOError:
+                break
+            n += 1
+            try:
+                self._handle(data, addr, to_ack)
+            except (qkd_frame.FrameError, UnicodeDecodeError) as e:
+                print(f"[OGS2] Bad datagram from {addr}: {e}")
+        for (addr, session), state in to_ack.items():
+            self.counters['sacks'] += 1
+            try:
+                self.sock.sendto(qkd_frame.encode_sack(session, state.next_seq, state.ranges()), addr)
+            except OSError:
+                pass
+        if n:
+            self.counters['batches'] += 1
+        if time.monotonic() >= self._next_expiry:
+            self.expire_senders()
+        return n
+
+    def expire_senders(self, idle=RELAY_SENDER_IDLE_SEC):
+        """Retires sender state without datagrams for idle seconds; keeps the newest RELAY_RETIRED_SENDERS."""
+        now = time.monotonic()
+        for sender, state in list(self.senders.items()):
+            if now - state.last_seen >= idle:
+                del self.senders[sender]
+                self.retired[sender] = state
+                self.counters['senders_retired'] += 1
+        while len(self.retired) > RELAY_RETIRED_SENDERS:
+            self.retired.popitem(last=False)
+        self._next_expiry = now + idle / 10
+
+    def _handle(self, data, addr, to_ack):
+        self.counters['datagrams'] += 1
+        if not qkd_frame.is_frame(data):
+            msg = data.decode('utf-8').strip()
+            if msg.startswith('KEY:'):
+                bits = msg.split(':', 1)[1]
+                if not bits or bits.strip('01'):
+                    raise qkd_frame.FrameError(f"text key is not a bitstring: {msg[:40]!r}")
+                self._store('', '', [(next(self._legacy_ids), qkd_frame.bitstring_to_bytes(bits), len(bits))], addr)
+            return
+        frame = qkd_frame.decode_frame(data)
+        if frame is None:
+            raise qkd_frame.FrameError("truncated frame")
+        msg_type, payload, _ = frame
+        if msg_type == qkd_frame.MSG_KEYS:
+            self.counters['legacy'] += 1
+            self._store(*qkd_frame.decode_keys(payload), addr)
+            return
+        if msg_type != qkd_frame.MSG_RELAY:
+            return
+        session, seq, keys_payload = qkd_frame.decode_relay(payload)
+        state = self.senders.get((addr, session))
+        if state is None:
+            # A retired sender resumes where it was: its old sequence numbers were already acknowledged
+            state = self.senders[(addr, session)] = self.retired.pop((addr, session), None) or _SenderState()
+        state.last_seen = time.monotonic()
+        to_ack[(addr, session)] = state
+        if seq < state.next_seq or seq in state.received:
+            self.counters['duplicates'] += 1
+            return
+        requester, peer, keys = qkd_frame.decode_keys(keys_payload)
+        if sum(k[2] for k in keys) > self.buffer.free_bits():
+            # Not acknowledged: the sender keeps it and retries once consumers made room
+            self.counters['held_back'] += 1
+            return
+        self._store(requester, peer, keys, addr)
+        state.received.add(seq)
+        while state.next_seq in state.received:
+            state.received.remove(state.next_seq)
+            state.next_seq += 1
+
+    def _store(self, requester, peer, keys, addr):
+        for key_id, data, n_bits in keys:
+            self.buffer.put(key_id, data, n_bits, requester, peer)
+        if self.on_keys is not None:
+            self.on_keys(requester, peer, keys, addr)
+
+    def close(self):
+        self.sock.close()
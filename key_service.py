@@ -0,0 +1,96 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+"""
+Out-of-process key management service.
+
+Owns the key material in a shared-memory store (shm_key_store.py) and runs
+the key ingestion server (key_ingest.py) on 127.0.0.1:7001 in its own
+process, so parsing and storing pushes no longer competes with OpenFlow event
+handling for the controller's interpreter. Start it before the controller and
+point the controller at the store:
+
+    python3 key_service.py &
+    KEY_SERVICE_SHM=qsdn_keys ryu-manager --observe-links SDNcontroller.py
+
+Producers keep pushing over TCP, or write into the store directly
+(python3 QKD_sdn.py --shm qsdn_keys).
+
+usage: python3 key_service.py [--name qsdn_keys] [--port 7001] [--slots 64] [--slot-bytes 1048576]
+"""
+
+import argparse
+import logging
+import signal
+import threading
+import time
+
+from qkd_frame import bitstring_to_bytes
+from key_ingest import KeyIngestServer, parse_text_key_push
+from shm_key_store import SharedKeyStore, SHM_KEY_STORE_NAME, SHM_KEY_SLOTS, SHM_KEY_SLOT_BYTES
+
+KEY_SERVICE_HOST = '127.0.0.1'
+KEY_SERVICE_PORT = 7001
+STATS_INTERVAL_SEC = 30.0
+
+
+class KeyService:
+    """KeyIngestServer in front of a SharedKeyStore this process owns."""
+
+    def __init__(self, name=SHM_KEY_STORE_NAME, host=KEY_SERVICE_HOST, port=KEY_SERVICE_PORT,
+                 slots=SHM_KEY_SLOTS, slot_bytes=SHM_KEY_SLOT_BYTES):
+        self.store = SharedKeyStore.create(name, slots, slot_bytes)
+        self.server = KeyIngestServer(self.store, host, port, text_handler=self._handle_text_key_push,
+                                      logger=logging.getLogger('key_service'))
+        self.text_keys = 0
+
+    def _handle_text_key_push(self, data: str) -> bytes:
+        pair, _, bits = parse_text_key_push(data)
+        if bits is None:
+            return b"ERR:BAD_FORMAT"
+        try:
+            self.store.put(bitstring_to_bytes(bits), len(bits), pair)
+        except ValueError:
+            return b"ERR:BAD_FORMAT"
+        self.text_keys += 1
+        return f"ACK:OK:bits={len(bits)}".encode('utf-8')
+
+    def serve_forever(self, stats_interval=STATS_INTERVAL_SEC):
+        host, port = self.server.bind()
+        print(f"[KEYS] Store {self.store.shm.name!r}: {self.store.slots} pair slots of "
+              f"{self.store.max_bits_per_pair} bits; listening on {host}:{port}")
+        if stats_interval:
+            threading.Thread(target=self._report, args=(stats_interval,), daemon=True).start()
+        try:
+            self.server.serve_forever()
+        finally:
+            self.store.close()
+
+    def stop(self):
+        self.server.stop()
+
+    def _report(self, interval):
+        while True:
+            time.sleep(interval)
+            stats = self.store.stats()
+            print(f"[KEYS] {stats['pairs']} pairs, {stats['total_depth_bits']} bits held, "
+                  f"{stats['bits_pushed']} pushed, {stats['bits_served']} served, "
+                  f"{stats['bits_dropped']} dropped, {self.server.counters['frames']} frames, "
+                  f"{self.text_keys} text pushes")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Key management service with a shared-memory key store.')
+    parser.add_argument('--name', default=SHM_KEY_STORE_NAME, help='shared memory name (KEY_SERVICE_SHM)')
+    parser.add_argument('--host', default=KEY_SERVICE_HOST)
+    parser.add_argument('--port', type=int, default=KEY_SERVICE_PORT)
+    parser.add_argument('--slots', type=int, default=SHM_KEY_SLOTS, help='(requester, peer) pairs')
+    parser.add_argument('--slot-bytes', type=int, default=SHM_KEY_SLOT_BYTES, help='ring size per pair')
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+    service = KeyService(args.name, args.host, args.port, args.slots, args.slot_bytes)
+    # Unlink the segment on a normal stop too
+    signal.signal(signal.SIGTERM, lambda *_: service.stop())
+    try:
+        service.serve_forever()
+    except KeyboardInterrupt:
+        pass
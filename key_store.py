@@ -0,0 +1,166 @@
+# -*- coding: utf-8 -*-
+"""
+Thread-safe QKD key store used by the SDN controller.
+
+Key material is kept per (requester, peer) pair as packed bytes with bit
+offsets, so pushes append raw bits and every request consumes exactly the
+number of bits it asks for. Material pushed without a pair lands in a shared
+pool that any pair can draw from once its own pool is empty; consumed bits
+are never handed out twice.
+"""
+
+import threading
+from collections import OrderedDict
+
+DEFAULT_PAIR = ('*', '*')
+KEY_POOL_MAX_BITS = 8 * 1024 * 1024 # per pair; oldest bits are evicted beyond this
+KEY_POOL_MAX_PAIRS = 1024 # least recently used pools are evicted beyond this
+
+
+class KeyPool:
+    """A FIFO of key bits stored packed in a bytearray between two bit offsets."""
+
+    def __init__(self, max_bits=KEY_POOL_MAX_BITS):
+        self.buf = bytearray()
+        self.start_bit = 0
+        self.end_bit = 0
+        self.max_bits = max_bits
+        self.lock = threading.Lock()
+
+    @property
+    def depth(self):
+        return self.end_bit - self.start_bit
+
+    def append(self, data: bytes, n_bits: int):
+        """Appends the first n_bits of data. Returns the number of bits evicted."""
+        rem = self.end_bit % 8
+        if rem == 0:
+            del self.buf[self.end_bit // 8:]
+            self.buf += data[:(n_bits + 7) // 8]
+        else:
+            # Merge the new bits behind the partial last byte
+            old = self.buf[-1] >> (8 - rem)
+            new = int.from_bytes(data, 'big') >> (len(data) * 8 - n_bits)
+            total = rem + n_bits
+            pad = (-total) % 8
+            merged = ((old << n_bits) | new) << pad
+            self.buf[-1:] = merged.to_bytes((total + pad) // 8, 'big')
+        self.end_bit += n_bits
+
+        evicted = 0
+        if self.depth > self.max_bits:
+            evicted = self.depth - self.max_bits
+            self.start_bit += evicted
+        self._compact()
+        return evicted
+
+    def take(self, n_bits: int):
+        """Removes and returns the oldest n_bits as packed bytes, or None if not enough are stored."""
+        if n_bits <= 0 or self.depth < n_bits:
+            return None
+        start = self.start_bit
+        byte_start, byte_end = start // 8, (start + n_bits + 7) // 8
+        if start % 8 == 0 and n_bits % 8 == 0:
+            out = bytes(self.buf[byte_start:byte_end])
+        else:
+            chunk = int.from_bytes(self.buf[byte_start:byte_end], 'big')
+            chunk >>= (byte_end - byte_start) * 8 - (start % 8) - n_bits
+            chunk &= (1 << n_bits) - 1
+            pad = (-n_bits) % 8
+            out = (chunk << pad).to_bytes((n_bits + pad) // 8, 'big')
+        self.start_bit += n_bits
+        self._compact()
+        return out
+
+    def _compact(self):
+        drop = self.start_bit // 8
+        if drop and drop * 2 >= len(self.buf):
+            del self.buf[:drop]
+            self.start_bit -= drop * 8
+            self.end_bit -= drop * 8
+
+
+class KeyStore:
+    """
+    Per-pair key pools with bounded capacity and depth/usage counters.
+    """
+
+    def __init__(self, max_bits_per_pair=KEY_POOL_MAX_BITS, max_pairs=KEY_POOL_MAX_PAIRS):
+        self.max_bits_per_pair = max_bits_per_pair
+        self.max_pairs = max_pairs
+        self.pools = OrderedDict()
+        self.lock = threading.Lock()
+        self.counters = {
+            'bits_pushed': 0,
+            'bits_served': 0,
+            'bits_evicted': 0,
+            'requests_served': 0,
+            'requests_failed': 0,
+            'pools_evicted': 0,
+        }
+
+    def _pool(self, pair, create):
+        with self.lock:
+            pool = self.pools.get(pair)
+            if pool is not None:
+                self.pools.move_to_end(pair)
+            elif create:
+                pool = self.pools[pair] = KeyPool(self.max_bits_per_pair)
+                while len(self.pools) > self.max_pairs:
+                    # Never evict the shared pool or the pool being created
+                    victim = next((p for p in self.pools if p not in (DEFAULT_PAIR, pair)), None)
+                    if victim is None:
+                        break
+                    old = self.pools.pop(victim)
+                    self.counters['pools_evicted'] += 1
+                    self.counters['bits_evicted'] += old.depth
+            return pool
+
+    def _count(self, **deltas):
+        with self.lock:
+            for name, delta in deltas.items():
+                self.counters[name] += delta
+
+    def put(self, data: bytes, n_bits: int, pair=DEFAULT_PAIR):
+        """Appends n_bits of packed key material to the pool of pair. Returns the new pool depth."""
+        pool = self._pool(tuple(pair), create=True)
+        with pool.lock:
+            evicted = pool.append(data, n_bits)
+            depth = pool.depth
+        self._count(bits_pushed=n_bits, bits_evicted=evicted)
+        return depth
+
+    def take(self, n_bits: int, pair=DEFAULT_PAIR):
+        """
+        Consumes exactly n_bits for pair, falling back to the shared pool.
+        Returns packed bytes or None if neither pool holds enough material.
+        """
+        for candidate in (tuple(pair), DEFAULT_PAIR):
+            pool = self._pool(candidate, create=False)
+            if pool is None:
+                continue
+            with pool.lock:
+                out = pool.take(n_bits)
+            if out is not None:
+                self._count(bits_served=n_bits, requests_served=1)
+                return out
+        self._count(requests_failed=1)
+        return None
+
+    def depth(self, pair=DEFAULT_PAIR):
+        pool = self._pool(tuple(pair), create=False)
+        return 0 if pool is None else pool.depth
+
+    def free_bits(self, pair=DEFAULT_PAIR):
+        """Bits that can still be pushed for pair without evicting older material."""
+        return self.max_bits_per_pair - self.depth(pair)
+
+    def stats(self):
+        """Counters plus the current depth (in bits) of every pool."""
+        with self.lock:
+            pools = list(self.pools.items())
+            stats = dict(self.counters)
+        stats['pairs'] = len(pools)
+        stats['pool_depth_bits'] = {f'{a}:{b}': pool.depth for (a, b), pool in pools}
+        stats['total_depth_bits'] = sum(stats['pool_depth_bits'].values())
+        return stats
@@ -0,0 +1,278 @@
+# -*- coding: utf-8 -*-
+"""
+In-process metrics and profiling for the SDN controller.
+
+Registry holds counters, histograms and callback metrics (values read from
+existing counters such as KeyStore.stats() at scrape time) and renders them
+in the Prometheus text exposition format. MetricsServer serves
+
+    GET /metrics                  Prometheus text format
+    GET /profile/start[?interval=0.005]
+    GET /profile/stop             collapsed stacks ("frame;frame;frame count"),
+                                  ready for flamegraph.pl / speedscope
+    GET /profile                  profiler status
+
+SamplingProfiler samples the stacks of every other thread from a native OS
+thread, so it also sees the eventlet hub thread Ryu runs its handlers on.
+"""
+
+import bisect
+import contextlib
+import sys
+import time
+from collections import Counter as _Tally
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+
+try:
+    # Ryu monkey-patches threading with green threads; the sampler needs a real one
+    from eventlet import patcher as _patcher
+    _threading = _patcher.original('threading')
+except ImportError:
+    import threading as _threading
+
+# Seconds; suited to packet-in and FlowMod handling (tens of us to a few ms)
+DEFAULT_BUCKETS = (0.00001, 0.000025, 0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005,
+                   0.01, 0.025, 0.05, 0.1, 0.25, 1.0)
+PROFILE_INTERVAL_SEC = 0.005
+
+
+def _escape_label(value):
+    """Label value escaping of the Prometheus text format; pair names come from the network."""
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ''
+    return '{' + ','.join(f'{k}="{_escape_label(v)}"' for k, v in pairs) + '}'
+
+
+class _Metric:
+    def __init__(self, name, help_text, labelnames=()):
+        self.name = name
+        self.help = help_text
+        self.labelnames = tuple(labelnames)
+        self.lock = _threading.Lock()
+
+    def _key(self, labels):
+        return tuple(labels.get(name, '') for name in self.labelnames)
+
+
+class Counter(_Metric):
+    kind = 'counter'
+
+    def __init__(self, name, help_text, labelnames=()):
+        super().__init__(name, help_text, labelnames)
+        self.values = {}
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+    def render(self):
+        with self.lock:
+            values = list(self.values.items())
+        return [f'{self.name}{_format_labels(self.labelnames, key)} {value}' for key, value in values]
+
+
+class Histogram(_Metric):
+    kind = 'histogram'
+
+    def __init__(self, name, help_text, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, help_text, labelnames)
+        self.buckets = tuple(buckets)
+        self.series = {} # label key -> [bucket counts..., +Inf count, sum]
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self.lock:
+            series = self.series.get(key)
+            if series is None:
+                series = self.series[key] = [0] * (len(self.buckets) + 1) + [0.0]
+            series[index] += 1
+            series[-1] += value
+
+    @contextlib.contextmanager
+    def time(self, **labels):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def render(self):
+        with self.lock:
+            series = [(key, list(values)) for key, values in self.series.items()]
+        lines = []
+        for key, values in series:
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float('inf'),), values):
+                cumulative += count
+                le = '+Inf' if bound == float('inf') else repr(bound)
+                lines.append(f'{self.name}_bucket{_format_labels(self.labelnames, key, [("le", le)])} {cumulative}')
+            lines.append(f'{self.name}_sum{_format_labels(self.labelnames, key)} {values[-1]}')
+            lines.append(f'{self.name}_count{_format_labels(self.labelnames, key)} {cumulative}')
+        return lines
+
+
+class CallbackMetric(_Metric):
+    """Value(s) computed at scrape time: fn() returns a number or {label value tuple: number}."""
+
+    def __init__(self, name, help_text, fn, labelnames=(), kind='gauge'):
+        super().__init__(name, help_text, labelnames)
+        self.fn = fn
+        self.kind = kind
+
+    def render(self):
+        values = self.fn()
+        if not isinstance(values, dict):
+            values = {(): values}
+        return [f'{self.name}{_format_labels(self.labelnames, key)} {value}' for key, value in values.items()]
+
+
+class Registry:
+    def __init__(self):
+        self.metrics = []
+
+    def _add(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def counter(self, name, help_text, labelnames=()):
+        return self._add(Counter(name, help_text, labelnames))
+
+    def histogram(self, name, help_text, labelnames=(), buckets=DEFAULT_BUCKETS):
+        return self._add(Histogram(name, help_text, labelnames, buckets))
+
+    def callback(self, name, help_text, fn, labelnames=(), kind='gauge'):
+        return self._add(CallbackMetric(name, help_text, fn, labelnames, kind))
+
+    def render(self):
+        lines = []
+        for metric in self.metrics:
+            try:
+                samples = metric.render()
+            except Exception as e:
+                # A failing callback must not take the whole scrape down
+                lines.append(f'# {metric.name} unavailable: {e}')
+                continue
+            lines.append(f'# HELP {metric.name} {metric.help}')
+            lines.append(f'# TYPE {metric.name} {metric.kind}')
+            lines.extend(samples)
+        return '\n'.join(lines) + '\n'
+
+
+class SamplingProfiler:
+    """Samples every other thread's Python stack at a fixed interval and tallies collapsed stacks."""
+
+    def __init__(self):
+        self.samples = _Tally()
+        self.n_samples = 0
+        self.interval = PROFILE_INTERVAL_SEC
+        self.started = None
+        self._thread = None
+        self._stop = _threading.Event()
+
+    @property
+    def running(self):
+        return self._thread is not None
+
+    def start(self, interval=PROFILE_INTERVAL_SEC):
+        if self.running:
+            return False
+        self.samples.clear()
+        self.n_samples = 0
+        self.interval = interval
+        self.started = time.time()
+        self._stop.clear()
+        self._thread = _threading.Thread(target=self._run, name='sampling-profiler', daemon=True)
+        self._thread.start()
+        return True
+
+    def stop(self):
+        """Stops sampling and returns the collapsed-stack report."""
+        if self.running:
+            self._stop.set()
+            self._thread.join()
+            self._thread = None
+        return self.report()
+
+    def _run(self):
+        own = _threading.get_ident()
+        while not self._stop.wait(self.interval):
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == own:
+                    continue
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append(f'{code.co_name} ({code.co_filename.rsplit("/", 1)[-1]}:{frame.f_lineno})')
+                    frame = frame.f_back
+                self.samples[';'.join(reversed(stack))] += 1
+            self.n_samples += 1
+
+    def report(self):
+        return ''.join(f'{stack} {count}\n' for stack, count in self.samples.most_common())
+
+    def status(self):
+        state = 'running' if self.running else 'stopped'
+        return f'{state}, {self.n_samples} samples at {self.interval * 1000:.1f} ms\n'
+
+
+class MetricsServer:
+    """Local HTTP endpoint for /metrics and the profiler toggle."""
+
+    def __init__(self, registry, host, port, profiler=None):
+        self.registry = registry
+        self.profiler = profiler or SamplingProfiler()
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                url = urlparse(self.path)
+                if url.path == '/metrics':
+                    body = server.registry.render()
+                    ctype = 'text/plain; version=0.0.4'
+                elif url.path == '/profile/start':
+                    try:
+                        interval = float(parse_qs(url.query).get('interval', [PROFILE_INTERVAL_SEC])[0])
+                    except ValueError:
+                        interval = None
+                    if interval is None or not 0 < interval < float('inf'):
+                        self.send_error(400, 'interval must be a positive number of seconds')
+                        return
+                    started = server.profiler.start(interval)
+                    body = 'started\n' if started else 'already running\n'
+                    ctype = 'text/plain'
+                elif url.path == '/profile/stop':
+                    body = server.profiler.stop()
+                    ctype = 'text/plain'
+                elif url.path == '/profile':
+                    body = server.profiler.status()
+                    ctype = 'text/plain'
+                else:
+                    self.send_error(404)
+                    return
+                data = body.encode('utf-8')
+                self.send_response(200)
+                self.send_header('Content-Type', ctype)
+                self.send_header('Content-Length', str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def log_message(self, *args):
+                pass
+
+        self.httpd = ThreadingHTTPServer((host, port), Handler)
+        self.address = self.httpd.server_address[:2]
+
+    def serve_forever(self):
+        self.httpd.serve_forever()
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
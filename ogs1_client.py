@@ -4,10 +4,12 @@ import struct
 import sys
 import time
 import select
+import qkd_frame
+from ogs_key_daemon import open_qkd_socket
+from key_relay import RelaySender
 
 QKD_ETHER_TYPE = 0x88B5
 UDP_PORT_OGS2 = 6000
-ETH_P_ALL = 0x0003
 ETH_HDR_LEN = 14
 
 def mac_to_bytes(mac_str: str) -> bytes:
@@ -17,17 +19,17 @@ def craft_eth_frame(dst_mac_bytes: bytes, src_mac_bytes: bytes, eth_type: int, p
     eth_header = dst_mac_bytes + src_mac_bytes + eth_type.to_bytes(2, 'big')
     return eth_header + payload
 
-def send_req(iface: str, requester: str, peer: str, size: int):
+def send_req(s, requester: str, peer: str, size: int, binary: bool = True):
     try:
-        s = socket.socket(socket.AF_PACKET, socket.SOCK_RAW, socket.htons(ETH_P_ALL))
-        s.bind((iface, 0))
-        payload = f"REQ_KEY:{requester}:{peer}:{size}".encode('utf-8')
+        payload = f"REQ_KEY:{requester}:{peer}:{size}"
+        if binary:
+            payload += f":{qkd_frame.REQ_BINARY_FLAG}"
+        payload = payload.encode('utf-8')
         src_mac_bytes = s.getsockname()[4]
         dst_mac_bytes = mac_to_bytes("ff:ff:ff:ff:ff:ff")
         frame = craft_eth_frame(dst_mac_bytes, src_mac_bytes, QKD_ETHER_TYPE, payload)
         print(f"[OGS1] Sending key request from {':'.join(f'{b:02x}' for b in src_mac_bytes)}...")
         s.send(frame)
-        s.close()
     except socket.error as e:
         print(f"[OGS1] Failed to send packet: {e}")
         sys.exit(1)
@@ -35,12 +37,17 @@ def send_req(iface: str, requester: str, peer: str, size: int):
 
 
 
-def wait_key(iface: str):
-    s = None
+def wait_key(s, n_bits: int):
+    """
+    Waits for the controller's reply to a key request of n_bits.
+    Returns (keys, error): keys is a list of (key_id, key_bytes, n_bits), error a
+    reply string when no key was served. Binary KEYS frames are collected until
+    n_bits have arrived; a legacy text reply KEY:<bits> becomes a single key with id 0.
+    s is the socket from open_qkd_socket(): only 0x88B5 frames for this host reach it.
+    """
+    keys = []
     try:
-        s = socket.socket(socket.AF_PACKET, socket.SOCK_RAW, socket.htons(ETH_P_ALL))
-        s.bind((iface, 0))
-        print("[OGS1] Waiting for reply on interface:", iface)
+        print("[OGS1] Waiting for reply on interface:", s.getsockname()[0])
         start_time = time.time()
         while time.time() - start_time < 20.0:
             ready_to_read, _, _ = select.select([s], [], [], 1.0)
@@ -50,51 +57,84 @@ def wait_key(iface: str):
             eth_header = raw_packet[:ETH_HDR_LEN]
             dst_mac_bytes, src_mac_bytes, eth_type_bytes = struct.unpack('!6s6sH', eth_header)
             print(f"[OGS1] Packet received: EtherType={hex(eth_type_bytes)} From={':'.join(f'{b:02x}' for b in src_mac_bytes)}")
-            if eth_type_bytes == QKD_ETHER_TYPE:
-                try:
-                    payload = raw_packet[ETH_HDR_LEN:].decode('utf-8', errors='ignore').strip()
-                    print(f"[OGS1] Decoded payload: {payload}")
-                    return payload
-                except Exception as e:
-                    print(f"[OGS1] Failed to decode payload: {e}")
+            if eth_type_bytes != QKD_ETHER_TYPE:
+                continue
+            body = raw_packet[ETH_HDR_LEN:]
+            try:
+                if qkd_frame.is_frame(body):
+                    frame = qkd_frame.decode_frame(body)
+                    if frame is None:
+                        print("[OGS1] Truncated key frame; ignoring")
+                        continue
+                    msg_type, payload, _ = frame
+                    if msg_type == qkd_frame.MSG_ACK:
+                        status, _, _ = qkd_frame.decode_ack(payload)
+                        return [], f"ERR:{qkd_frame.STATUS_NAMES.get(status, status)}"
+                    if msg_type == qkd_frame.MSG_KEYS:
+                        _, _, frame_keys = qkd_frame.decode_keys(payload)
+                        keys.extend(frame_keys)
+                        print(f"[OGS1] Key frame: {', '.join(f'id={k[0]} ({k[2]} bits)' for k in frame_keys)}")
+                        if sum(k[2] for k in keys) >= n_bits:
+                            return keys, None
+                    continue
+                payload = body.decode('utf-8', errors='ignore').rstrip('\x00').strip()
+                print(f"[OGS1] Decoded payload: {payload}")
+                if payload.startswith('KEY:'):
+                    bits = payload.split(':', 1)[1]
+                    return [(0, qkd_frame.bitstring_to_bytes(bits), len(bits))], None
+                return [], payload
+            except Exception as e:
+                print(f"[OGS1] Failed to decode payload: {e}")
         print("[OGS1] Timed out waiting for QKD reply.")
     except Exception as e:
         print(f"[OGS1] Error receiving packet: {e}")
-    finally:
-        if s:
-            s.close()
-    return ""
+    return keys, "ERR:TIMEOUT"
 
 
 
 
-def forward_to_ogs2(ogs2_ip: str, key_bits: str):
+def forward_to_ogs2(ogs2_ip: str, keys, requester: str = '', peer: str = '', binary: bool = True):
+    """
+    Sends keys [(key_id, key_bytes, n_bits), ...] to OGS2 over the reliable relay
+    (key_relay.py) and waits for its acknowledgement; returns False if it never came.
+    Legacy mode sends one unacknowledged KEY:<bits> datagram.
+    """
+    if binary:
+        sender = RelaySender((ogs2_ip, UDP_PORT_OGS2))
+        sender.send_keys(keys, requester, peer)
+        acked = sender.flush()
+        sender.close()
+        return acked
     s = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-    s.sendto(f"KEY:{key_bits}".encode('utf-8'), (ogs2_ip, UDP_PORT_OGS2))
+    bits = ''.join(qkd_frame.bytes_to_bitstring(data, n) for _, data, n in keys)
+    s.sendto(f"KEY:{bits}".encode('utf-8'), (ogs2_ip, UDP_PORT_OGS2))
     s.close()
+    return True
 
 if __name__ == '__main__':
-    if len(sys.argv) != 6:
-        print("usage: python3 ogs1_client.py <iface> <OGS2_IP> <REQ_NAME> <PEER_NAME> <SIZE>")
+    if len(sys.argv) not in (6, 7):
+        print("usage: python3 ogs1_client.py <iface> <OGS2_IP> <REQ_NAME> <PEER_NAME> <SIZE> [text]")
         sys.exit(1)
 
     iface, ogs2_ip, req_name, peer_name, size = sys.argv[1], sys.argv[2], sys.argv[3], sys.argv[4], int(sys.argv[5])
+    # 'text' selects the legacy ASCII KEY:<bits> format end to end
+    binary = not (len(sys.argv) == 7 and sys.argv[6] == 'text')
 
-    temp_sock = socket.socket(socket.AF_PACKET, socket.SOCK_RAW, socket.htons(ETH_P_ALL))
-    temp_sock.bind((iface, 0))
-    my_mac_bytes = temp_sock.getsockname()[4]
-    temp_sock.close()
+    # One socket for the MAC lookup, the request and the reply (ogs_key_daemon.py keeps it open across requests)
+    sock, my_mac_bytes = open_qkd_socket(iface)
 
     print(f"[OGS1] My MAC is {':'.join(f'{b:02x}' for b in my_mac_bytes)}. Requesting key from controller...")
-    send_req(iface, req_name, peer_name, size)
+    send_req(sock, req_name, peer_name, size, binary)
 
-    resp = wait_key(iface)
+    keys, err = wait_key(sock, size)
+    sock.close()
 
-    if not resp.startswith('KEY:'):
-        print(f"[OGS1] Bad reply from controller: {resp}")
+    if err is not None:
+        print(f"[OGS1] Bad reply from controller: {err}")
         sys.exit(2)
 
-    bits = resp.split(':', 1)[1]
-    print(f"[OGS1] Got key ({len(bits)} bits) from controller.")
-    forward_to_ogs2(ogs2_ip, bits)
+    print(f"[OGS1] Got key ({sum(k[2] for k in keys)} bits, {len(keys)} key id(s)) from controller.")
+    if not forward_to_ogs2(ogs2_ip, keys, req_name, peer_name, binary):
+        print("[OGS1] OGS2 did not acknowledge the key (UDP:6000).")
+        sys.exit(3)
     print("[OGS1] Forwarded key to OGS2 (UDP:6000).")
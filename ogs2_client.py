@@ -1,23 +1,98 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+"""
+OGS2 key service: receives relayed keys on UDP 6000 (key_relay.py), acknowledges
+them selectively and keeps them in an indexed buffer. Local consumers draw keys
+over a Unix socket, one command per line, each answered with one frame:
 
+    GET <key_id>     -> KEYS frame with that key
+    TAKE <n_bits>    -> KEYS frame with the oldest keys holding at least n_bits
+                        (ACK NO_KEY_AVAILABLE if the buffer holds less)
+
+usage: python3 ogs2_client.py [--port 6000] [--socket /tmp/ogs2_keys.sock]
+"""
+
+import argparse
+import os
+import selectors
 import socket
 
-LISTEN_PORT = 6000
+import qkd_frame
+from key_relay import RelayReceiver, IndexedKeyBuffer, RELAY_PORT
+
+LISTEN_PORT = RELAY_PORT
+CONSUMER_SOCKET = '/tmp/ogs2_keys.sock'
+
+
+class OGS2KeyService:
+    def __init__(self, port=LISTEN_PORT, socket_path=CONSUMER_SOCKET):
+        self.buffer = IndexedKeyBuffer()
+        self.receiver = RelayReceiver(self.buffer, '0.0.0.0', port, on_keys=self._on_keys)
+        self.socket_path = socket_path
+        self.sel = selectors.DefaultSelector()
+        self.buffers = {}
+
+    def _on_keys(self, requester, peer, keys, addr):
+        for key_id, key, n_bits in keys:
+            print(f"[OGS2] Received key id={key_id} ({n_bits} bits) for {requester}:{peer} from {addr[0]}")
+
+    def _accept(self, server):
+        conn, _ = server.accept()
+        self.buffers[conn] = b''
+        self.sel.register(conn, selectors.EVENT_READ, self._read_consumer)
+
+    def _read_consumer(self, conn):
+        try:
+            data = conn.recv(4096)
+        except OSError:
+            # Reset by the consumer: same as a close
+            data = b''
+        if not data:
+            self._close_consumer(conn)
+            return
+        *lines, self.buffers[conn] = (self.buffers[conn] + data).split(b'\n')
+        for line in lines:
+            parts = line.decode('utf-8', errors='ignore').split()
+            if len(parts) == 2 and parts[0] in ('GET', 'TAKE') and parts[1].isdigit():
+                if parts[0] == 'GET':
+                    key = self.buffer.get(int(parts[1]))
+                    keys = [key] if key is not None else []
+                else:
+                    keys = self.buffer.take(int(parts[1]))
+                reply = qkd_frame.encode_keys(keys) if keys else qkd_frame.encode_ack(qkd_frame.STATUS_NO_KEY)
+            elif parts:
+                reply = qkd_frame.encode_ack(qkd_frame.STATUS_BAD_FORMAT)
+            else:
+                continue
+            try:
+                conn.sendall(reply)
+            except OSError:
+                self._close_consumer(conn)
+                return
+
+    def _close_consumer(self, conn):
+        self.sel.unregister(conn)
+        del self.buffers[conn]
+        conn.close()
+
+    def serve_forever(self):
+        if os.path.exists(self.socket_path):
+            os.unlink(self.socket_path)
+        server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        server.bind(self.socket_path)
+        server.listen(64)
+        server.setblocking(False)
+        self.sel.register(server, selectors.EVENT_READ, self._accept)
+        self.sel.register(self.receiver, selectors.EVENT_READ, lambda receiver: receiver.drain())
+        print(f"[OGS2] Receiving keys on UDP:{self.receiver.address[1]}, consumers on {self.socket_path}")
+        while True:
+            for key, _ in self.sel.select():
+                key.data(key.fileobj)
+
 
 if __name__ == '__main__':
-    s = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-    s.bind(('0.0.0.0', LISTEN_PORT))
-    print(f"[OGS2] Waiting for key on UDP:{LISTEN_PORT} ...")
-    try:
-        data, addr = s.recvfrom(65535)
-        print(f"[OGS2] Packet received from {addr}")
-        msg = data.decode('utf-8').strip()
-        print(f"[OGS2] Raw message: {msg}")
-        if msg.startswith('KEY:'):
-            bits = msg.split(':', 1)[1]
-            print(f"[OGS2] Received key ({len(bits)} bits)")
-        else:
-            print(f"[OGS2] Unexpected: {msg}")
-    except Exception as e:
-        print(f"[OGS2] Error: {e}")
-    finally:
-        s.close()
+    parser = argparse.ArgumentParser(description='OGS2 key service.')
+    parser.add_argument('--port', type=int, default=LISTEN_PORT)
+    parser.add_argument('--socket', default=CONSUMER_SOCKET, help='Unix socket for local key consumers')
+    args = parser.parse_args()
+    OGS2KeyService(args.port, args.socket).serve_forever()
@@ -0,0 +1,314 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+"""
+Long-running OGS key client.
+
+Keeps one AF_PACKET socket open on the OGS interface with a classic BPF
+filter attached, so only 0x88B5 frames addressed to this host are copied to
+userspace. Every REQ_KEY it sends carries a correlation ID; the controller
+tags its replies with it (qkd_frame.MSG_TAGGED), so up to MAX_IN_FLIGHT
+requests can be outstanding at once.
+
+Local applications ask for keys over a Unix stream socket, one request per
+line, any number in flight per connection:
+
+    REQ <tag> <requester> <peer> <n_bits>
+
+Each request is answered with one MSG_TAGGED frame carrying the client's
+tag and either a KEYS frame (n_bits or more of key material) or an ACK with
+the error status (NO_KEY_AVAILABLE, TIMEOUT, BAD_FORMAT). With --relay, every
+served key is also relayed to OGS2 over the reliable relay (key_relay.py).
+
+usage: python3 ogs_key_daemon.py <iface> [--socket PATH] [--relay OGS2_IP]
+       python3 ogs_key_daemon.py <iface> --get <requester> <peer> <n_bits>
+"""
+
+import argparse
+import ctypes
+import itertools
+import os
+import selectors
+import socket
+import struct
+import time
+from collections import deque
+
+import qkd_frame
+from key_relay import RelaySender, RELAY_PORT
+
+QKD_ETHER_TYPE = 0x88B5
+ETH_HDR_LEN = 14
+SO_ATTACH_FILTER = 26
+MAX_IN_FLIGHT = 32 # REQ_KEYs outstanding towards the controller
+REQUEST_TIMEOUT_SEC = 5.0
+RECV_BATCH = 64 # frames drained per readable event
+DEFAULT_SOCKET_DIR = '/tmp'
+
+
+def default_socket_path(iface):
+    # Mininet hosts share the filesystem; one socket per OGS interface
+    return os.path.join(DEFAULT_SOCKET_DIR, f'ogs_keyd.{iface}.sock')
+
+
+def qkd_bpf_program(mac: bytes):
+    """Classic BPF: accept EtherType 0x88B5 frames whose destination is mac, drop everything else."""
+    mac_hi, mac_lo = struct.unpack('!IH', mac)
+    # (code, jt, jf, k)
+    return [
+        (0x28, 0, 0, 12), # ldh [12]            EtherType
+        (0x15, 0, 5, QKD_ETHER_TYPE), # jeq #0x88B5
+        (0x20, 0, 0, 0), # ld [0]               destination MAC, first 4 bytes
+        (0x15, 0, 3, mac_hi), # jeq #mac_hi
+        (0x28, 0, 0, 4), # ldh [4]              last 2 bytes
+        (0x15, 0, 1, mac_lo), # jeq #mac_lo
+        (0x06, 0, 0, 0xFFFF), # ret #65535      accept
+        (0x06, 0, 0, 0), # ret #0               drop
+    ]
+
+
+def attach_filter(sock, program):
+    """SO_ATTACH_FILTER with a struct sock_fprog built in place."""
+    insns = b''.join(struct.pack('HBBI', *insn) for insn in program)
+    buf = ctypes.create_string_buffer(insns)
+    fprog = struct.pack('HL', len(program), ctypes.addressof(buf))
+    sock.setsockopt(socket.SOL_SOCKET, SO_ATTACH_FILTER, fprog)
+
+
+def open_qkd_socket(iface):
+    """Raw socket bound to iface for 0x88B5 only, with the BPF filter. Returns (sock, own MAC bytes)."""
+    sock = socket.socket(socket.AF_PACKET, socket.SOCK_RAW, socket.htons(QKD_ETHER_TYPE))
+    sock.bind((iface, 0))
+    mac = sock.getsockname()[4]
+    attach_filter(sock, qkd_bpf_program(mac))
+    # Frames queued before the filter was attached did not go through it
+    sock.setblocking(False)
+    try:
+        while True:
+            sock.recv(65535)
+    except BlockingIOError:
+        pass
+    sock.setblocking(True)
+    return sock, mac
+
+
+def req_key_frame(src_mac, requester, peer, n_bits, tag=None):
+    payload = f"REQ_KEY:{requester}:{peer}:{n_bits}:{qkd_frame.REQ_BINARY_FLAG}"
+    if tag is not None:
+        payload += f":{tag}"
+    return b'\xff' * 6 + src_mac + QKD_ETHER_TYPE.to_bytes(2, 'big') + payload.encode('utf-8')
+
+
+class _Request:
+    __slots__ = ('corr', 'conn', 'tag', 'requester', 'peer', 'n_bits', 'keys', 'bits', 'deadline')
+
+    def __init__(self, corr, conn, tag, requester, peer, n_bits):
+        self.corr = corr
+        self.conn = conn
+        self.tag = tag
+        self.requester = requester
+        self.peer = peer
+        self.n_bits = n_bits
+        self.keys = []
+        self.bits = 0
+        self.deadline = None
+
+
+class OGSKeyDaemon:
+    """Selector loop over the raw socket, the Unix listener and its client connections."""
+
+    def __init__(self, iface, socket_path=None, max_in_flight=MAX_IN_FLIGHT, timeout=REQUEST_TIMEOUT_SEC,
+                 relay_to=None):
+        self.iface = iface
+        self.socket_path = socket_path or default_socket_path(iface)
+        self.max_in_flight = max_in_flight
+        self.timeout = timeout
+        self.sel = selectors.DefaultSelector()
+        self.raw, self.mac = open_qkd_socket(iface)
+        self.relay = RelaySender((relay_to, RELAY_PORT)) if relay_to else None
+        self._corr_ids = itertools.count(1)
+        self.in_flight = {} # correlation id -> _Request, in send order
+        self.queued = deque()
+        self.buffers = {}
+        self.counters = {
+            'requests': 0,
+            'served': 0,
+            'failed': 0,
+            'timeouts': 0,
+            'frames': 0,
+            'late_frames': 0,
+            'untagged_frames': 0,
+        }
+
+    # ---------- Unix socket API ----------
+    def listen(self):
+        if os.path.exists(self.socket_path):
+            os.unlink(self.socket_path)
+        self.server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.server.bind(self.socket_path)
+        self.server.listen(64)
+        self.server.setblocking(False)
+        self.sel.register(self.server, selectors.EVENT_READ, self._accept)
+        self.sel.register(self.raw, selectors.EVENT_READ, self._drain_raw)
+        if self.relay is not None:
+            self.sel.register(self.relay, selectors.EVENT_READ, lambda relay: relay.handle_readable())
+
+    def _accept(self, server):
+        conn, _ = server.accept()
+        self.buffers[conn] = b''
+        self.sel.register(conn, selectors.EVENT_READ, self._read_client)
+
+    def _read_client(self, conn):
+        try:
+            data = conn.recv(4096)
+        except OSError:
+            # Reset by the client: same as a close
+            data = b''
+        if not data:
+            self._close_client(conn)
+            return
+        buf = self.buffers[conn] + data
+        *lines, self.buffers[conn] = buf.split(b'\n')
+        for line in lines:
+            parts = line.decode('utf-8', errors='ignore').split()
+            if len(parts) == 5 and parts[0] == 'REQ' and parts[1].isdigit() and parts[4].isdigit():
+                self._submit(_Request(None, conn, int(parts[1]), parts[2], parts[3], int(parts[4])))
+            elif parts:
+                self._reply(conn, 0, qkd_frame.encode_ack(qkd_frame.STATUS_BAD_FORMAT))
+
+    def _close_client(self, conn):
+        self.sel.unregister(conn)
+        self.buffers.pop(conn, None)
+        conn.close()
+        # Drop its requests; replies still arriving for them are counted as late
+        self.queued = deque(r for r in self.queued if r.conn is not conn)
+        for corr in [c for c, r in self.in_flight.items() if r.conn is conn]:
+            del self.in_flight[corr]
+
+    def _reply(self, conn, tag, frame):
+        try:
+            conn.sendall(qkd_frame.encode_tagged(tag, frame))
+        except OSError:
+            if conn in self.buffers:
+                self._close_client(conn)
+
+    # ---------- Requests towards the controller ----------
+    def _submit(self, request):
+        self.counters['requests'] += 1
+        self.queued.append(request)
+        self._send_queued()
+
+    def _send_queued(self):
+        while self.queued and len(self.in_flight) < self.max_in_flight:
+            request = self.queued.popleft()
+            request.corr = next(self._corr_ids)
+            request.deadline = time.monotonic() + self.timeout
+            self.in_flight[request.corr] = request
+            self.raw.send(req_key_frame(self.mac, request.requester, request.peer, request.n_bits, request.corr))
+
+    def _finish(self, request, frame, ok):
+        self.in_flight.pop(request.corr, None)
+        self.counters['served' if ok else 'failed'] += 1
+        if ok and self.relay is not None:
+            self.relay.send_keys(request.keys, request.requester, request.peer)
+        self._reply(request.conn, request.tag, frame)
+
+    def _drain_raw(self, raw):
+        for _ in range(RECV_BATCH):
+            try:
+                data = raw.recv(65535, socket.MSG_DONTWAIT)
+            except BlockingIOError:
+                break
+            self.counters['frames'] += 1
+            self._handle_frame(data[ETH_HDR_LEN:])
+        self._send_queued()
+
+    def _handle_frame(self, body):
+        try:
+            frame = qkd_frame.decode_frame(body) if qkd_frame.is_frame(body) else None
+            if frame is None:
+                return
+            msg_type, payload, _ = frame
+            if msg_type == qkd_frame.MSG_TAGGED:
+                corr, msg_type, payload = qkd_frame.decode_tagged(payload)
+                request = self.in_flight.get(corr)
+                if request is None:
+                    self.counters['late_frames'] += 1
+                    return
+            else:
+                # Controller without correlation support: replies come back in request order
+                self.counters['untagged_frames'] += 1
+                if not self.in_flight:
+                    return
+                request = next(iter(self.in_flight.values()))
+            if msg_type == qkd_frame.MSG_ACK:
+                self._finish(request, qkd_frame.encode_frame(msg_type, payload), ok=False)
+            elif msg_type == qkd_frame.MSG_KEYS:
+                _, _, keys = qkd_frame.decode_keys(payload)
+                request.keys.extend(keys)
+                request.bits += sum(k[2] for k in keys)
+                if request.bits >= request.n_bits:
+                    self._finish(request, qkd_frame.encode_keys(request.keys, request.requester, request.peer),
+                                 ok=True)
+        except qkd_frame.FrameError as e:
+            print(f"[OGS-KEYD] Bad key frame: {e}")
+
+    def _expire(self):
+        now = time.monotonic()
+        for request in [r for r in self.in_flight.values() if r.deadline <= now]:
+            self.counters['timeouts'] += 1
+            self._finish(request, qkd_frame.encode_ack(qkd_frame.STATUS_TIMEOUT, len(request.keys), request.bits),
+                         ok=False)
+        self._send_queued()
+
+    def serve_forever(self):
+        self.listen()
+        print(f"[OGS-KEYD] {self.iface} ({self.mac.hex(':')}) serving key requests on {self.socket_path}")
+        while True:
+            timeouts = []
+            if self.in_flight:
+                timeouts.append(max(0.0, min(r.deadline for r in self.in_flight.values()) - time.monotonic()))
+            if self.relay is not None and self.relay.next_timeout() is not None:
+                timeouts.append(self.relay.next_timeout())
+            for key, _ in self.sel.select(min(timeouts) if timeouts else None):
+                key.data(key.fileobj)
+            self._expire()
+            if self.relay is not None:
+                self.relay.poll()
+
+
+def request_keys(socket_path, requester, peer, n_bits, tag=1, timeout=REQUEST_TIMEOUT_SEC + 1):
+    """
+    One request to a running daemon. Returns (keys, error): keys is a list of
+    (key_id, key_bytes, n_bits), error a status name when no key was served.
+    """
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as s:
+        s.settimeout(timeout)
+        s.connect(socket_path)
+        s.sendall(f"REQ {tag} {requester} {peer} {n_bits}\n".encode('utf-8'))
+        msg_type, payload = qkd_frame.recv_frame(s)
+    _, msg_type, payload = qkd_frame.decode_tagged(payload)
+    if msg_type == qkd_frame.MSG_KEYS:
+        return qkd_frame.decode_keys(payload)[2], None
+    status, _, _ = qkd_frame.decode_ack(payload)
+    return [], qkd_frame.STATUS_NAMES.get(status, str(status))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Persistent OGS key client.')
+    parser.add_argument('iface')
+    parser.add_argument('--socket', default=None, help='Unix socket path (default /tmp/ogs_keyd.<iface>.sock)')
+    parser.add_argument('--relay', default=None, metavar='OGS2_IP', help='also relay served keys to OGS2')
+    parser.add_argument('--get', nargs=3, metavar=('REQUESTER', 'PEER', 'N_BITS'),
+                        help='ask a running daemon for one key and print it')
+    args = parser.parse_args()
+
+    path = args.socket or default_socket_path(args.iface)
+    if args.get:
+        keys, err = request_keys(path, args.get[0], args.get[1], int(args.get[2]))
+        if err is not None:
+            print(f"[OGS-KEYD] No key: {err}")
+            raise SystemExit(2)
+        for key_id, data, n_bits in keys:
+            print(f"id={key_id} bits={n_bits} key={qkd_frame.bytes_to_bitstring(data, n_bits)}")
+    else:
+        OGSKeyDaemon(args.iface, path, relay_to=args.relay).serve_forever()
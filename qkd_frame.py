@@ -0,0 +1,265 @@
+# -*- coding: utf-8 -*-
+"""
+Versioned binary framing for QKD key transport.
+
+Used by the QKD_sdn push client, the controller's TCP key listener, the
+0x88B5 key reply and the OGS1 -> OGS2 UDP forward. Every frame is
+
+    magic 'QK' (2) | version (1) | msg type (1) | payload length (4, big endian) | payload
+
+MSG_KEYS payload (one or more keys for one requester/peer pair):
+
+    len(requester) (1) | requester | len(peer) (1) | peer | key count (2)
+    per key: key id (8) | n_bits (4) | ceil(n_bits / 8) bytes of key material
+
+MSG_ACK payload:
+
+    status (1) | key count (2) | n_bits (8)
+
+MSG_TAGGED payload (a reply to a REQ_KEY that carried a correlation ID):
+
+    correlation id (8) | one complete KEYS or ACK frame
+
+MSG_RELAY payload (OGS1 -> OGS2 sequenced key datagram, see key_relay.py):
+
+    session (4) | sequence number (8) | one complete KEYS frame
+
+MSG_SACK payload (OGS2 -> OGS1 selective acknowledgement):
+
+    session (4) | next expected sequence number (8) | range count (2)
+    per range: first (8) | last (8) sequence number received beyond it
+
+The old ASCII messages (KEY:<bits>, KEY:<packed>, KEYLEN:...) remain accepted
+everywhere as a fallback; is_frame() tells the two apart.
+"""
+
+import struct
+
+MAGIC = b'QK'
+VERSION = 1
+MAX_NAME_BYTES = 255 # requester / peer names carry a one-byte length
+HEADER = struct.Struct('!2sBBI')
+KEY_ENTRY = struct.Struct('!QI')
+ACK = struct.Struct('!BHQ')
+TAG = struct.Struct('!Q')
+RELAY = struct.Struct('!IQ')
+SACK = struct.Struct('!IQH')
+SACK_RANGE = struct.Struct('!QQ')
+MAX_PAYLOAD_LEN = 64 * 1024 * 1024
+
+MSG_KEYS = 0x01
+MSG_ACK = 0x02
+MSG_TAGGED = 0x03
+MSG_RELAY = 0x04
+MSG_SACK = 0x05
+
+STATUS_OK = 0
+STATUS_BAD_FORMAT = 1
+STATUS_NO_KEY = 2
+STATUS_ERROR = 3
+STATUS_FULL = 4
+STATUS_TIMEOUT = 5
+STATUS_NAMES = {
+    STATUS_OK: 'OK',
+    STATUS_BAD_FORMAT: 'BAD_FORMAT',
+    STATUS_NO_KEY: 'NO_KEY_AVAILABLE',
+    STATUS_ERROR: 'EXCEPTION',
+    STATUS_FULL: 'KEY_STORE_FULL',
+    STATUS_TIMEOUT: 'TIMEOUT',
+}
+
+# Suffix a REQ_KEY with this field to ask for a binary reply
+REQ_BINARY_FLAG = 'v1'
+# REQ_KEY:<requester>:<peer>:<size>:v1:<correlation id> gets MSG_TAGGED replies
+
+
+class FrameError(ValueError):
+    """Raised for frames with a bad magic, unsupported version or corrupt payload."""
+
+
+def bitstring_to_bytes(bits: str) -> bytes:
+    """'0101...' -> packed bytes, MSB first, zero-padded to a whole byte."""
+    if not bits:
+        return b''
+    pad = (-len(bits)) % 8
+    return int(bits + '0' * pad, 2).to_bytes((len(bits) + pad) // 8, 'big')
+
+
+def bytes_to_bitstring(data: bytes, n_bits: int) -> str:
+    """Packed bytes -> '0101...' of exactly n_bits."""
+    if n_bits == 0:
+        return ''
+    return bin(int.from_bytes(data, 'big'))[2:].zfill(len(data) * 8)[:n_bits]
+
+
+def is_frame(data) -> bool:
+    return bytes(data[:2]) == MAGIC
+
+
+def encode_frame(msg_type: int, payload: bytes) -> bytes:
+    return HEADER.pack(MAGIC, VERSION, msg_type, len(payload)) + payload
+
+
+def decode_frame_header(header: bytes):
+    """Validates a frame header. Returns (version, msg_type, payload_length)."""
+    magic, version, msg_type, length = HEADER.unpack_from(header)
+    if magic != MAGIC:
+        raise FrameError("bad magic")
+    if version != VERSION:
+        raise FrameError(f"unsupported version {version}")
+    if length > MAX_PAYLOAD_LEN:
+        raise FrameError(f"payload too large ({length} bytes)")
+    return version, msg_type, length
+
+
+def decode_frame(buf):
+    """
+    Decodes one frame from the start of buf.
+    Returns (msg_type, payload, bytes_consumed), or None if buf holds an incomplete frame.
+    """
+    if len(buf) < HEADER.size:
+        return None
+    _, msg_type, length = decode_frame_header(buf)
+    end = HEADER.size + length
+    if len(buf) < end:
+        return None
+    return msg_type, bytes(buf[HEADER.size:end]), end
+
+
+def encode_keys(keys, requester: str = '', peer: str = '') -> bytes:
+    """keys: iterable of (key_id, key_bytes, n_bits). Returns a complete MSG_KEYS frame."""
+    keys = list(keys)
+    parts = []
+    for name in (requester, peer):
+        raw = name.encode('utf-8')
+        if len(raw) > MAX_NAME_BYTES:
+            raise FrameError(f"name of {len(raw)} bytes, at most {MAX_NAME_BYTES} fit a KEYS frame")
+        parts.append(bytes([len(raw)]) + raw)
+    parts.append(struct.pack('!H', len(keys)))
+    for key_id, data, n_bits in keys:
+        n_bytes = (n_bits + 7) // 8
+        if len(data) < n_bytes:
+            raise FrameError(f"key {key_id} holds {len(data)} bytes, {n_bytes} needed for {n_bits} bits")
+        parts.append(KEY_ENTRY.pack(key_id, n_bits))
+        parts.append(bytes(data[:n_bytes]))
+    return encode_frame(MSG_KEYS, b''.join(parts))
+
+
+def keys_overhead(requester: str = '', peer: str = '') -> int:
+    """Bytes of a one-key MSG_KEYS frame that are not key material."""
+    return HEADER.size + 2 + len(requester.encode('utf-8')) + len(peer.encode('utf-8')) + 2 + KEY_ENTRY.size
+
+
+def decode_keys(payload: bytes):
+    """Returns (requester, peer, [(key_id, key_bytes, n_bits), ...]) from a MSG_KEYS payload."""
+    try:
+        off = 0
+        names = []
+        for _ in range(2):
+            n = payload[off]
+            names.append(payload[off + 1:off + 1 + n].decode('utf-8'))
+            off += 1 + n
+        (count,) = struct.unpack_from('!H', payload, off)
+        off += 2
+        keys = []
+        for _ in range(count):
+            key_id, n_bits = KEY_ENTRY.unpack_from(payload, off)
+            off += KEY_ENTRY.size
+            n_bytes = (n_bits + 7) // 8
+            data = payload[off:off + n_bytes]
+            if len(data) != n_bytes:
+                raise FrameError("truncated key material")
+            keys.append((key_id, data, n_bits))
+            off += n_bytes
+    except (IndexError, struct.error, UnicodeDecodeError) as e:
+        raise FrameError(f"corrupt KEYS payload: {e}")
+    return names[0], names[1], keys
+
+
+def encode_ack(status: int, n_keys: int = 0, n_bits: int = 0) -> bytes:
+    return encode_frame(MSG_ACK, ACK.pack(status, n_keys, n_bits))
+
+
+def decode_ack(payload: bytes):
+    """Returns (status, n_keys, n_bits) from a MSG_ACK payload."""
+    try:
+        return ACK.unpack(payload)
+    except struct.error as e:
+        raise FrameError(f"corrupt ACK payload: {e}")
+
+
+def encode_tagged(tag: int, frame: bytes) -> bytes:
+    """Wraps a complete frame with a correlation ID."""
+    return encode_frame(MSG_TAGGED, TAG.pack(tag) + frame)
+
+
+def decode_tagged(payload: bytes):
+    """Returns (tag, msg_type, payload) of the frame inside a MSG_TAGGED payload."""
+    if len(payload) < TAG.size:
+        raise FrameError("corrupt TAGGED payload")
+    (tag,) = TAG.unpack_from(payload)
+    frame = decode_frame(payload[TAG.size:])
+    if frame is None:
+        raise FrameError("truncated frame inside TAGGED payload")
+    return tag, frame[0], frame[1]
+
+
+def encode_relay(session: int, seq: int, keys_frame: bytes) -> bytes:
+    return encode_frame(MSG_RELAY, RELAY.pack(session, seq) + keys_frame)
+
+
+def decode_relay(payload: bytes):
+    """Returns (session, seq, keys_payload) from a MSG_RELAY payload."""
+    if len(payload) < RELAY.size:
+        raise FrameError("corrupt RELAY payload")
+    session, seq = RELAY.unpack_from(payload)
+    frame = decode_frame(payload[RELAY.size:])
+    if frame is None or frame[0] != MSG_KEYS:
+        raise FrameError("RELAY payload does not hold a complete KEYS frame")
+    return session, seq, frame[1]
+
+
+def encode_sack(session: int, next_seq: int, ranges=()) -> bytes:
+    """ranges: [(first, last), ...] of sequence numbers received beyond next_seq."""
+    ranges = list(ranges)
+    parts = [SACK.pack(session, next_seq, len(ranges))]
+    parts.extend(SACK_RANGE.pack(first, last) for first, last in ranges)
+    return encode_frame(MSG_SACK, b''.join(parts))
+
+
+def decode_sack(payload: bytes):
+    """Returns (session, next_seq, [(first, last), ...]) from a MSG_SACK payload."""
+    try:
+        session, next_seq, count = SACK.unpack_from(payload)
+        ranges = [SACK_RANGE.unpack_from(payload, SACK.size + i * SACK_RANGE.size) for i in range(count)]
+    except struct.error as e:
+        raise FrameError(f"corrupt SACK payload: {e}")
+    return session, next_seq, ranges
+
+
+def recv_exact(sock, n: int) -> bytes:
+    """Reads exactly n bytes from a stream socket; returns fewer only at EOF."""
+    chunks = []
+    remaining = n
+    while remaining:
+        chunk = sock.recv(remaining)
+        if not chunk:
+            break
+        chunks.append(chunk)
+        remaining -= len(chunk)
+    return b''.join(chunks)
+
+
+def recv_frame(sock):
+    """Reads one complete frame from a stream socket. Returns (msg_type, payload), or None on a clean EOF."""
+    header = recv_exact(sock, HEADER.size)
+    if not header:
+        return None
+    if len(header) < HEADER.size:
+        raise FrameError("connection closed inside frame header")
+    _, msg_type, length = decode_frame_header(header)
+    payload = recv_exact(sock, length)
+    if len(payload) < length:
+        raise FrameError("connection closed inside frame payload")
+    return msg_type, payload
+
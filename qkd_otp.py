@@ -0,0 +1,91 @@
+# -*- coding: utf-8 -*-
+"""
+Byte-oriented key packing and one-time-pad helpers.
+
+Keys are NumPy bit arrays (0/1 per element) or packed bytes (MSB first, as
+produced by np.packbits). Encryption XORs whole buffers at once and never
+repeats key material: the streaming API draws fresh key bytes for every
+chunk from a key source and fails once the source is exhausted.
+"""
+
+import numpy as np
+
+
+class KeyExhausted(Exception):
+    """Raised when a key source cannot supply enough material for the data."""
+
+
+def key_array_to_bytes(key_array) -> bytes:
+    """Bit array -> packed bytes; the last byte is zero-padded."""
+    return np.packbits(np.asarray(key_array, dtype=np.uint8)).tobytes()
+
+
+def bytes_to_key_array(data, n_bits=None) -> np.ndarray:
+    """Packed bytes -> bit array, truncated to n_bits if given."""
+    bits = np.unpackbits(np.frombuffer(data, dtype=np.uint8))
+    return bits if n_bits is None else bits[:n_bits]
+
+
+def key_array_to_bitstring(key_array) -> str:
+    """Bit array -> '0101...' without per-bit string formatting."""
+    return (np.asarray(key_array, dtype=np.uint8) + ord('0')).tobytes().decode('ascii')
+
+
+def xor_bytes(key, data) -> bytes:
+    """XORs data with the first len(data) bytes of key."""
+    data = np.frombuffer(data, dtype=np.uint8)
+    key = np.frombuffer(key, dtype=np.uint8)
+    if len(key) < len(data):
+        raise KeyExhausted(f"need {len(data)} key bytes, have {len(key)}")
+    return np.bitwise_xor(key[:len(data)], data).tobytes()
+
+
+def encrypt_bytes(key, data) -> bytes:
+    return xor_bytes(key, data)
+
+
+def decrypt_bytes(key, data) -> bytes:
+    return xor_bytes(key, data)
+
+
+class KeyBuffer:
+    """
+    A key source over a fixed block of key material; every byte is handed out once.
+    Any callable f(n_bytes) -> bytes works as a key source, this is the simplest one.
+    """
+
+    def __init__(self, key):
+        self.view = memoryview(bytes(key))
+        self.offset = 0
+
+    @property
+    def remaining(self):
+        return len(self.view) - self.offset
+
+    def __call__(self, n_bytes):
+        out = self.view[self.offset:self.offset + n_bytes]
+        self.offset += len(out)
+        return out
+
+
+def otp_stream(chunks, key_source):
+    """
+    Encrypts (or decrypts) an iterable of byte chunks, drawing len(chunk) fresh
+    key bytes from key_source for each one. Yields the output chunks.
+    """
+    for chunk in chunks:
+        key = key_source(len(chunk))
+        if len(key) < len(chunk):
+            raise KeyExhausted(f"key source returned {len(key)} of {len(chunk)} bytes")
+        yield xor_bytes(key, chunk)
+
+
+def otp_file(src_path, dst_path, key_source, chunk_size=1 << 20):
+    """Streams a file through otp_stream. Returns the number of bytes written."""
+    written = 0
+    with open(src_path, 'rb') as src, open(dst_path, 'wb') as dst:
+        chunks = iter(lambda: src.read(chunk_size), b'')
+        for out in otp_stream(chunks, key_source):
+            dst.write(out)
+            written += len(out)
+    return written
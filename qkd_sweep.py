@@ -0,0 +1,242 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+"""
+Parallel parameter sweep over QKD runs.
+
+Fans the cross product of key sizes, eavesdropper intercept probabilities,
+channel loss and QuNetSim wait_time (times --repeats) out over a process
+pool and records key rate, QBER and wall time per run. QuNetSim's Network is
+a per-process singleton, so every qunetsim run gets a fresh worker process;
+batch runs (bb84_batch.py) reuse their workers.
+
+Results go to a sweep directory as columnar part files (Parquet when pyarrow
+is installed, NumPy .npz otherwise), one part per --flush-every finished
+runs. Every run has a run_id derived from its parameters, so rerunning the
+same command after an interruption only runs what is missing, and a grid can
+be extended without redoing the runs it already has. load_results() reads
+the whole directory back as one DataFrame.
+
+usage: python3 qkd_sweep.py sweep_out --engine batch --key-sizes 1024,65536 \\
+           --intercept 0,1 --loss 0,0.1 --repeats 5
+       python3 qkd_sweep.py sweep_out --engine qunetsim --key-sizes 16,32 --wait-time 0.5,2
+       python3 qkd_sweep.py sweep_out --summary
+"""
+
+import argparse
+import glob
+import hashlib
+import itertools
+import json
+import multiprocessing
+import os
+import time
+
+import numpy as np
+import pandas as pd
+
+from bb84_batch import check_channel
+
+try:
+    import pyarrow # noqa: F401 (pandas' Parquet engine)
+    HAVE_PARQUET = True
+except ImportError:
+    HAVE_PARQUET = False
+
+SWEEP_FLUSH_EVERY = 16 # finished runs per part file
+# Columns of every part, in order; 'error' is empty for successful runs
+RESULT_COLUMNS = ['run_id', 'engine', 'key_size', 'intercept', 'loss', 'wait_time', 'repeat', 'seed',
+                  'key_bits', 'n_sent', 'n_received', 'n_sifted', 'qber', 'wall_time_s', 'key_rate_bps', 'error']
+PARAM_COLUMNS = ['engine', 'key_size', 'intercept', 'loss', 'wait_time', 'repeat']
+TEXT_COLUMNS = ('run_id', 'engine', 'error')
+
+
+def run_id(params):
+    """Stable ID of one run: same parameters, same ID, across invocations."""
+    key = json.dumps([params[c] for c in PARAM_COLUMNS])
+    return hashlib.sha1(key.encode('utf-8')).hexdigest()[:16]
+
+
+def check_params(params):
+    """ValueError for a parameter point no engine can run (e.g. loss 1 would never sift a key)."""
+    if params['key_size'] <= 0:
+        raise ValueError(f"key size must be positive, got {params['key_size']}")
+    check_channel(params['intercept'], params['loss'])
+    if not 0.0 <= params['wait_time'] < float('inf'):
+        raise ValueError(f"wait time must be finite and non-negative, got {params['wait_time']}")
+
+
+def sweep_grid(engine, key_sizes, intercepts, losses, wait_times, repeats, seed=0):
+    """Parameter dicts of every run in the cross product, in a deterministic order."""
+    runs = []
+    for key_size, intercept, loss, wait_time, repeat in itertools.product(
+            key_sizes, intercepts, losses, wait_times, range(repeats)):
+        params = {'engine': engine, 'key_size': int(key_size), 'intercept': float(intercept),
+                  'loss': float(loss), 'wait_time': float(wait_time), 'repeat': repeat}
+        params['run_id'] = run_id(params)
+        # Per-run seed so a resumed sweep reproduces the runs it skipped
+        params['seed'] = (seed * 1000003 + int(params['run_id'], 16)) % (1 << 32)
+        runs.append(params)
+    return runs
+
+
+def run_one(params):
+    """Worker: one QKD run. Returns the result row as a dict (never raises)."""
+    row = dict.fromkeys(RESULT_COLUMNS)
+    row.update({k: params[k] for k in PARAM_COLUMNS + ['run_id', 'seed']})
+    row['error'] = ''
+    start = time.perf_counter()
+    try:
+        # Recorded as a failed run; an invalid point must not reach an engine that never returns
+        check_params(params)
+        if params['engine'] == 'batch':
+            import bb84_batch
+            result = bb84_batch.generate_sifted_key(params['key_size'], intercept=params['intercept'],
+                                                    loss=params['loss'], seed=params['seed'])
+            row.update(key_bits=len(result.alice_key), n_sent=result.n_sent, n_received=result.n_received,
+                       n_sifted=result.n_sifted, qber=result.qber)
+        else:
+            import contextlib
+            import io
+            import random
+            import QKD_sdn
+            QKD_sdn.wait_time = params['wait_time']
+            random.seed(params['seed'])
+            np.random.seed(params['seed'])
+            # The protocol prints every bit; keep the sweep's output readable
+            with contextlib.redirect_stdout(io.StringIO()):
+                alice_key, eve_key = QKD_sdn.run_qunetsim_qkd(params['key_size'], push=False)
+            n = min(len(alice_key), len(eve_key))
+            errors = sum(a != b for a, b in zip(alice_key, eve_key))
+            row.update(key_bits=len(alice_key), n_sent=np.nan, n_received=np.nan, n_sifted=len(alice_key),
+                       qber=errors / n if n else np.nan)
+    except Exception as e:
+        row['error'] = f'{type(e).__name__}: {e}'
+    row['wall_time_s'] = time.perf_counter() - start
+    if row['key_bits']:
+        row['key_rate_bps'] = row['key_bits'] / row['wall_time_s']
+    return row
+
+
+# ---------- columnar part files ----------
+def _part_paths(out_dir):
+    return sorted(glob.glob(os.path.join(out_dir, 'part-*.parquet')) + glob.glob(os.path.join(out_dir, 'part-*.npz')))
+
+
+def _read_part(path):
+    if path.endswith('.parquet'):
+        return pd.read_parquet(path)
+    with np.load(path, allow_pickle=False) as data:
+        return pd.DataFrame({c: data[c] for c in RESULT_COLUMNS if c in data.files})
+
+
+def load_results(out_dir):
+    """Every finished run of a sweep directory as one DataFrame (empty if none)."""
+    parts = [_read_part(p) for p in _part_paths(out_dir)]
+    if not parts:
+        return pd.DataFrame(columns=RESULT_COLUMNS)
+    return pd.concat(parts, ignore_index=True)
+
+
+def write_part(out_dir, rows, fmt):
+    """Writes rows as the next part file; atomic, so an interrupted sweep never leaves half a part."""
+    df = pd.DataFrame(rows, columns=RESULT_COLUMNS)
+    for c in RESULT_COLUMNS:
+        # Failed runs leave None in the metrics; keep every part's columns numeric
+        df[c] = df[c].astype(str) if c in TEXT_COLUMNS else pd.to_numeric(df[c])
+    existing = [os.path.basename(p).split('.')[0] for p in _part_paths(out_dir)]
+    index = max((int(name.split('-')[1]) for name in existing), default=-1) + 1
+    path = os.path.join(out_dir, f'part-{index:05d}.{fmt}')
+    tmp = path + '.tmp'
+    if fmt == 'parquet':
+        df.to_parquet(tmp, index=False)
+    else:
+        with open(tmp, 'wb') as f:
+            np.savez(f, **{c: df[c].to_numpy(dtype=str if c in TEXT_COLUMNS else None) for c in RESULT_COLUMNS})
+    os.replace(tmp, path)
+    return path
+
+
+def run_sweep(out_dir, runs, workers=None, flush_every=SWEEP_FLUSH_EVERY, fmt=None):
+    """Runs whatever of runs is not yet in out_dir. Returns (runs done now, runs skipped)."""
+    fmt = fmt or ('parquet' if HAVE_PARQUET else 'npz')
+    os.makedirs(out_dir, exist_ok=True)
+    results = load_results(out_dir)
+    # Failed runs are kept for the record but tried again
+    done = set(results['run_id'][results['error'] == ''])
+    todo = [r for r in runs if r['run_id'] not in done]
+    skipped = len(runs) - len(todo)
+    if not todo:
+        return 0, skipped
+    # QuNetSim keeps global state per process: one run per worker process
+    per_child = 1 if any(r['engine'] == 'qunetsim' for r in todo) else None
+    workers = workers or os.cpu_count() or 1
+    pending = []
+    finished = 0
+    start = time.perf_counter()
+    try:
+        with multiprocessing.Pool(workers, maxtasksperchild=per_child) as pool:
+            for row in pool.imap_unordered(run_one, todo):
+                pending.append(row)
+                finished += 1
+                if row['error']:
+                    print(f"[SWEEP] run {row['run_id']} failed: {row['error']}")
+                if len(pending) >= flush_every:
+                    write_part(out_dir, pending, fmt)
+                    pending = []
+                    elapsed = time.perf_counter() - start
+                    print(f"[SWEEP] {finished}/{len(todo)} runs, {elapsed:.1f}s, "
+                          f"{finished / elapsed:.1f} runs/s")
+    finally:
+        # Also on Ctrl-C: keep what finished, the rerun picks up the rest
+        if pending:
+            write_part(out_dir, pending, fmt)
+    return finished, skipped
+
+
+def summarize(df):
+    """Mean key rate, QBER and wall time per parameter point (repeats averaged)."""
+    ok = df[df['error'] == '']
+    group = [c for c in PARAM_COLUMNS if c != 'repeat']
+    return ok.groupby(group)[['key_rate_bps', 'qber', 'wall_time_s']].agg(['mean', 'std']).round(6)
+
+
+def _floats(text):
+    return [float(x) for x in text.split(',') if x]
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Run a resumable parallel sweep of QKD simulations.')
+    parser.add_argument('out_dir', help='sweep directory (columnar part files; rerun to resume)')
+    parser.add_argument('--engine', choices=['batch', 'qunetsim'], default='batch')
+    parser.add_argument('--key-sizes', default='16', help='comma-separated sifted key sizes in bits')
+    parser.add_argument('--intercept', default='0', help='eavesdropper intercept-resend probabilities (batch)')
+    parser.add_argument('--loss', default='0', help='channel loss probabilities (batch)')
+    parser.add_argument('--wait-time', default='2', help='QuNetSim wait_time values in seconds (qunetsim)')
+    parser.add_argument('--repeats', type=int, default=1)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--workers', type=int, default=None, help='processes (default: all cores)')
+    parser.add_argument('--flush-every', type=int, default=SWEEP_FLUSH_EVERY)
+    parser.add_argument('--format', choices=['parquet', 'npz'], default=None,
+                        help='part file format (default: parquet if pyarrow is installed)')
+    parser.add_argument('--summary', action='store_true', help='only print the summary of out_dir')
+    args = parser.parse_args()
+
+    if not args.summary:
+        if args.format == 'parquet' and not HAVE_PARQUET:
+            parser.error('--format parquet needs pyarrow')
+        if args.engine == 'qunetsim' and (any(_floats(args.intercept)) or any(_floats(args.loss))):
+            parser.error('the qunetsim engine models neither an eavesdropper nor channel loss; use --engine batch')
+        runs = sweep_grid(args.engine, [int(k) for k in args.key_sizes.split(',')], _floats(args.intercept),
+                          _floats(args.loss), _floats(args.wait_time), args.repeats, args.seed)
+        for params in runs:
+            try:
+                check_params(params)
+            except ValueError as e:
+                parser.error(str(e))
+        start = time.perf_counter()
+        ran, skipped = run_sweep(args.out_dir, runs, args.workers, args.flush_every, args.format)
+        print(f"[SWEEP] {ran} runs in {time.perf_counter() - start:.1f}s, {skipped} already in {args.out_dir}")
+    df = load_results(args.out_dir)
+    if len(df):
+        with pd.option_context('display.width', 160, 'display.max_rows', 200):
+            print(summarize(df))
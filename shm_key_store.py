@@ -0,0 +1,295 @@
+# -*- coding: utf-8 -*-
+"""
+QKD key store in a multiprocessing.shared_memory segment.
+
+Same interface as key_store.KeyStore, but the key material lives in shared
+memory so the key service (key_service.py) can ingest in its own process
+while the controller serves REQ_KEYs straight from the segment.
+
+Layout: a header with the store geometry and counters, a directory of
+SHM_KEY_SLOTS pair slots, then one ring of slot_bytes per slot. Each ring
+holds the bits of one (requester, peer) pair between two monotonically
+increasing bit counters: producers only ever advance tail_bits, the single
+consumer only ever advances head_bits, and every counter in the header has
+exactly one writing side. The consumer (the controller) therefore takes keys
+without any lock. Producers, which may be several processes, serialize per
+slot with fcntl byte-range locks on a lock file next to the segment.
+
+Unlike KeyStore, a full ring never evicts unread bits (the consumer owns the
+head): pushes beyond capacity are dropped and counted in bits_dropped, and
+pairs beyond SHM_KEY_SLOTS get no pool. KeyIngestServer checks free_bits()
+first, so binary producers see backpressure instead. Requester and peer names
+longer than SHM_NAME_BYTES (UTF-8) are rejected with ValueError.
+"""
+
+import fcntl
+import os
+import struct
+import tempfile
+import threading
+from contextlib import contextmanager
+from multiprocessing import shared_memory, resource_tracker
+
+from key_store import DEFAULT_PAIR
+
+SHM_KEY_STORE_NAME = 'qsdn_keys'
+SHM_KEY_SLOTS = 64 # (requester, peer) pairs, shared pool included
+SHM_KEY_SLOT_BYTES = 1024 * 1024 # ring size per pair (8 Mbit, as KEY_POOL_MAX_BITS)
+SHM_NAME_BYTES = 48 # requester / peer names, UTF-8, NUL padded
+
+MAGIC = b'QKDSHM01'
+# magic, slots, slot_bytes, then the counters: producer side first, consumer side after
+HEADER = struct.Struct('=8sII5Q')
+HEADER_SIZE = 128
+PRODUCER_COUNTERS = ('bits_pushed', 'bits_dropped')
+CONSUMER_COUNTERS = ('bits_served', 'requests_served', 'requests_failed')
+COUNTER_OFFSET = {name: 16 + 8 * i for i, name in enumerate(PRODUCER_COUNTERS + CONSUMER_COUNTERS)}
+# state (0 free, 1 in use), pad, head_bits, tail_bits, requester, peer
+SLOT = struct.Struct(f'=II QQ {SHM_NAME_BYTES}s{SHM_NAME_BYTES}s')
+SLOT_SIZE = 128
+HEAD_OFFSET = 8
+TAIL_OFFSET = 16
+U64 = struct.Struct('=Q') # native order: the segment never leaves this host
+
+
+def _lock_path(name):
+    return os.path.join(tempfile.gettempdir(), f'{name}.shm.lock')
+
+
+def _check_pair(pair):
+    """pair as a tuple; ValueError if a name does not fit a slot (it would never match its own slot)."""
+    pair = tuple(pair)
+    for name in pair:
+        if len(name.encode('utf-8')) > SHM_NAME_BYTES:
+            raise ValueError(f"key pool name {name[:16]!r}... is longer than {SHM_NAME_BYTES} bytes")
+    return pair
+
+
+class SharedKeyStore:
+    """
+    Per-pair bit rings in shared memory. Use create() in the owning process
+    and attach() everywhere else; only one process may call take().
+    """
+
+    def __init__(self, shm, owner):
+        self.shm = shm
+        self.buf = shm.buf
+        self.owner = owner
+        magic, self.slots, self.slot_bytes = struct.unpack_from('=8sII', self.buf, 0)
+        if magic != MAGIC:
+            raise ValueError(f"shared memory {shm.name!r} is not a key store")
+        self.capacity_bits = self.slot_bytes * 8
+        self.max_bits_per_pair = self.capacity_bits - 8
+        self.data_offset = HEADER_SIZE + self.slots * SLOT_SIZE
+        self._index = {} # pair -> slot, for the slots this process has seen
+        self._scanned = 0
+        self._lock_fd = os.open(_lock_path(shm.name), os.O_RDWR | os.O_CREAT, 0o600)
+        self._local_lock = threading.RLock() # fcntl locks do not exclude threads of one process
+
+    @classmethod
+    def create(cls, name=SHM_KEY_STORE_NAME, slots=SHM_KEY_SLOTS, slot_bytes=SHM_KEY_SLOT_BYTES):
+        """Creates the segment, replacing a stale one left by a crashed service."""
+        size = HEADER_SIZE + slots * (SLOT_SIZE + slot_bytes)
+        try:
+            shm = shared_memory.SharedMemory(name, create=True, size=size)
+        except FileExistsError:
+            stale = shared_memory.SharedMemory(name)
+            stale.close()
+            stale.unlink()
+            shm = shared_memory.SharedMemory(name, create=True, size=size)
+        shm.buf[:HEADER_SIZE + slots * SLOT_SIZE] = bytes(HEADER_SIZE + slots * SLOT_SIZE)
+        HEADER.pack_into(shm.buf, 0, MAGIC, slots, slot_bytes, 0, 0, 0, 0, 0)
+        return cls(shm, owner=True)
+
+    @classmethod
+    def attach(cls, name=SHM_KEY_STORE_NAME):
+        """Maps an existing segment; raises FileNotFoundError if the service is not running."""
+        shm = shared_memory.SharedMemory(name)
+        # The tracker would unlink the segment when this process exits; only the owner may
+        resource_tracker.unregister(shm._name, 'shared_memory')
+        return cls(shm, owner=False)
+
+    def close(self):
+        self.buf = None
+        self.shm.close()
+        os.close(self._lock_fd)
+        if self.owner:
+            self.shm.unlink()
+            try:
+                os.unlink(_lock_path(self.shm.name))
+            except FileNotFoundError:
+                pass
+
+    # ---------- shared counters ----------
+    def _get(self, offset):
+        return U64.unpack_from(self.buf, offset)[0]
+
+    def _set(self, offset, value):
+        U64.pack_into(self.buf, offset, value)
+
+    def _count(self, name, delta):
+        # Each counter has one writing side (producers under the directory lock, or the consumer)
+        self._set(COUNTER_OFFSET[name], self._get(COUNTER_OFFSET[name]) + delta)
+
+    @property
+    def counters(self):
+        return {name: self._get(offset) for name, offset in COUNTER_OFFSET.items()}
+
+    # ---------- directory ----------
+    def _slot_offset(self, slot):
+        return HEADER_SIZE + slot * SLOT_SIZE
+
+    def _scan(self):
+        """Indexes slots published since the last scan; slots are allocated in order and never freed."""
+        while self._scanned < self.slots:
+            state, _, _, _, requester, peer = SLOT.unpack_from(self.buf, self._slot_offset(self._scanned))
+            if state != 1:
+                break
+            pair = (requester.rstrip(b'\0').decode('utf-8'), peer.rstrip(b'\0').decode('utf-8'))
+            self._index[pair] = self._scanned
+            self._scanned += 1
+
+    def _find(self, pair):
+        slot = self._index.get(pair)
+        if slot is None:
+            self._scan()
+            slot = self._index.get(pair)
+        return slot
+
+    def _allocate(self, pair):
+        """Producer side: slot of pair, publishing a new one if needed; None when the directory is full."""
+        names = [name.encode('utf-8') for name in pair]
+        with self._locked(0):
+            slot = self._find(pair)
+            if slot is not None or self._scanned >= self.slots:
+                return slot
+            slot = self._scanned
+            offset = self._slot_offset(slot)
+            # Names and counters first; state=1 publishes the slot
+            SLOT.pack_into(self.buf, offset, 0, 0, 0, 0, names[0], names[1])
+            struct.pack_into('=I', self.buf, offset, 1)
+            self._scan()
+            return slot
+
+    @contextmanager
+    def _locked(self, index):
+        """Lock on byte index of the lock file: 0 guards the directory and producer counters, 1+i slot i."""
+        with self._local_lock:
+            fcntl.lockf(self._lock_fd, fcntl.LOCK_EX, 1, index)
+            try:
+                yield
+            finally:
+                fcntl.lockf(self._lock_fd, fcntl.LOCK_UN, 1, index)
+
+    # ---------- rings ----------
+    def _ring(self, slot):
+        start = self.data_offset + slot * self.slot_bytes
+        return self.buf[start:start + self.slot_bytes]
+
+    def _write(self, ring, byte_index, data):
+        first = min(len(data), self.slot_bytes - byte_index)
+        ring[byte_index:byte_index + first] = data[:first]
+        if first < len(data):
+            ring[:len(data) - first] = data[first:]
+
+    def _read(self, ring, byte_index, length):
+        end = byte_index + length
+        if end <= self.slot_bytes:
+            return bytes(ring[byte_index:end])
+        return bytes(ring[byte_index:]) + bytes(ring[:end - self.slot_bytes])
+
+    def put(self, data: bytes, n_bits: int, pair=DEFAULT_PAIR):
+        """Appends n_bits of packed key material to the ring of pair. Returns the new depth in bits."""
+        pair = _check_pair(pair)
+        slot = self._allocate(pair)
+        if slot is None:
+            with self._locked(0):
+                self._count('bits_dropped', n_bits)
+            return 0
+        offset = self._slot_offset(slot)
+        with self._locked(1 + slot):
+            head = self._get(offset + HEAD_OFFSET)
+            tail = self._get(offset + TAIL_OFFSET)
+            # One byte of slack keeps the padding of the last written byte off unread bits
+            if tail - head + n_bits > self.max_bits_per_pair:
+                with self._locked(0):
+                    self._count('bits_dropped', n_bits)
+                return tail - head
+            pos = tail % self.capacity_bits
+            rem = pos % 8
+            ring = self._ring(slot)
+            if rem == 0:
+                chunk = bytes(data[:(n_bits + 7) // 8])
+            else:
+                # Merge the new bits behind the partial byte at the tail
+                old = ring[pos // 8] >> (8 - rem)
+                new = int.from_bytes(data, 'big') >> (len(data) * 8 - n_bits)
+                total = rem + n_bits
+                pad = (-total) % 8
+                chunk = (((old << n_bits) | new) << pad).to_bytes((total + pad) // 8, 'big')
+            self._write(ring, pos // 8, chunk)
+            ring.release()
+            # Publish only after the bits are in place
+            self._set(offset + TAIL_OFFSET, tail + n_bits)
+            with self._locked(0):
+                self._count('bits_pushed', n_bits)
+            return tail + n_bits - head
+
+    def take(self, n_bits: int, pair=DEFAULT_PAIR):
+        """
+        Consumes exactly n_bits for pair, falling back to the shared pool.
+        Returns packed bytes or None if neither ring holds enough material.
+        Lock-free: only one process may take.
+        """
+        for candidate in (_check_pair(pair), DEFAULT_PAIR):
+            slot = self._find(candidate)
+            if slot is None or n_bits <= 0:
+                continue
+            offset = self._slot_offset(slot)
+            head = self._get(offset + HEAD_OFFSET)
+            if self._get(offset + TAIL_OFFSET) - head < n_bits:
+                continue
+            pos = head % self.capacity_bits
+            ring = self._ring(slot)
+            span = (pos % 8 + n_bits + 7) // 8
+            raw = self._read(ring, pos // 8, span)
+            ring.release()
+            if pos % 8 == 0 and n_bits % 8 == 0:
+                out = raw
+            else:
+                chunk = int.from_bytes(raw, 'big')
+                chunk >>= span * 8 - (pos % 8) - n_bits
+                chunk &= (1 << n_bits) - 1
+                pad = (-n_bits) % 8
+                out = (chunk << pad).to_bytes((n_bits + pad) // 8, 'big')
+            # Copied out before the head moves: producers may then overwrite the space
+            self._set(offset + HEAD_OFFSET, head + n_bits)
+            self._count('bits_served', n_bits)
+            self._count('requests_served', 1)
+            return out
+        self._count('requests_failed', 1)
+        return None
+
+    def depth(self, pair=DEFAULT_PAIR):
+        slot = self._find(_check_pair(pair))
+        if slot is None:
+            return 0
+        offset = self._slot_offset(slot)
+        return self._get(offset + TAIL_OFFSET) - self._get(offset + HEAD_OFFSET)
+
+    def free_bits(self, pair=DEFAULT_PAIR):
+        """Bits that can still be pushed for pair (0 for a new pair once every slot is taken)."""
+        pair = _check_pair(pair)
+        if self._find(pair) is None and self._scanned >= self.slots:
+            return 0
+        return self.max_bits_per_pair - self.depth(pair)
+
+    def stats(self):
+        """Counters plus the current depth (in bits) of every pool, as KeyStore.stats()."""
+        self._scan()
+        stats = self.counters
+        stats['pairs'] = len(self._index)
+        stats['pool_depth_bits'] = {f'{a}:{b}': self.depth((a, b)) for a, b in list(self._index)}
+        stats['total_depth_bits'] = sum(stats['pool_depth_bits'].values())
+        return stats
+
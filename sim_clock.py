@@ -0,0 +1,208 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+"""
+Virtual simulation clock for the satellite emulation.
+
+Modes:
+ - realtime: simulated time runs at `speed` simulated seconds per wall second;
+ - afap:     as fast as possible, wait_until() jumps straight to the requested time;
+ - step:     paused; STEP releases the next pending wait, STEP <sec> advances
+             the clock by that many simulated seconds.
+
+ClockServer exposes the clock on a local TCP socket, one command per line,
+one JSON reply per line:
+
+    TIME | PAUSE | RESUME | STEP [seconds] | SPEED <x> | MODE <realtime|afap|step>
+    -> {"time": 6000.0, "mode": "realtime", "speed": 60.0, "next_event": 6100.0}
+
+usage: python3 sim_clock.py [--port 7002] time|pause|resume|step [sec]|speed <x>|mode <m>
+"""
+
+import argparse
+import json
+import math
+import socket
+import socketserver
+import threading
+import time
+
+SIM_CLOCK_HOST = '127.0.0.1'
+SIM_CLOCK_PORT = 7002
+MODES = ('realtime', 'afap', 'step')
+
+
+def check_speed(speed):
+    """Returns speed as a float; raises ValueError unless it is finite and positive."""
+    speed = float(speed)
+    if not (math.isfinite(speed) and speed > 0):
+        raise ValueError(f"speed must be a finite positive number, got {speed!r}")
+    return speed
+
+
+class VirtualClock:
+    def __init__(self, mode='realtime', speed=1.0, start_time=0.0):
+        if mode not in MODES:
+            raise ValueError(f"unknown clock mode {mode!r}")
+        self.cond = threading.Condition()
+        self.mode = mode
+        self.speed = check_speed(speed)
+        self._sim_ref = float(start_time)
+        self._wall_ref = time.monotonic()
+        self._step_next = False # step mode: release the next wait_until()
+        self._resume_mode = mode if mode != 'step' else 'realtime'
+
+    def _now(self):
+        if self.mode == 'realtime':
+            return self._sim_ref + (time.monotonic() - self._wall_ref) * self.speed
+        return self._sim_ref
+
+    def _rebase(self):
+        self._sim_ref = self._now()
+        self._wall_ref = time.monotonic()
+
+    def now(self):
+        with self.cond:
+            return self._now()
+
+    def wait_until(self, sim_time):
+        """Blocks until the clock reaches sim_time; returns sim_time (or the current time if later)."""
+        with self.cond:
+            while True:
+                now = self._now()
+                if now >= sim_time:
+                    return now
+                if self.mode == 'afap':
+                    self._sim_ref = sim_time
+                    self._wall_ref = time.monotonic()
+                    return sim_time
+                if self.mode == 'realtime':
+                    self.cond.wait((sim_time - now) / self.speed)
+                    continue
+                # step mode
+                if self._step_next:
+                    self._step_next = False
+                    self._sim_ref = sim_time
+                    return sim_time
+                self.cond.wait()
+
+    def set_mode(self, mode):
+        if mode not in MODES:
+            raise ValueError(f"unknown clock mode {mode!r}")
+        with self.cond:
+            self._rebase()
+            if mode == 'step':
+                if self.mode != 'step':
+                    self._resume_mode = self.mode
+                self._step_next = False
+            self.mode = mode
+            self.cond.notify_all()
+
+    def set_speed(self, speed):
+        speed = check_speed(speed)
+        with self.cond:
+            self._rebase()
+            self.speed = speed
+            self.cond.notify_all()
+
+    def pause(self):
+        self.set_mode('step')
+
+    def resume(self):
+        self.set_mode(self._resume_mode)
+
+    def step(self, seconds=None):
+        """Pauses if needed, then releases the next event (seconds=None) or advances by seconds."""
+        if seconds is not None:
+            seconds = float(seconds)
+            if not (math.isfinite(seconds) and seconds >= 0):
+                raise ValueError(f"step must be a finite non-negative number of seconds, got {seconds!r}")
+        with self.cond:
+            if self.mode != 'step':
+                self._rebase()
+                self._resume_mode = self.mode
+                self.mode = 'step'
+            if seconds is None:
+                self._step_next = True
+            else:
+                # Events scheduled before the new time are released at once
+                self._sim_ref += seconds
+            self.cond.notify_all()
+
+    def state(self):
+        with self.cond:
+            return {'time': self._now(), 'mode': self.mode, 'speed': self.speed}
+
+
+class ClockServer:
+    """Serves a VirtualClock on a local TCP socket; next_event() adds the next scheduled event time."""
+
+    def __init__(self, clock, host=SIM_CLOCK_HOST, port=SIM_CLOCK_PORT, next_event=None):
+        self.clock = clock
+        self.next_event = next_event
+        server = self
+
+        class Handler(socketserver.StreamRequestHandler):
+            def handle(self):
+                for line in self.rfile:
+                    reply = server.command(line.decode('utf-8', errors='ignore'))
+                    self.wfile.write((json.dumps(reply) + '\n').encode('utf-8'))
+
+        socketserver.ThreadingTCPServer.allow_reuse_address = True
+        self.server = socketserver.ThreadingTCPServer((host, port), Handler)
+        self.server.daemon_threads = True
+        self.address = self.server.server_address[:2]
+
+    def command(self, line):
+        parts = line.split()
+        if not parts:
+            return {'error': 'empty command'}
+        cmd, args = parts[0].upper(), parts[1:]
+        try:
+            if cmd == 'PAUSE':
+                self.clock.pause()
+            elif cmd == 'RESUME':
+                self.clock.resume()
+            elif cmd == 'STEP':
+                self.clock.step(float(args[0]) if args else None)
+            elif cmd == 'SPEED':
+                self.clock.set_speed(float(args[0]))
+            elif cmd == 'MODE':
+                self.clock.set_mode(args[0].lower())
+            elif cmd != 'TIME':
+                return {'error': f'unknown command {cmd}'}
+        except (IndexError, ValueError) as e:
+            return {'error': str(e)}
+        state = self.clock.state()
+        state['next_event'] = self.next_event() if self.next_event is not None else None
+        return state
+
+    def start(self):
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        return self.address
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+def query_clock(host=SIM_CLOCK_HOST, port=SIM_CLOCK_PORT, command='TIME', timeout=1.0):
+    """Sends one command to a ClockServer and returns its JSON reply as a dict."""
+    with socket.create_connection((host, port), timeout=timeout) as s:
+        s.sendall((command + '\n').encode('utf-8'))
+        reply = b''
+        while not reply.endswith(b'\n'):
+            chunk = s.recv(4096)
+            if not chunk:
+                break
+            reply += chunk
+    return json.loads(reply.decode('utf-8'))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Query or control the emulation clock.')
+    parser.add_argument('--host', default=SIM_CLOCK_HOST)
+    parser.add_argument('--port', type=int, default=SIM_CLOCK_PORT)
+    parser.add_argument('command', nargs='*', default=['time'],
+                        help='time | pause | resume | step [sec] | speed <x> | mode <realtime|afap|step>')
+    args = parser.parse_args()
+    print(json.dumps(query_clock(args.host, args.port, ' '.join(args.command))))